@@ -88,3 +88,11 @@ if "data_source" in CONFIG:
     FILE_DOWNLOAD_PATH = CONFIG["data_source"]["file_download_path"]
     # ENFORCEMENT_FILE = CONFIG["data_source"]["enforcement_file"]
     USAGE_FILE = CONFIG["data_source"]["usage_file"]
+    # etags, last-modified dates and hashes of fetched files so unchanged releases are skipped
+    FETCH_STATE_PATH = CONFIG["data_source"].get("fetch_state_path") or os.path.join(FILE_DOWNLOAD_PATH, "fetch_state.json")
+    # parsed rows of each workbook keyed by its sha256 so archived releases skip the xlsx step
+    PARSE_CACHE_PATH = CONFIG["data_source"].get("parse_cache_path") or os.path.join(FILE_DOWNLOAD_PATH, "parse_cache")
+    # columnar numpy snapshot of each ingested release for analytics that skip the database
+    SNAPSHOT_PATH = CONFIG["data_source"].get("snapshot_path") or os.path.join(FILE_DOWNLOAD_PATH, "snapshot")
+    # token the usage ingest changes so views know to work out the latest release again
+    DATA_VERSION_PATH = CONFIG["data_source"].get("data_version_path") or os.path.join(FILE_DOWNLOAD_PATH, "data_version")
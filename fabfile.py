@@ -60,6 +60,41 @@ def fetch_water_use():
     local("python manage.py fetch_usage_stats")
 
 
+def fetch_releases():
+    """
+    download the past releases listed in the manifest into the data folder
+    """
+    local("python manage.py fetch_releases")
+
+
+def refresh_release_catalog():
+    """
+    catalog the workbooks in the data folder and list the ones not yet ingested
+    """
+    local("python manage.py refresh_release_catalog")
+
+
+def backfill_reports():
+    """
+    rebuild usage and enforcement data from the workbooks archived in the data folder
+    """
+    local("python manage.py backfill_reports")
+
+
+def supplier_aliases():
+    """
+    list the supplier name spellings held for review
+    """
+    local("python manage.py supplier_aliases")
+
+
+def export_report_snapshots():
+    """
+    write a columnar snapshot of every release in the database
+    """
+    local("python manage.py export_report_snapshots")
+
+
 # development functions
 def run():
     """
@@ -0,0 +1,198 @@
+from __future__ import division
+from monthly_water_reports.models import WaterSupplier, WaterSupplierAlias
+from fetch_methods import SupplierNameNormalizer
+from collections import OrderedDict, Counter
+import re
+import math
+import logging
+import datetime
+
+logger = logging.getLogger("cali_water_reports")
+
+class SupplierAliasIndex(object):
+    """
+    maps every spelling of a supplier name the state has published to the supplier we track
+    the alias table is read once per run so resolving a row is a dictionary lookup
+    and spellings we haven't seen are learned in bulk when the release is written
+    """
+
+    ngram_size = 3
+
+    # a new spelling this close to a supplier we track is held for review instead of
+    # becoming a supplier of its own, weighted so words every supplier shares count for little
+    suggestion_threshold = 0.85
+
+    numbers = re.compile(r"[0-9]+")
+
+    def __init__(self):
+        self.aliases = {}
+        self.suppliers = {}
+        self.ngram_index = {}
+        self.ngram_sets = {}
+        self.new_spellings = OrderedDict()
+        self.counts = Counter()
+
+
+    def _can_load(self):
+        """
+        read the alias table and the tracked suppliers into memory
+        """
+        self.aliases = {}
+        for raw_name, slug, name, skip, needs_review in WaterSupplierAlias.objects.values_list("raw_name", "supplier_slug", "supplier_name", "skip", "needs_review"):
+            self.aliases[raw_name] = {"supplier_slug": slug, "supplier_name": name, "skip": skip, "held": needs_review}
+        self.suppliers = {}
+        self.ngram_index = {}
+        self.ngram_sets = {}
+        for slug, name in WaterSupplier.objects.values_list("supplier_slug", "supplier_name"):
+            self._can_index_supplier(slug, name)
+        self.new_spellings = OrderedDict()
+        self.counts = Counter()
+
+
+    def _can_make_ngrams(self, name):
+        """
+        """
+        padded = " %s " % (name)
+        return set(padded[index:index + self.ngram_size] for index in range(len(padded) - self.ngram_size + 1))
+
+
+    def _can_index_supplier(self, slug, name):
+        """
+        add a supplier to the lookup and the ngram index used for suggestions
+        """
+        self.suppliers[slug] = name
+        grams = self._can_make_ngrams(name)
+        self.ngram_sets[slug] = grams
+        for gram in grams:
+            self.ngram_index.setdefault(gram, set()).add(slug)
+
+
+    def _can_suggest(self, name):
+        """
+        the tracked supplier whose name shares the most rare ngrams with this one as slug and score
+        a supplier whose name carries different numbers is a different district, not a spelling
+        """
+        grams = self._can_make_ngrams(name)
+        total = len(self.suppliers) + 1
+        weights = {}
+        shared = Counter()
+        for gram in grams:
+            candidates = self.ngram_index.get(gram, ())
+            weights[gram] = math.log(total / (len(candidates) + 1))
+            for slug in candidates:
+                shared[slug] += weights[gram]
+        name_weight = sum(weights.values())
+        numbers = self.numbers.findall(name)
+        best = (None, 0)
+        for slug, weight in shared.iteritems():
+            candidate_weight = sum(math.log(total / (len(self.ngram_index[gram]) + 1)) for gram in self.ngram_sets[slug])
+            score = 2 * weight / (name_weight + candidate_weight)
+            if score > best[1] and self.numbers.findall(self.suppliers[slug]) == numbers:
+                best = (slug, score)
+        return best
+
+
+    def _can_learn(self, raw_name, data):
+        """
+        decide where a spelling we haven't seen points, by way of an alias for its
+        pretty name or slug, a supplier we track, a close match to hold or a new supplier
+        """
+        formatted = {"supplier_name": data["supplier_name"], "supplier_slug": data["supplier_slug"]}
+        for key in (formatted["supplier_name"], formatted["supplier_slug"]):
+            if key != raw_name and key in self.aliases:
+                alias = dict(self.aliases[key])
+                break
+        else:
+            alias = {"supplier_slug": formatted["supplier_slug"], "supplier_name": formatted["supplier_name"], "skip": False, "held": False}
+            if formatted["supplier_slug"] in self.suppliers:
+                alias["supplier_name"] = self.suppliers[formatted["supplier_slug"]]
+            else:
+                suggested_slug, score = self._can_suggest(formatted["supplier_name"])
+                if score >= self.suggestion_threshold:
+                    alias.update({"supplier_slug": None, "supplier_name": None, "held": True, "suggested_slug": suggested_slug, "suggestion_score": round(score, 3)})
+                    logger.error("holding %s for review, it looks like %s (%.2f)" % (raw_name, suggested_slug, score))
+                else:
+                    self._can_index_supplier(formatted["supplier_slug"], formatted["supplier_name"])
+        self.aliases[raw_name] = alias
+        self.new_spellings[raw_name] = alias
+        return alias
+
+
+    def _can_resolve_rows_from(self, list_of_data):
+        """
+        point each parsed row at its canonical supplier, leaving out skipped suppliers
+        and spellings held for review
+        a row that changes is copied so the parsed rows can still be cached as they were read
+        """
+        resolved = []
+        for data in list_of_data:
+            raw_name = data.get("raw_supplier_name", data["supplier_name"])
+            alias = self.aliases.get(raw_name)
+            if alias is None:
+                alias = self._can_learn(raw_name, data)
+            if alias["skip"] == True:
+                self.counts["skipped"] += 1
+                continue
+            if alias["held"] == True:
+                self.counts["held"] += 1
+                continue
+            if data["supplier_slug"] != alias["supplier_slug"] or data["supplier_name"] != alias["supplier_name"]:
+                data = dict(data, supplier_slug=alias["supplier_slug"], supplier_name=alias["supplier_name"])
+            resolved.append(data)
+        self.counts["resolved"] += len(resolved)
+        return resolved
+
+
+    def _can_save_new_spellings(self):
+        """
+        store the spellings learned this run in one go and summarize the run
+        names differing only in case share a row since mysql compares them as equal
+        """
+        existing = set(raw_name.lower() for raw_name in WaterSupplierAlias.objects.values_list("raw_name", flat=True))
+        new_aliases = []
+        for raw_name, alias in self.new_spellings.iteritems():
+            if raw_name.lower() in existing:
+                continue
+            existing.add(raw_name.lower())
+            new_aliases.append(
+                WaterSupplierAlias(
+                    raw_name = raw_name,
+                    supplier_slug = alias["supplier_slug"],
+                    supplier_name = alias["supplier_name"],
+                    skip = alias["skip"],
+                    needs_review = alias["held"],
+                    suggested_slug = alias.get("suggested_slug"),
+                    suggestion_score = alias.get("suggestion_score"),
+                    created_date = datetime.datetime.now(),
+                )
+            )
+        WaterSupplierAlias.objects.bulk_create(new_aliases, batch_size=500)
+        summary = {
+            "resolved": self.counts["resolved"],
+            "skipped": self.counts["skipped"],
+            "held": self.counts["held"],
+            "learned": len(new_aliases),
+            "flagged": [dict(alias, raw_name=raw_name) for raw_name, alias in self.new_spellings.iteritems() if alias["held"] == True],
+        }
+        self.new_spellings = OrderedDict()
+        return summary
+
+
+    def _can_settle_alias(self, raw_name, accept=False, skip=False):
+        """
+        clear a held spelling, pointing it at the suggested supplier when accept is set,
+        leaving it out of ingests when skip is set and otherwise making it a supplier of its own
+        """
+        alias = WaterSupplierAlias.objects.get(raw_name=raw_name)
+        if accept == True:
+            alias.supplier_slug = alias.suggested_slug
+            alias.supplier_name = WaterSupplier.objects.get(supplier_slug=alias.suggested_slug).supplier_name
+        elif skip == True:
+            alias.skip = True
+        else:
+            formatted = SupplierNameNormalizer()._can_prettify_and_slugify(raw_name)
+            alias.supplier_slug = formatted["supplier_slug"]
+            alias.supplier_name = formatted["supplier_name"]
+        alias.needs_review = False
+        alias.save()
+        return alias
@@ -0,0 +1,207 @@
+from __future__ import division
+from django.conf import settings
+from django.db import connections, transaction
+from monthly_water_reports.fetch_usage_stats import BuildMonthlyWaterUseReport
+from monthly_water_reports.fetch_enforcement_stats import LoadMonthlyEnforcementStats
+from fetch_methods import MonthlyFormattingMethods
+from cache_methods import ParsedReleaseCache
+from catalog_methods import ReleaseCatalogMethods
+from alias_methods import SupplierAliasIndex
+from screening_methods import ReleaseScreeningMethods
+from snapshot_methods import ReportSnapshotMethods
+from release_methods import DataVersion
+import multiprocessing
+import glob
+import logging
+import time
+import datetime
+import os.path
+
+logger = logging.getLogger("cali_water_reports")
+
+def _can_parse_release_file(file_path):
+    """
+    parse one archived workbook, kept at module level so the process pool can pickle it
+    """
+    return BackfillMonthlyReports()._can_parse_release_file(file_path)
+
+
+class BackfillMonthlyReports(object):
+    """
+    scaffolding to rebuild the database from the workbooks in the data folder
+    """
+
+    data_path = settings.DATA_PATH
+
+    sluggy = MonthlyFormattingMethods()
+
+    usage = BuildMonthlyWaterUseReport()
+
+    enforcement = LoadMonthlyEnforcementStats()
+
+    catalog = ReleaseCatalogMethods()
+
+    aliases = SupplierAliasIndex()
+
+    screener = ReleaseScreeningMethods()
+
+    snapshot = ReportSnapshotMethods()
+
+    data_version = DataVersion()
+
+    def _init(self, *args, **kwargs):
+        """
+        parse the archived workbooks in parallel and write them to the database in one pass
+        pass pending to load only the cataloged releases that haven't been ingested
+        each usage release written is exported as a columnar snapshot
+        """
+        if kwargs.get("pending"):
+            files = self.catalog._can_find_pending_releases()
+        else:
+            files = kwargs.get("files") or self._can_find_release_files_in(kwargs.get("data_path") or self.data_path)
+        processes = kwargs.get("processes") or multiprocessing.cpu_count()
+        started = time.time()
+        releases = self._can_parse_release_files(files, processes)
+        parsed = time.time()
+        summary = self._can_save_releases_from(releases)
+        self.data_version._can_bump()
+        summary["parse_seconds"] = parsed - started
+        summary["write_seconds"] = time.time() - parsed
+        self._can_record_releases_in_catalog(releases, summary["write_seconds"])
+        report_dates = sorted(set(release["report_date"] for release in releases if release["usage"] and not release["error"]))
+        summary["snapshots"] = [manifest for manifest in (self.snapshot._can_export_release(report_date) for report_date in report_dates) if manifest]
+        return summary
+
+
+    def _can_record_releases_in_catalog(self, releases, write_seconds):
+        """
+        note each release that was written in the catalog
+        the single write is shared out between releases by their number of rows
+        """
+        ingested = [release for release in releases if not release["error"]]
+        total_rows = sum(len(release["usage"]) + len(release["enforcement"]) for release in ingested)
+        for release in ingested:
+            file_type = self.catalog._can_make_file_type_from(os.path.basename(release["file_path"]))
+            release_rows = len(release["usage"]) + len(release["enforcement"])
+            seconds = release["seconds"] + (write_seconds * release_rows / total_rows if total_rows else 0)
+            self.catalog._can_record_ingest(release["file_path"], file_type, len(release[file_type]), seconds)
+
+
+    def _can_find_release_files_in(self, data_path):
+        """
+        list the workbooks archived in the data folder
+        """
+        return sorted(glob.glob(os.path.join(data_path, "*.xlsx")))
+
+
+    def _can_parse_release_files(self, files, processes):
+        """
+        parse workbooks in a process pool and return them in release order
+        """
+        # forked workers must not inherit the parent's database connection
+        for connection in connections.all():
+            connection.close()
+        pool = multiprocessing.Pool(processes=processes)
+        try:
+            releases = pool.map(_can_parse_release_file, files, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        return sorted(releases, key=lambda release: (release["report_date"], release["file_path"]))
+
+
+    def _can_parse_release_file(self, file_path):
+        """
+        read a workbook into usage and enforcement rows without touching the database
+        newer usage workbooks carry the enforcement columns as well
+        """
+        file_name = os.path.basename(file_path)
+        started = time.time()
+        release = {"file_path": file_path, "report_date": None, "usage": [], "enforcement": [], "rejects": [], "error": None}
+        cache_before = [self.usage.normalizer._can_report_cache(), self.enforcement.normalizer._can_report_cache()]
+        parse_cache = ParsedReleaseCache()
+        try:
+            release["report_date"] = self.sluggy._can_create_datetime_from_filename(file_path)
+            is_enforcement_file = "enforcement" in file_name
+            usage_key = self.usage._can_make_cache_key_for(parse_cache, file_path, streaming=True)
+            enforcement_key = self.enforcement._can_make_cache_key_for(parse_cache, file_path, streaming=True)
+            usage = None if is_enforcement_file else parse_cache._can_load(usage_key)
+            enforcement = parse_cache._can_load(enforcement_key)
+            # the workbook is only read when something it holds isn't cached
+            if enforcement is None or (usage is None and not is_enforcement_file):
+                rows = list(self.sluggy._can_stream_excel_rows_from(file_path))
+                if usage is None and not is_enforcement_file:
+                    usage = self._can_parse_into_cache(parse_cache, usage_key, lambda rejects: self.usage._can_parse_rows_from(rows, file_path))
+                if enforcement is None and (is_enforcement_file or (rows and "Complaints Received" in rows[0])):
+                    enforcement = self._can_parse_into_cache(parse_cache, enforcement_key, lambda rejects: self.enforcement._can_parse_rows_from(rows, file_path, rejects=rejects))
+                elif enforcement is None:
+                    parse_cache._can_save(enforcement_key, None)
+                    enforcement = {"rows": None, "rejects": [], "error": None}
+            if usage is not None:
+                if usage["error"]:
+                    raise ValueError(usage["error"])
+                release["usage"] = self.usage._can_stamp_cached_rows(usage["rows"])
+            if enforcement["error"]:
+                raise ValueError(enforcement["error"])
+            release["enforcement"] = enforcement["rows"] or []
+            release["rejects"] = enforcement["rejects"]
+        except Exception, exception:
+            release["error"] = "%s %s" % (exception.__class__.__name__, exception)
+        cache_after = [self.usage.normalizer._can_report_cache(), self.enforcement.normalizer._can_report_cache()]
+        release["supplier_cache"] = {key: sum(after[key] - before[key] for before, after in zip(cache_before, cache_after)) for key in ("hits", "misses")}
+        release["parse_cache"] = parse_cache._can_report_cache()
+        release["seconds"] = time.time() - started
+        return release
+
+
+    def _can_parse_into_cache(self, parse_cache, cache_key, parse):
+        """
+        run a parser over the workbook and cache what it made or the error it raised
+        """
+        rejects = []
+        try:
+            payload = {"rows": parse(rejects), "rejects": rejects, "error": None}
+        except ValueError, exception:
+            payload = {"rows": [], "rejects": [], "error": str(exception)}
+        parse_cache._can_save(cache_key, payload["rows"], payload["rejects"], error=payload["error"])
+        return payload
+
+
+    def _can_save_releases_from(self, releases):
+        """
+        merge parsed releases oldest first so the outcome matches loading them one at a time
+        """
+        summary = {"files": len(releases), "skipped": [], "enforcement_rejects": 0, "supplier_cache": {"hits": 0, "misses": 0}, "parse_cache": {"hits": 0, "misses": 0}}
+        usage_rows = []
+        enforcement_rows = []
+        for release in releases:
+            for key in ("hits", "misses"):
+                summary["supplier_cache"][key] += release["supplier_cache"][key]
+                summary["parse_cache"][key] += release["parse_cache"][key]
+            if release["error"]:
+                logger.error("skipping %s: %s" % (os.path.basename(release["file_path"]), release["error"]))
+                summary["skipped"].append(release)
+                continue
+            usage_rows.extend(release["usage"])
+            enforcement_rows.extend(release["enforcement"])
+            for reject in release["rejects"]:
+                logger.error("rejected %s line %s: %s" % (os.path.basename(release["file_path"]), reject["line"], reject["error"]))
+            summary["enforcement_rejects"] += len(release["rejects"])
+        self.aliases._can_load()
+        usage_rows = self.aliases._can_resolve_rows_from(usage_rows)
+        enforcement_rows = self.aliases._can_resolve_rows_from(enforcement_rows)
+        usage_rows, summary["quarantine"] = self.screener._can_screen_release(usage_rows)
+        with transaction.atomic():
+            usage_summary = self.usage.bulky._can_bulk_save_release_from(usage_rows)
+            enforcement_summary = self.enforcement._save_enforcement_instances_from(enforcement_rows)
+            summary["aliases"] = self.aliases._can_save_new_spellings()
+        summary["usage_rows"] = len(usage_rows)
+        summary["enforcement_rows"] = len(enforcement_rows)
+        summary["created"] = usage_summary["created"]
+        summary["updated"] = usage_summary["updated"]
+        summary["new"] = usage_summary["new"]
+        summary["revised"] = usage_summary["revised"]
+        summary["unchanged"] = usage_summary["unchanged"]
+        summary["enforcement_created"] = enforcement_summary["created"]
+        summary["enforcement_updated"] = enforcement_summary["updated"]
+        return summary
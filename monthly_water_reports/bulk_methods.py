@@ -0,0 +1,395 @@
+from __future__ import division
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, When, Value, F
+from monthly_water_reports.models import WaterSupplier, WaterSupplierMonthlyReport
+from collections import OrderedDict, Counter
+import hashlib
+import logging
+import json
+import time
+import datetime
+
+logger = logging.getLogger("cali_water_reports")
+
+class BulkUpsertMethods(object):
+    """
+    scaffolding to write a release of monthly reports to the database in batches
+    """
+
+    batch_size = 500
+
+    staging_table = "%s_staging" % (WaterSupplierMonthlyReport._meta.db_table)
+
+    supplier_fields = [
+        "supplier_name",
+        "supplier_url",
+        "supplier_active",
+        "hydrologic_region",
+        "hydrologic_region_slug",
+        "created_date",
+        "supplier_notes",
+    ]
+
+    report_fields = [
+        "stage_invoked",
+        "mandatory_restrictions",
+        "total_monthly_potable_water_production_2014",
+        "total_monthly_potable_water_production_2013",
+        "units",
+        "qualification",
+        "total_population_served",
+        "reported_rgpcd",
+        "enforcement_actions",
+        "implementation",
+        "recycled_water",
+        "recycled_water_units",
+        "calculated_production_monthly_gallons_month_2014",
+        "calculated_production_monthly_gallons_month_2013",
+        "calculated_rgpcd_2014",
+        "percent_residential_use",
+        "production_gallons_2014",
+        "production_gallons_2013",
+        "residential_gallons_2014",
+        "residential_gallons_2013",
+        "days_in_month",
+        "comments_or_corrections",
+        "hydrologic_region",
+        "hydrologic_region_slug",
+    ]
+
+    def _can_chunk(self, list_of_items, size):
+        """
+        yield successive slices of a list that are no longer than size
+        """
+        for index in range(0, len(list_of_items), size):
+            yield list_of_items[index:index + size]
+
+
+    def _can_make_date_from(self, value):
+        """
+        datetimes and dates hash differently so reduce keys to a date
+        """
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        return value
+
+
+    def _can_find_new_suppliers_from(self, list_of_data, release):
+        """
+        note the water suppliers we haven't seen before and add them to the release's slug to supplier name map
+        """
+        supplier_names = release["supplier_names"]
+        for data in list_of_data:
+            slug = data["supplier_slug"]
+            if slug in supplier_names:
+                continue
+            values = {field: data[field] for field in self.supplier_fields}
+            release["new_suppliers"][slug] = WaterSupplier(supplier_slug=slug, **values)
+            supplier_names[slug] = values["supplier_name"]
+
+
+    def _can_fingerprint(self, values, fields=None):
+        """
+        a hash of a report's values so unchanged rows can be found without comparing every field
+        numbers are compared as floats and text as unicode so parsed and stored values agree
+        """
+        parts = []
+        for field in fields or self.report_fields:
+            value = values.get(field)
+            if isinstance(value, bool):
+                pass
+            elif isinstance(value, (int, long, float)):
+                value = float(value)
+            elif isinstance(value, datetime.date):
+                value = value.isoformat()
+            elif isinstance(value, str):
+                value = value.decode("utf-8")
+            parts.append(value)
+        return hashlib.sha1(json.dumps(parts)).hexdigest()
+
+
+    def _can_load_fingerprints_for(self, report_dates):
+        """
+        the stored fingerprints for each release in a batch and the release published before it
+        keyed on report_date then supplier_slug and reporting_month
+        """
+        stored_dates = set(WaterSupplierMonthlyReport.objects.order_by().values_list("report_date", flat=True).distinct())
+        all_dates = sorted(stored_dates | set(report_dates))
+        previous_dates = dict(zip(all_dates, [None] + all_dates[:-1]))
+        fingerprints = {report_date: {} for report_date in report_dates}
+        wanted_dates = set(report_dates) | set(previous_dates[report_date] for report_date in report_dates)
+        wanted_dates &= stored_dates
+        queryset = WaterSupplierMonthlyReport.objects.filter(report_date__in=wanted_dates).order_by("id")
+        for pk, slug, reporting_month, report_date, fingerprint in queryset.values_list("id", "supplier_slug", "reporting_month", "report_date", "fingerprint"):
+            fingerprints.setdefault(report_date, {}).setdefault((slug, reporting_month), (pk, fingerprint))
+        return fingerprints, previous_dates
+
+
+    def _can_begin_release(self, report_dates):
+        """
+        create the staging table and load what a release is compared against
+        the release that comes back is handed to each batch as it is staged and then merged
+        """
+        fingerprints, previous_dates = self._can_load_fingerprints_for(report_dates)
+        self._can_create_staging_table()
+        return {
+            "supplier_names": dict(WaterSupplier.objects.values_list("supplier_slug", "supplier_name")),
+            "new_suppliers": OrderedDict(),
+            "supplier_rows": Counter(),
+            "fingerprints": fingerprints,
+            "previous_dates": previous_dates,
+            "outcomes": {},
+            "changed_reports": OrderedDict(),
+            "carried_reports": OrderedDict((report_date, OrderedDict()) for report_date in sorted(report_dates)),
+            "counts": {"new": 0, "revised": 0, "unchanged": 0},
+            "rows": 0,
+        }
+
+
+    def _can_diff_reports_from(self, list_of_data, release):
+        """
+        sort a batch into new monthly reports, changes to the ones we have
+        and reports identical to the release before that can be copied forward in the database
+        keyed on supplier_slug, reporting_month and report_date
+        changes and copies are kept on the release, the new reports are returned to be staged
+        """
+        fingerprints = release["fingerprints"]
+        new_reports = []
+        # oldest release first so a release can be compared with one earlier in the same batch
+        for data in sorted(list_of_data, key=lambda data: data["report_date"]):
+            report_date = data["report_date"]
+            reporting_month = self._can_make_date_from(data["reporting_month"])
+            key = (data["supplier_slug"], reporting_month)
+            outcome_key = (data["supplier_slug"], reporting_month, self._can_make_date_from(report_date))
+            stored = fingerprints[report_date]
+            values = {field: data.get(field) for field in self.report_fields}
+            values["fingerprint"] = self._can_fingerprint(values)
+            if key in stored:
+                pk, fingerprint = stored[key]
+                if pk is None:
+                    continue
+                stored[key] = (None, values["fingerprint"])
+                if fingerprint == values["fingerprint"]:
+                    outcome = ("unchanged", None)
+                else:
+                    outcome = ("revised", "changed")
+                    release["changed_reports"][outcome_key] = (pk, values)
+            else:
+                stored[key] = (None, values["fingerprint"])
+                previous = fingerprints.get(release["previous_dates"][report_date], {}).get(key)
+                if previous is None:
+                    outcome = ("new", "staged")
+                elif previous[1] == values["fingerprint"] and previous[0] is not None:
+                    outcome = ("unchanged", "carried")
+                    release["carried_reports"][report_date][outcome_key] = previous[0]
+                else:
+                    outcome = ("unchanged" if previous[1] == values["fingerprint"] else "revised", "staged")
+                if outcome[1] == "staged":
+                    new_reports.append(
+                        WaterSupplierMonthlyReport(
+                            supplier_name_id = release["supplier_names"][data["supplier_slug"]],
+                            supplier_slug = data["supplier_slug"],
+                            reporting_month = reporting_month,
+                            report_date = report_date,
+                            **values
+                        )
+                    )
+            release["counts"][outcome[0]] += 1
+            release["outcomes"][outcome_key] = outcome
+            release["supplier_rows"][data["supplier_slug"]] += 1
+        return new_reports
+
+
+    def _can_stage_batch(self, release, list_of_data):
+        """
+        diff a batch of rows against the release and write its new and revised reports to the staging table
+        """
+        self._can_find_new_suppliers_from(list_of_data, release)
+        new_reports = self._can_diff_reports_from(list_of_data, release)
+        with transaction.atomic():
+            self._can_stage_reports(new_reports)
+        release["rows"] += len(list_of_data)
+
+
+    def _can_set_aside_reports(self, release, list_of_keys):
+        """
+        take rows back out of a staged release, such as the ones screening quarantined
+        keys are supplier_slug, reporting_month and report_date
+        """
+        quote_name = connection.ops.quote_name
+        unstaged = []
+        for slug, reporting_month, report_date in list_of_keys:
+            outcome_key = (slug, self._can_make_date_from(reporting_month), self._can_make_date_from(report_date))
+            outcome = release["outcomes"].pop(outcome_key, None)
+            if outcome is None:
+                continue
+            release["counts"][outcome[0]] -= 1
+            release["supplier_rows"][slug] -= 1
+            release["rows"] -= 1
+            if outcome[1] == "staged":
+                unstaged.append(outcome_key)
+            elif outcome[1] == "changed":
+                del release["changed_reports"][outcome_key]
+            elif outcome[1] == "carried":
+                del release["carried_reports"][outcome_key[2]][outcome_key]
+        if unstaged:
+            model = WaterSupplierMonthlyReport
+            fields = [model._meta.get_field(name) for name in ("supplier_slug", "reporting_month", "report_date")]
+            key_match = " AND ".join("%s = %%s" % (quote_name(field.column)) for field in fields)
+            connection.cursor().executemany(
+                "DELETE FROM %s WHERE %s" % (quote_name(self.staging_table), key_match),
+                [[field.get_db_prep_save(value, connection) for field, value in zip(fields, key)] for key in unstaged]
+            )
+        return len(unstaged)
+
+
+    def _can_finish_release(self, release):
+        """
+        copy forward what didn't change and merge the staged release into the live tables in one transaction
+        """
+        summary = dict(release["counts"])
+        new_suppliers = [supplier for slug, supplier in release["new_suppliers"].iteritems() if release["supplier_rows"][slug] > 0]
+        with transaction.atomic():
+            summary["carried"] = self._can_stage_carried_reports(OrderedDict((report_date, ids.values()) for report_date, ids in release["carried_reports"].iteritems()))
+            WaterSupplier.objects.bulk_create(new_suppliers, batch_size=self.batch_size)
+            for supplier in new_suppliers:
+                logger.debug("%s created: %s - %s" % (supplier.supplier_name, supplier.supplier_slug, supplier.hydrologic_region))
+            summary["created"] = self._can_merge_staged_reports()
+            summary["updated"] = self._can_bulk_update(WaterSupplierMonthlyReport, release["changed_reports"].values())
+        summary["rows"] = release["rows"]
+        return summary
+
+
+    def _can_create_staging_table(self):
+        """
+        a temporary table private to this connection shaped like the monthly reports
+        temporary tables don't end the transaction on mysql and work the same on sqlite
+        """
+        model = WaterSupplierMonthlyReport
+        quote_name = connection.ops.quote_name
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        columns = ", ".join(quote_name(field.column) for field in fields)
+        self._can_drop_staging_table()
+        connection.cursor().execute("CREATE TEMPORARY TABLE %s AS SELECT %s FROM %s WHERE 1 = 0" % (quote_name(self.staging_table), columns, quote_name(model._meta.db_table)))
+
+
+    def _can_stage_reports(self, list_of_reports):
+        """
+        write new monthly reports to the staging table
+        """
+        model = WaterSupplierMonthlyReport
+        quote_name = connection.ops.quote_name
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        columns = ", ".join(quote_name(field.column) for field in fields)
+        cursor = connection.cursor()
+        insert = "INSERT INTO %s (%s) VALUES (%s)" % (quote_name(self.staging_table), columns, ", ".join(["%s"] * len(fields)))
+        for chunk in self._can_chunk(list_of_reports, self.batch_size):
+            cursor.executemany(insert, [[field.get_db_prep_save(getattr(report, field.attname), connection) for field in fields] for report in chunk])
+
+
+    def _can_stage_carried_reports(self, carried_reports):
+        """
+        copy reports that didn't change since the last release into the staging table
+        under the new report_date without round tripping them through python
+        each release is a full snapshot so this still writes a row for every unchanged report
+        """
+        model = WaterSupplierMonthlyReport
+        quote_name = connection.ops.quote_name
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        columns = ", ".join(quote_name(field.column) for field in fields)
+        selected = ", ".join("%s" if field.name == "report_date" else quote_name(field.column) for field in fields)
+        report_date_field = model._meta.get_field("report_date")
+        cursor = connection.cursor()
+        copied = 0
+        for report_date, list_of_ids in carried_reports.iteritems():
+            for chunk in self._can_chunk(list_of_ids, self.batch_size):
+                cursor.execute(
+                    "INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s IN (%s)" % (
+                        quote_name(self.staging_table),
+                        columns,
+                        selected,
+                        quote_name(model._meta.db_table),
+                        quote_name(model._meta.pk.column),
+                        ", ".join(["%s"] * len(chunk)),
+                    ),
+                    [report_date_field.get_db_prep_save(report_date, connection)] + chunk
+                )
+                copied += len(chunk)
+        return copied
+
+
+    def _can_merge_staged_reports(self):
+        """
+        copy staged reports into the live table with one statement
+        rows another ingest added since the release was staged are left alone
+        """
+        model = WaterSupplierMonthlyReport
+        quote_name = connection.ops.quote_name
+        fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+        columns = ", ".join(quote_name(field.column) for field in fields)
+        staged_columns = ", ".join("staged.%s" % (quote_name(field.column)) for field in fields)
+        key_match = " AND ".join("live.%s = staged.%s" % (quote_name(column), quote_name(column)) for column in ("supplier_slug", "reporting_month", "report_date"))
+        cursor = connection.cursor()
+        cursor.execute(
+            "INSERT INTO %s (%s) SELECT %s FROM %s staged WHERE NOT EXISTS (SELECT 1 FROM %s live WHERE %s)" % (
+                quote_name(model._meta.db_table),
+                columns,
+                staged_columns,
+                quote_name(self.staging_table),
+                quote_name(model._meta.db_table),
+                key_match,
+            )
+        )
+        return cursor.rowcount
+
+
+    def _can_drop_staging_table(self):
+        """
+        mysql needs the temporary keyword so dropping the table doesn't commit
+        """
+        if connection.vendor == "mysql":
+            statement = "DROP TEMPORARY TABLE IF EXISTS %s"
+        else:
+            statement = "DROP TABLE IF EXISTS %s"
+        connection.cursor().execute(statement % (connection.ops.quote_name(self.staging_table)))
+
+
+    def _can_bulk_update(self, model, list_of_changes, size=None):
+        """
+        apply (pk, {field: value}) changes in chunks using one CASE expression per field
+        """
+        size = size or self.batch_size
+        updated = 0
+        for chunk in self._can_chunk(list_of_changes, size):
+            fields = set()
+            for pk, changes in chunk:
+                fields.update(changes.keys())
+            case_statements = {}
+            for field in fields:
+                output_field = model._meta.get_field(field)
+                whens = [When(pk=pk, then=Value(changes[field], output_field=output_field)) for pk, changes in chunk if field in changes]
+                case_statements[field] = Case(*whens, default=F(field), output_field=output_field)
+            updated += model.objects.filter(pk__in=[pk for pk, changes in chunk]).update(**case_statements)
+        return updated
+
+
+    def _can_bulk_save_release_from(self, list_of_data, suppliers_to_skip=[]):
+        """
+        stage a release of usage rows, then merge it into the live tables in one short transaction
+        so a build running alongside the ingest sees the release before or after, never half of it
+        only new and revised rows are built in python, unchanged rows are copied forward from
+        the previous release inside the database or left alone when the release is already stored
+        """
+        started = time.time()
+        list_of_data = [data for data in list_of_data if data["supplier_slug"] not in suppliers_to_skip]
+        try:
+            with transaction.atomic():
+                release = self._can_begin_release(sorted(set(data["report_date"] for data in list_of_data)))
+                self._can_stage_batch(release, list_of_data)
+                summary = self._can_finish_release(release)
+        finally:
+            self._can_drop_staging_table()
+        summary["seconds"] = time.time() - started
+        logger.debug("%(rows)s rows: %(new)s new, %(revised)s revised, %(unchanged)s unchanged, %(created)s created of which %(carried)s copied forward, %(updated)s updated" % summary)
+        return summary
@@ -0,0 +1,103 @@
+from __future__ import division
+from django.conf import settings
+from fetch_methods import MonthlyFormattingMethods
+import cPickle as pickle
+import hashlib
+import logging
+import zlib
+import os.path
+
+logger = logging.getLogger("cali_water_reports")
+
+class ParsedReleaseCache(object):
+    """
+    keeps the parsed rows of each workbook so archived releases can be ingested again without the xlsx step
+    """
+
+    # bump when the layout of a cache file changes
+    cache_format = 1
+
+    sluggy = MonthlyFormattingMethods()
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or getattr(settings, "PARSE_CACHE_PATH", None) or os.path.join(settings.FILE_DOWNLOAD_PATH, "parse_cache")
+        self.hits = 0
+        self.misses = 0
+        self.file_hashes = {}
+
+
+    def _can_make_cache_key(self, file_path, kind, *parser_inputs):
+        """
+        the workbook's sha256 plus a hash of whatever decides how it is parsed
+        so a change to the columns or the parser version misses the old entries
+        """
+        parser_hash = hashlib.sha1(repr((self.cache_format,) + parser_inputs)).hexdigest()[:12]
+        return "%s-%s-%s" % (kind, self._can_hash_file(file_path), parser_hash)
+
+
+    def _can_hash_file(self, file_path):
+        """
+        a workbook holding usage and enforcement rows is only hashed once
+        """
+        file_stat = os.stat(file_path)
+        file_key = (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime)
+        if file_key not in self.file_hashes:
+            self.file_hashes[file_key] = self.sluggy._can_hash_file(file_path)
+        return self.file_hashes[file_key]
+
+
+    def _can_get_cache_file(self, cache_key):
+        """
+        """
+        return os.path.join(self.cache_path, "%s.pickle.z" % (cache_key))
+
+
+    def _can_load(self, cache_key):
+        """
+        the rows and rejects stored for a key or None when there aren't any
+        an unreadable entry is removed and treated as a miss
+        """
+        cache_file = self._can_get_cache_file(cache_key)
+        if not os.path.isfile(cache_file):
+            self.misses += 1
+            return None
+        try:
+            with open(cache_file, "rb") as input_file:
+                payload = pickle.loads(zlib.decompress(input_file.read()))
+        except Exception, exception:
+            logger.error("discarding unreadable parse cache %s: %s" % (cache_file, exception))
+            os.remove(cache_file)
+            self.misses += 1
+            return None
+        self.hits += 1
+        if payload["rows"] is not None:
+            payload["rows"] = [dict(zip(payload["fields"], values)) for values in payload["rows"]]
+        return payload
+
+
+    def _can_save(self, cache_key, list_of_data, rejects=[], error=None):
+        """
+        rows are stored as one tuple each under a shared list of field names
+        pass None as list_of_data to remember a workbook has nothing of this kind
+        and an error to remember a workbook the parser can't read
+        """
+        fields = sorted(list_of_data[0].keys()) if list_of_data else []
+        payload = {
+            "fields": fields,
+            "rows": [tuple(data[field] for field in fields) for data in list_of_data] if list_of_data is not None else None,
+            "rejects": rejects,
+            "error": error,
+        }
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+        cache_file = self._can_get_cache_file(cache_key)
+        temporary_path = "%s.tmp.%s" % (cache_file, os.getpid())
+        with open(temporary_path, "wb") as output_file:
+            output_file.write(zlib.compress(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL), 1))
+        os.rename(temporary_path, cache_file)
+
+
+    def _can_report_cache(self):
+        """
+        """
+        return {"hits": self.hits, "misses": self.misses}
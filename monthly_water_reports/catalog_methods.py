@@ -0,0 +1,96 @@
+from __future__ import division
+from django.conf import settings
+from monthly_water_reports.models import ReleaseCatalog
+from fetch_methods import MonthlyFormattingMethods
+import glob
+import logging
+import datetime
+import os.path
+
+logger = logging.getLogger("cali_water_reports")
+
+class ReleaseCatalogMethods(object):
+    """
+    scaffolding to keep track of the releases archived in the data folder and which have been ingested
+    """
+
+    data_path = settings.DATA_PATH
+
+    sluggy = MonthlyFormattingMethods()
+
+    def _can_make_file_type_from(self, file_name):
+        """
+        standalone enforcement workbooks say so in their name, everything else leads with usage
+        """
+        if "enforcement" in file_name:
+            return "enforcement"
+        return "usage"
+
+
+    def _can_describe_release_file(self, file_path):
+        """
+        what the catalog records about a workbook, this is the one place its name is parsed
+        """
+        file_name = os.path.basename(file_path)
+        return {
+            "file_name": file_name,
+            "file_path": os.path.abspath(file_path),
+            "release_date": self.sluggy._can_create_datetime_from_filename(file_path),
+            "file_type": self._can_make_file_type_from(file_name),
+            "sha256": self.sluggy._can_hash_file(file_path),
+            "file_size": os.path.getsize(file_path),
+        }
+
+
+    def _can_refresh_catalog(self, data_path=None):
+        """
+        add new workbooks in the data folder, mark ones whose contents changed as not ingested
+        and drop entries for workbooks that are gone
+        """
+        data_path = os.path.abspath(data_path or self.data_path)
+        summary = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0, "skipped": []}
+        entries = {entry.file_name: entry for entry in ReleaseCatalog.objects.filter(file_path__startswith=data_path)}
+        seen = set()
+        for file_path in sorted(glob.glob(os.path.join(data_path, "*.xlsx"))):
+            try:
+                values = self._can_describe_release_file(file_path)
+            except Exception, exception:
+                logger.error("can't catalog %s: %s" % (os.path.basename(file_path), exception))
+                summary["skipped"].append({"file_path": file_path, "error": "%s %s" % (exception.__class__.__name__, exception)})
+                continue
+            seen.add(values["file_name"])
+            entry = entries.get(values["file_name"])
+            if entry is None:
+                ReleaseCatalog.objects.update_or_create(file_name=values["file_name"], defaults=values)
+                summary["added"] += 1
+            elif entry.sha256 != values["sha256"]:
+                values.update({"row_count": None, "ingested_date": None, "ingest_seconds": None, "cataloged_date": datetime.datetime.now()})
+                ReleaseCatalog.objects.filter(pk=entry.pk).update(**values)
+                summary["changed"] += 1
+            else:
+                summary["unchanged"] += 1
+        removed = [file_name for file_name in entries if file_name not in seen]
+        ReleaseCatalog.objects.filter(file_name__in=removed).delete()
+        summary["removed"] = len(removed)
+        return summary
+
+
+    def _can_record_ingest(self, file_path, file_type, row_count, seconds):
+        """
+        note that a workbook was ingested, a usage workbook that also carries
+        enforcement rows is only marked by the usage ingest
+        """
+        values = self._can_describe_release_file(file_path)
+        if values["file_type"] != file_type:
+            return None
+        values.update({"row_count": row_count, "ingested_date": datetime.datetime.now(), "ingest_seconds": seconds})
+        entry, created = ReleaseCatalog.objects.update_or_create(file_name=values["file_name"], defaults=values)
+        return entry
+
+
+    def _can_find_pending_releases(self):
+        """
+        paths to the cataloged workbooks that haven't been ingested, oldest release first
+        """
+        queryset = ReleaseCatalog.objects.filter(ingested_date__isnull=True).order_by("release_date", "file_name")
+        return list(queryset.values_list("file_path", flat=True))
@@ -1,10 +1,17 @@
 from __future__ import division
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.db.models import Q, Avg, Max, Min, Sum, Count
 from monthly_water_reports.models import WaterSupplier, WaterSupplierMonthlyReport, WaterEnforcementMonthlyReport
 from monthly_water_reports.views import QueryUtilities
-from fetch_methods import MonthlyFormattingMethods
+from fetch_methods import MonthlyFormattingMethods, SupplierNameNormalizer
+from bulk_methods import BulkUpsertMethods
+from timing_methods import StageTimer
+from cache_methods import ParsedReleaseCache
+from catalog_methods import ReleaseCatalogMethods
+from alias_methods import SupplierAliasIndex
+from release_methods import DataVersion
 import csv
 from csvkit.utilities.in2csv import In2CSV
 import re
@@ -48,80 +55,242 @@ class LoadMonthlyEnforcementStats(object):
         "Enforcement Comments",
     ]
 
-    suppliers_to_skip = [
-        "city-of-coalinga",
-        "mountain-house-community-services-district",
-        "cloverdale",
-        "",
+    columns = [
+        ("supplier_name", "supplier_name", "text"),
+        ("reporting_month", "reporting_month", "date"),
+        ("hydrologic_region", "hydrologic_region", "text"),
+        ("total_population_served", "total_population_served", "number"),
+        ("mandatory_restrictions", "mandatory_restrictions", "flag"),
+        ("water_days_allowed_week", "water_days_allowed_week", "number"),
+        ("complaints_received", "complaints_received", "number"),
+        ("follow_up_actions", "follow-up_actions", "number"),
+        ("warnings_issued", "warnings_issued", "number"),
+        ("penalties_assessed", "penalties_assessed", "number"),
+        ("enforcement_comments", "enforcement_comments", "text"),
+    ]
+
+    # the standalone enforcement workbooks label this column population served
+    header_aliases = {
+        "population_served": "total_population_served",
+    }
+
+    enforcement_fields = [
+        "reported_to_state_date",
+        "supplier_name",
+        "hydrologic_region",
+        "hydrologic_region_slug",
+        "enforcement_comments",
+        "mandatory_restrictions",
+        "total_population_served",
+        "supplier_id",
+        "water_days_allowed_week",
+        "complaints_received",
+        "follow_up_actions",
+        "warnings_issued",
+        "penalties_assessed",
     ]
 
     sluggy = MonthlyFormattingMethods()
 
+    normalizer = SupplierNameNormalizer()
+
+    bulky = BulkUpsertMethods()
+
+    # bump when a change to parsing should invalidate cached releases
+    parser_version = 2
+
+    catalog = ReleaseCatalogMethods()
+
+    aliases = SupplierAliasIndex()
+
+    data_version = DataVersion()
+
     def _init(self, *args, **kwargs):
         """
         begin the process of downloading the latest state water control board usage report
+        pass local_file to ingest a workbook already on disk and streaming to read
+        the workbook directly instead of converting it to csv
+        a download that matches the last ingested release is skipped unless force is set
+        pass a StageTimer as timer to collect timings for each stage of the run
+        each ingest is noted in the release catalog and bumps the data version
         """
-        self.sluggy._can_write_excel_file_from(self.file_name, self.excel_file_url, self.file_download_excel_path)
-        self.sluggy._can_convert_excel_file_to(self.file_name, self.file_created_csv_path, self.file_download_excel_path)
-        self._can_build_model_instance(self.file_created_csv_path)
-        try:
-            shutil.move(self.file_download_excel_path, self.data_path)
-            shutil.move(self.file_created_csv_path, self.data_path)
-        except:
-            logger.debug("file already exists in data folder")
-            logger.debug("moving %s" % (self.file_name))
-            if os.path.exists("%s/%s" % (self.data_path, self.file_name)):
-                os.remove("%s/%s" % (self.data_path, self.file_name))
-                shutil.move(self.file_download_excel_path, self.data_path)
-            logger.debug("moving %s" % (os.path.basename(self.file_created_csv_path)))
-            if os.path.exists("%s/%s" % (self.data_path, os.path.basename(self.file_created_csv_path))):
-                os.remove("%s/%s" % (self.data_path, os.path.basename(self.file_created_csv_path)))
-                shutil.move(self.file_created_csv_path, self.data_path)
-
-
-    def _can_build_model_instance(self, file_created_csv_path):
+        local_file = kwargs.get("local_file", None)
+        streaming = kwargs.get("streaming", False)
+        force = kwargs.get("force", False)
+        timer = kwargs.get("timer", None) or StageTimer()
+        started = time.time()
+        if local_file:
+            file_name = os.path.basename(local_file)
+            file_download_excel_path = local_file
+            file_created_csv_path = "%s/%s" % (settings.FILE_DOWNLOAD_PATH, file_name.replace(".xlsx", ".csv"))
+        else:
+            file_name = self.file_name
+            file_download_excel_path = self.file_download_excel_path
+            file_created_csv_path = self.file_created_csv_path
+            with timer._can_time_stage("download"):
+                fetch = self.sluggy._can_write_excel_file_from(file_name, self.excel_file_url, file_download_excel_path, state_key="enforcement", force=force)
+            if fetch["changed"] == False:
+                logger.debug("skipping %s because it has not changed since it was last ingested" % (file_name))
+                return {"rows": 0, "unchanged_release": True}
+        cache = kwargs.get("cache", None) or ParsedReleaseCache()
+        with timer._can_time_stage("cache") as stage:
+            cache_key = self._can_make_cache_key_for(cache, file_download_excel_path, streaming)
+            cached = cache._can_load(cache_key)
+            stage["rows"] = len(cached["rows"]) if cached and cached["rows"] is not None else None
+        # a cached parse error is read again so it is raised with its traceback
+        if cached and cached["error"] is None:
+            if cached["rows"] is None:
+                raise ValueError("%s has no enforcement columns" % (file_name))
+            logger.debug("using the parsed rows cached for %s" % (file_name))
+            summary = self._can_write_release_from(cached["rows"], cached["rejects"], timer=timer)
+        elif streaming == True:
+            rows = timer._can_time_rows("read", self.sluggy._can_stream_excel_rows_from(file_download_excel_path), within="parse")
+            summary = self._can_build_model_instance(rows, file_download_excel_path, timer=timer, cache=cache, cache_key=cache_key)
+        else:
+            with timer._can_time_stage("convert"):
+                self.sluggy._can_convert_excel_file_to(file_name, file_created_csv_path, file_download_excel_path)
+            rows = timer._can_time_rows("read", self.sluggy._can_read_csv_rows_from(file_created_csv_path), within="parse")
+            summary = self._can_build_model_instance(rows, file_created_csv_path, timer=timer, cache=cache, cache_key=cache_key)
+        summary["parse_cache"] = cache._can_report_cache()
+        # suppliers and enforcement reports are committed, so anything cached from them is stale
+        self.data_version._can_bump()
+        if not local_file:
+            self.sluggy._can_archive_file_to(file_download_excel_path, self.data_path)
+            if os.path.isfile(file_created_csv_path):
+                self.sluggy._can_archive_file_to(file_created_csv_path, self.data_path)
+            self.sluggy._can_save_fetch_state(fetch)
+        self.catalog._can_record_ingest(local_file or os.path.join(self.data_path, file_name), "enforcement", summary["rows"], time.time() - started)
+        return summary
+
+
+    def _can_make_cache_key_for(self, cache, file_path, streaming=False):
+        """
+        csv and streamed reads are cached apart since In2CSV formats some cells differently
+        """
+        kind = "enforcement-stream" if streaming == True else "enforcement-csv"
+        return cache._can_make_cache_key(file_path, kind, self.parser_version, self.columns, self.list_of_expected_keys, self.header_aliases)
+
+
+    def _can_build_model_instance(self, rows, file_path, timer=None, cache=None, cache_key=None):
+        """
+        builds data for database from rows read out of a csv or excel file
+        rows that can't be converted are set aside in summary["rejects"]
+        the parsed rows are kept in the parse cache when a cache_key is passed
+        """
+        timer = timer or StageTimer()
+        started = time.time()
+        rejects = []
+        with timer._can_time_stage("parse") as stage:
+            list_of_data = self._can_parse_rows_from(rows, file_path, timer=timer, rejects=rejects)
+            stage["rows"] = len(list_of_data)
+        if cache_key is not None:
+            with timer._can_time_stage("cache"):
+                cache._can_save(cache_key, list_of_data, rejects)
+        return self._can_write_release_from(list_of_data, rejects, timer=timer, started=started)
+
+
+    def _can_write_release_from(self, list_of_data, rejects, timer=None, started=None):
+        """
+        write parsed enforcement rows and summarize the run
+        supplier names are resolved through the alias table first
+        """
+        timer = timer or StageTimer()
+        started = started or time.time()
+        with timer._can_time_stage("resolve") as stage:
+            self.aliases._can_load()
+            list_of_data = self.aliases._can_resolve_rows_from(list_of_data)
+            stage["rows"] = len(list_of_data)
+        with timer._can_time_stage("write") as stage:
+            summary = self._save_enforcement_instances_from(list_of_data)
+            stage["rows"] = len(list_of_data)
+        summary["aliases"] = self.aliases._can_save_new_spellings()
+        summary["rows"] = len(list_of_data)
+        summary["seconds"] = time.time() - started
+        summary["supplier_cache"] = self.normalizer._can_report_cache()
+        summary["rejects"] = rejects
+        return summary
+
+
+    def _can_parse_rows_from(self, rows, file_path, timer=None, rejects=None):
+        """
+        turn the rows of a release into dictionaries ready for the database
+        no queries are made here so it is safe to run in a worker process
+        pass a list as rejects to collect rows that can't be converted instead of raising
+        """
+        list_of_data = []
+        report_date = self.sluggy._can_create_datetime_from_filename(file_path)
+        region_slugs = {}
+        normalize_seconds = 0
+        schema = None
+        # the header is line one of the worksheet
+        for line, row in enumerate(rows, 2):
+            if timer is not None:
+                timer._can_tick("parse")
+            if schema is None:
+                schema = self.sluggy._can_compile_row_schema(row.keys(), self.list_of_expected_keys, self.columns, header_aliases=self.header_aliases)
+            try:
+                values = self.sluggy._can_apply_row_schema(schema, row)
+            except Exception, exception:
+                if rejects is None:
+                    raise
+                rejects.append({"line": line, "error": "%s %s" % (exception.__class__.__name__, exception), "row": row})
+                continue
+            normalize_started = time.time()
+            supplier_formatted = self.normalizer._can_normalize(values.supplier_name)
+            if values.hydrologic_region not in region_slugs:
+                region_slugs[values.hydrologic_region] = self.sluggy._can_create_hydrologic_region_slug(values.hydrologic_region)
+            normalize_seconds += time.time() - normalize_started
+            data = dict(zip(values._fields, values))
+            data.update({
+                "raw_supplier_name": values.supplier_name,
+                "supplier_slug": supplier_formatted["supplier_slug"],
+                "supplier_name": supplier_formatted["supplier_name"],
+                "reporting_month": values.reporting_month.replace(day=1),
+                "report_date": report_date,
+                "reported_to_state_date": values.reporting_month,
+                "hydrologic_region_slug": region_slugs[values.hydrologic_region],
+                "supplier_id": None,
+            })
+            list_of_data.append(data)
+        if timer is not None:
+            timer._can_add_to_stage("normalize", normalize_seconds, rows=len(list_of_data), within="parse")
+        return list_of_data
+
+
+    def _save_enforcement_instances_from(self, list_of_data):
         """
-        builds data for database from csv file
+        insert new enforcement reports and update the ones whose fingerprint changed
+        keyed on supplier_slug and reporting_month, a later row for the same key wins
         """
-        with open(file_created_csv_path, "rb") as csvfile:
-            csv_data = csv.DictReader(csvfile, delimiter=',')
-            for row in csv_data:
-                clean_row = {re.sub(r"\([^)]*\)", "", k).strip().replace("- ", "").replace(" ", "_").replace("/", "_").lower(): v.strip() for k, v in row.iteritems()}
-                supplier_formatted = self.sluggy._can_prettify_and_slugify_string(clean_row["supplier_name"])
-                clean_row["report_date"] = self.sluggy._can_create_datetime_from_filename(file_created_csv_path)
-                clean_row["supplier_name"] = supplier_formatted["supplier_name"]
-                clean_row["supplier_slug"] = supplier_formatted["supplier_slug"]
-                try:
-                    if clean_row["supplier_slug"] in self.suppliers_to_skip:
-                        pass
+        summary = {"created": 0, "updated": 0, "unchanged": 0}
+        releases = OrderedDict()
+        for data in list_of_data:
+            releases[(data["supplier_slug"], self.bulky._can_make_date_from(data["reporting_month"]))] = data
+        with transaction.atomic():
+            existing_reports = {}
+            queryset = WaterEnforcementMonthlyReport.objects.filter(reporting_month__in=set(month for slug, month in releases)).order_by("id")
+            for pk, slug, reporting_month, fingerprint in queryset.values_list("id", "supplier_slug", "reporting_month", "fingerprint"):
+                existing_reports.setdefault((slug, reporting_month), (pk, fingerprint))
+            new_reports = []
+            changed_reports = []
+            for key, data in releases.iteritems():
+                values = {field: self.bulky._can_make_date_from(data[field]) for field in self.enforcement_fields}
+                values["fingerprint"] = self.bulky._can_fingerprint(values, self.enforcement_fields)
+                if key in existing_reports:
+                    pk, fingerprint = existing_reports[key]
+                    if fingerprint != values["fingerprint"]:
+                        changed_reports.append((pk, values))
                     else:
-                        clean_row["reporting_month"] = self.sluggy._can_make_string_to_datetime(clean_row["reporting_month"])
-                        obj, created = WaterEnforcementMonthlyReport.objects.get_or_create(
-                            supplier_slug = clean_row["supplier_slug"],
-                            reporting_month = clean_row["reporting_month"].replace(day=1),
-                            defaults = {
-                                "reported_to_state_date": clean_row["reporting_month"],
-                                "supplier_name": clean_row["supplier_name"],
-                                "hydrologic_region": clean_row["hydrologic_region"],
-                                "hydrologic_region_slug": self.sluggy._can_create_hydrologic_region_slug(clean_row["hydrologic_region"]),
-                                "enforcement_comments": clean_row["enforcement_comments"],
-                                "mandatory_restrictions": clean_row["mandatory_restrictions"],
-                                "total_population_served": self.sluggy._can_convert_str_to_num(clean_row["total_population_served"])["value"],
-                                "supplier_id": None,
-                                "water_days_allowed_week": self.sluggy._can_convert_str_to_num(clean_row["water_days_allowed_week"])["value"],
-                                "complaints_received": self.sluggy._can_convert_str_to_num(clean_row["complaints_received"])["value"],
-                                "follow_up_actions": self.sluggy._can_convert_str_to_num(clean_row["follow-up_actions"])["value"],
-                                "warnings_issued": self.sluggy._can_convert_str_to_num(clean_row["warnings_issued"])["value"],
-                                "penalties_assessed": self.sluggy._can_convert_str_to_num(clean_row["penalties_assessed"])["value"],
-                            }
-                        )
-                        if created:
-                            logger.debug("%s - %s created" % (clean_row["reporting_month"], clean_row["supplier_name"]))
-                        else:
-                            logger.debug("%s - %s updated" % (clean_row["reporting_month"], clean_row["supplier_name"]))
-                except ObjectDoesNotExist, exception:
-                    logger.error("%s-%s" % (exception, clean_row["supplier_name"]))
-                    break
+                        summary["unchanged"] += 1
+                else:
+                    new_reports.append(WaterEnforcementMonthlyReport(supplier_slug=key[0], reporting_month=key[1], **values))
+            WaterEnforcementMonthlyReport.objects.bulk_create(new_reports, batch_size=self.bulky.batch_size)
+            summary["created"] = len(new_reports)
+            summary["updated"] = self.bulky._can_bulk_update(WaterEnforcementMonthlyReport, changed_reports)
+        summary["new"] = summary["created"]
+        summary["revised"] = summary["updated"]
+        logger.debug("%s enforcement rows: %s created, %s updated, %s unchanged" % (len(list_of_data), summary["created"], summary["updated"], summary["unchanged"]))
+        return summary
 
 
 if __name__ == '__main__':
@@ -3,39 +3,283 @@ from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 import csv
 from csvkit.utilities.in2csv import In2CSV
+from openpyxl import load_workbook
 import re
 import logging
 import time
 import datetime
+import calendar
 import requests
+import hashlib
+import socket
+import json
 from dateutil import parser
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import sys
 import os.path
+import shutil
 
 logger = logging.getLogger("cali_water_reports")
 
+class SupplierNameNormalizer(object):
+    """
+    turns the supplier names published by the state into a pretty name and a slug
+    the same few hundred names appear in every release so results are kept in a
+    bounded least recently used cache
+    """
+
+    non_name_characters = re.compile(r"[^0-9a-zA-Z\s-]+")
+
+    non_slug_characters = re.compile(r"[^a-z0-9]+")
+
+    repeated_dashes = re.compile(r"[-]+")
+
+    def __init__(self, suppliers_to_skip=[], maxsize=2048):
+        self.suppliers_to_skip = set(suppliers_to_skip)
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def _can_normalize(self, string):
+        """
+        the pretty name, slug and whether to skip a supplier, from the cache when we can
+        """
+        try:
+            output = self.cache.pop(string)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            output = self._can_prettify_and_slugify(string)
+            output["skip"] = output["supplier_slug"] in self.suppliers_to_skip
+            if len(self.cache) >= self.maxsize:
+                self.cache.popitem(last=False)
+        self.cache[string] = output
+        return output
+
+
+    def _can_prettify_and_slugify(self, string):
+        """
+        move a trailing city of or town of to the front and build a slug from the result
+        """
+        value = self.non_name_characters.sub(" ", string.lower())
+        for place in ("city of", "town of"):
+            if place[:4] in value:
+                if not value.startswith(place) and place in value:
+                    value = "%s %s" % (place, value.split(place)[0].strip())
+                break
+        pretty_name = " ".join(value.split())
+        slug = pretty_name.encode("ascii", "ignore").lower()
+        slug = self.non_slug_characters.sub("-", slug).strip("-")
+        slug = self.repeated_dashes.sub("-", slug)
+        return {"supplier_slug": slug, "supplier_name": pretty_name}
+
+
+    def _can_report_cache(self):
+        """
+        how much work the cache saved
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache)}
+
+
 class MonthlyFormattingMethods(object):
     """
     scaffolding used when dealing with state water board data
     """
 
-    def _can_write_excel_file_from(self, file_name, excel_file_url, file_download_excel_path):
+    download_chunk_size = 64 * 1024
+
+    download_attempts = 5
+
+    download_retry_delay = 2
+
+    download_timeout = 60
+
+    iso_date = re.compile(r"^\s*([0-9]{4})-([0-9]{2})-([0-9]{2})(?:[T ]([0-9]{2}):([0-9]{2}):([0-9]{2}))?\s*$")
+
+    us_date = re.compile(r"^\s*([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})\s*$")
+
+    # a month as excel displays it, such as Aug-14 or Dec 2016, a two digit year only after a hyphen
+    month_year = re.compile(r"^\s*([A-Za-z]{3})[a-z]*\.?(?:-([0-9]{2})|[- /]([0-9]{4}))\s*$")
+
+    month_numbers = {name.lower(): number for number, name in enumerate(calendar.month_abbr) if name}
+
+    # dateutil fills in what a string leaves out from its default, and returns the default itself
+    # for a blank string, so a string that parses differently against each of these is missing part
+    # of the date, and one whose year and month still agree is a month
+    fill_in_dates = (datetime.datetime(2000, 1, 1), datetime.datetime(2001, 2, 2))
+
+    parsed_dates_maxsize = 1024
+
+    # one normalizer shared by every instance so _can_prettify_and_slugify_string keeps its cache
+    normalizer = SupplierNameNormalizer()
+
+    row_converters = {
+        "text": "_can_make_text_from",
+        "upper": "_can_make_upper_text_from",
+        "flag": "_can_make_flag_from",
+        "number": "_can_make_number_from",
+        "percent": "_can_make_percent_from",
+        "date": "_can_make_string_to_datetime",
+    }
+
+    def __init__(self):
+        # dates this instance has parsed, bounded like the supplier name cache
+        self.parsed_dates = OrderedDict()
+
+    def _can_write_excel_file_from(self, file_name, excel_file_url, file_download_excel_path, state_key=None, force=False):
         """
         can I write an excel file from url
+        sends the etag and last-modified we saw last time and compares a sha256 of the
+        content so an unchanged release comes back with changed set to False
+        the workbook is streamed to a partial file and only renamed into place once complete
         """
+        state_key = state_key or excel_file_url
+        previous = {}
+        if force == False:
+            previous = self._can_load_fetch_state().get(state_key, {})
+        headers = dict(settings.REQUEST_HEADERS)
+        if previous.get("url") == excel_file_url:
+            if previous.get("etag"):
+                headers["If-None-Match"] = previous["etag"]
+            if previous.get("last_modified"):
+                headers["If-Modified-Since"] = previous["last_modified"]
+        fetch = {
+            "state_key": state_key,
+            "url": excel_file_url,
+            "etag": previous.get("etag"),
+            "last_modified": previous.get("last_modified"),
+            "sha256": previous.get("sha256"),
+            "changed": False,
+        }
+        partial_path = "%s.part" % (file_download_excel_path)
         try:
             logger.debug("Requesting %s" % (file_name))
-            response = requests.get(excel_file_url, headers=settings.REQUEST_HEADERS)
-            with open(file_download_excel_path, "w+", buffering=-1) as output_file:
-                output_file.write(response.content)
-                excel_file_exists = os.path.isfile(file_download_excel_path)
-                excel_file_size = os.path.getsize(file_download_excel_path)
-                if excel_file_exists == True and excel_file_size > 0:
-                    logger.debug("Success!")
+            if os.path.isfile(partial_path):
+                os.remove(partial_path)
+            download = self._can_stream_download_to(partial_path, excel_file_url, headers)
+            if download["status_code"] == 304:
+                logger.debug("%s has not changed since it was last fetched" % (file_name))
+                return fetch
+            fetch["etag"] = download["etag"]
+            fetch["last_modified"] = download["last_modified"]
+            sha256 = self._can_hash_file(partial_path)
+            if sha256 == previous.get("sha256"):
+                logger.debug("%s matches the release that was already ingested" % (file_name))
+                os.remove(partial_path)
+                self._can_save_fetch_state(fetch)
+                return fetch
+            fetch["sha256"] = sha256
+            fetch["changed"] = True
+            os.rename(partial_path, file_download_excel_path)
+            logger.debug("Success!")
         except Exception, exception:
             logger.error(exception)
+            if os.path.isfile(partial_path):
+                os.remove(partial_path)
             raise
+        return fetch
+
+
+    def _can_stream_download_to(self, partial_path, url, headers, session=None):
+        """
+        write a url to disk in chunks, picking up where the last attempt stopped with
+        a range request when the connection drops before the whole file arrives
+        pass a requests session to reuse its pooled connections
+        """
+        session = session or requests
+        download = {"status_code": None, "etag": None, "last_modified": None, "size": None}
+        for attempt in range(1, self.download_attempts + 1):
+            received = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+            request_headers = dict(headers)
+            if received > 0:
+                request_headers.pop("If-None-Match", None)
+                request_headers.pop("If-Modified-Since", None)
+                request_headers["Range"] = "bytes=%s-" % (received)
+                # if the release changed under us the server sends all of it again
+                if download["etag"] or download["last_modified"]:
+                    request_headers["If-Range"] = download["etag"] or download["last_modified"]
+            completed = False
+            try:
+                response = session.get(url, headers=request_headers, stream=True, timeout=self.download_timeout)
+                try:
+                    if response.status_code == 304 and received == 0:
+                        download["status_code"] = 304
+                        return download
+                    response.raise_for_status()
+                    if response.status_code == 206:
+                        content_range = re.match(r"bytes ([0-9]+)-[0-9]+/([0-9]+|\*)", response.headers.get("Content-Range", ""))
+                        if content_range is None or int(content_range.group(1)) != received:
+                            raise IOError("unexpected Content-Range %s for %s" % (response.headers.get("Content-Range"), url))
+                        mode = "ab"
+                    else:
+                        mode = "wb"
+                        download["status_code"] = response.status_code
+                        download["etag"] = response.headers.get("ETag")
+                        download["last_modified"] = response.headers.get("Last-Modified")
+                        content_length = response.headers.get("Content-Length", "")
+                        download["size"] = int(content_length) if content_length.isdigit() else None
+                    with open(partial_path, mode) as partial_file:
+                        for chunk in response.iter_content(chunk_size=self.download_chunk_size):
+                            if chunk:
+                                partial_file.write(chunk)
+                    completed = True
+                finally:
+                    response.close()
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout, socket.error), exception:
+                logger.debug("attempt %s to fetch %s was interrupted: %s" % (attempt, url, exception))
+            received = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+            if download["size"] is not None and received > download["size"]:
+                raise IOError("received %s bytes of %s but expected %s" % (received, url, download["size"]))
+            if download["size"] is not None and received == download["size"]:
+                return download
+            if download["size"] is None and completed == True:
+                return download
+            logger.debug("received %s of %s bytes from %s" % (received, download["size"], url))
+            if attempt < self.download_attempts:
+                time.sleep(self.download_retry_delay * attempt)
+        raise IOError("gave up on %s after %s attempts" % (url, self.download_attempts))
+
+
+    def _can_hash_file(self, file_path):
+        """
+        sha256 a file a chunk at a time so large releases are never held in memory
+        """
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(self.download_chunk_size), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+
+    def _can_load_fetch_state(self):
+        """
+        read what we know about previously fetched files from the local state store
+        """
+        if os.path.isfile(settings.FETCH_STATE_PATH):
+            with open(settings.FETCH_STATE_PATH, "rb") as state_file:
+                return json.load(state_file)
+        return {}
+
+
+    def _can_save_fetch_state(self, fetch):
+        """
+        record a fetched file once it has been ingested so the next run can skip it
+        """
+        state = self._can_load_fetch_state()
+        state[fetch["state_key"]] = {
+            "url": fetch["url"],
+            "etag": fetch["etag"],
+            "last_modified": fetch["last_modified"],
+            "sha256": fetch["sha256"],
+            "fetched_at": datetime.datetime.now().isoformat(),
+        }
+        temporary_path = "%s.tmp" % (settings.FETCH_STATE_PATH)
+        with open(temporary_path, "wb") as state_file:
+            json.dump(state, state_file, indent=4, sort_keys=True)
+        os.rename(temporary_path, settings.FETCH_STATE_PATH)
+
 
     def _can_convert_excel_file_to(self, file_name, file_created_csv_path, file_download_excel_path):
         """
@@ -54,6 +298,142 @@ class MonthlyFormattingMethods(object):
             raise
 
 
+    def _can_read_csv_rows_from(self, file_created_csv_path):
+        """
+        yield each row of a converted csv file as a dict
+        """
+        with open(file_created_csv_path, "rb") as csvfile:
+            csv_data = csv.DictReader(csvfile, delimiter=',')
+            for row in csv_data:
+                yield row
+
+
+    def _can_stream_excel_rows_from(self, file_download_excel_path):
+        """
+        yield each row of the first worksheet as a dict of strings without writing a csv file
+        read-only mode keeps memory flat because rows are parsed as they are requested
+        """
+        with open(file_download_excel_path, "rb") as excel_file:
+            workbook = load_workbook(excel_file, read_only=True, data_only=True)
+            worksheet = workbook.worksheets[0]
+            rows = worksheet.iter_rows()
+            header = [self._can_make_cell_to_string(cell.value) for cell in next(rows)]
+            for row in rows:
+                values = [self._can_make_cell_to_string(cell.value) for cell in row]
+                if not any(values):
+                    continue
+                values.extend([u""] * (len(header) - len(values)))
+                yield dict(zip(header, values))
+
+
+    def _can_make_cell_to_string(self, value):
+        """
+        render a worksheet cell the same way In2CSV writes it to a csv file
+        """
+        if value is None:
+            return u""
+        elif isinstance(value, datetime.datetime):
+            if value.time() == datetime.time(0):
+                return unicode(value.date().isoformat())
+            return unicode(value.isoformat())
+        elif isinstance(value, datetime.date):
+            return unicode(value.isoformat())
+        elif isinstance(value, float):
+            if value.is_integer():
+                return unicode(int(value))
+            return unicode(repr(value))
+        elif isinstance(value, basestring):
+            return value
+        return unicode(value)
+
+
+    def _can_archive_file_to(self, file_path, data_path):
+        """
+        move a processed file into the data folder, replacing an older copy
+        """
+        archived_path = "%s/%s" % (data_path, os.path.basename(file_path))
+        if not os.path.exists(file_path):
+            return
+        if os.path.exists(archived_path):
+            logger.debug("file already exists in data folder")
+            os.remove(archived_path)
+        logger.debug("moving %s" % (os.path.basename(file_path)))
+        shutil.move(file_path, data_path)
+
+
+    def _can_clean_header(self, header):
+        """
+        reduce a column header to the lowercase, underscored key the ingest code uses
+        """
+        return re.sub(r"\([^)]*\)", "", header).strip().replace("- ", "").replace(" ", "_").replace("/", "_").lower()
+
+
+    def _can_compile_row_schema(self, header, list_of_expected_keys, columns, header_aliases={}):
+        """
+        resolve which column feeds each field and how to convert it once per file
+        columns is a list of (field, cleaned header, converter name) and a file missing
+        any of the expected keys is rejected before a single row is converted
+        """
+        available = {self._can_clean_header(key): key for key in header}
+        for alias, cleaned in header_aliases.iteritems():
+            if cleaned not in available and alias in available:
+                available[cleaned] = available[alias]
+        expected = [header_aliases.get(self._can_clean_header(key), self._can_clean_header(key)) for key in list_of_expected_keys]
+        missing = [key for key, cleaned in zip(list_of_expected_keys, expected) if cleaned not in available]
+        missing.extend([cleaned for field, cleaned, converter in columns if cleaned not in available and cleaned not in expected])
+        if missing:
+            raise ValueError("missing expected columns: %s" % (", ".join(missing)))
+        return {
+            "row_type": namedtuple("Row", [field for field, cleaned, converter in columns]),
+            "columns": [(available[cleaned], getattr(self, self.row_converters[converter])) for field, cleaned, converter in columns],
+        }
+
+
+    def _can_apply_row_schema(self, schema, row):
+        """
+        convert a row into a typed tuple using a compiled schema
+        """
+        return schema["row_type"]._make([converter(row[key]) for key, converter in schema["columns"]])
+
+
+    def _can_make_text_from(self, value):
+        """
+        """
+        return (value or u"").strip()
+
+
+    def _can_make_upper_text_from(self, value):
+        """
+        """
+        return (value or u"").strip().upper()
+
+
+    def _can_make_flag_from(self, value):
+        """
+        """
+        return (value or u"").strip() == "Yes"
+
+
+    def _can_make_number_from(self, value):
+        """
+        the numeric value of a cell or None when it doesn't convert
+        """
+        status = self._can_convert_str_to_num(value)
+        if status["convert"] == True:
+            return status["value"]
+        return None
+
+
+    def _can_make_percent_from(self, value):
+        """
+        percentages are published as whole numbers and stored as fractions
+        """
+        status = self._can_convert_str_to_num(value)
+        if status["convert"] == True:
+            return status["value"] / 100
+        return 0
+
+
     def _can_create_hydrologic_region_slug(self, item):
         """
         """
@@ -64,56 +444,10 @@ class MonthlyFormattingMethods(object):
 
     def _can_prettify_and_slugify_string(self, string):
         """
+        the pretty name and slug from the shared cache, copied so a caller can't change the cached entry
         """
-        more_than_one_space = re.compile("\s+")
-        string = string.lower()
-        value = re.sub("[^0-9a-zA-Z\s-]+", " ", string)
-        city_in = "city" in value
-        town_in = "town" in value
-        if city_in == True:
-            start_city_check = re.compile("^city of")
-            end_city_check = re.compile("city of")
-            city_match = re.search(start_city_check, value)
-            try:
-                if city_match:
-                    pretty_name = value
-                else:
-                    end_city_match = re.search(end_city_check, value)
-                    if end_city_match:
-                        value = value.split("city of")
-                        pretty_name = "city of %s" % (value[0].strip())
-                    else:
-                        pretty_name = value
-            except Exception, exception:
-                logger.error(exception)
-                raise
-        elif town_in == True:
-            start_town_check = re.compile("^town of")
-            end_town_check = re.compile("town of")
-            town_match = re.search(start_town_check, value)
-            try:
-                if town_match:
-                    pretty_name = value
-                else:
-                    end_town_match = re.search(end_town_check, value)
-                    if end_town_match:
-                        value = value.split("town of")
-                        pretty_name = "town of %s" % (value[0].strip())
-                    else:
-                        pretty_name = value
-            except Exception, exception:
-                logger.error(exception)
-                raise
-        else:
-            pretty_name = value
-        pretty_name = " ".join(pretty_name.split())
-        if pretty_name == "san bernardino county service area 70j":
-            pretty_name = "san bernardino county service area 70"
-        slug = pretty_name.encode("ascii", "ignore").lower()
-        slug = re.sub(r"[^a-z0-9]+", "-", slug).strip("-")
-        slug = re.sub(r"[-]+", "-", slug)
-        output = {"supplier_slug": slug, "supplier_name": pretty_name}
-        return output
+        formatted = self.normalizer._can_normalize(string)
+        return {"supplier_slug": formatted["supplier_slug"], "supplier_name": formatted["supplier_name"]}
 
 
     def _can_convert_str_to_num(self, value):
@@ -161,21 +495,59 @@ class MonthlyFormattingMethods(object):
     def _can_create_datetime_from_filename(self, file):
         """
         can I create a datetime out of the file name because there are six digits
+        archived files are also named with a year_month_day_ prefix
         """
         file_name = os.path.basename(file)
-        date_data = re.findall('([0-9]{6})[^0-9]', file_name)
-        date_data = date_data[0]
-        this_year = "20%s" % (date_data[4:])
-        data_release = datetime.date(int(this_year), int(date_data[:2]), int(date_data[2:4]))
+        prefixed_date = re.match('([0-9]{4})_([0-9]{2})_([0-9]{2})_', file_name)
+        if prefixed_date:
+            year, month, day = prefixed_date.groups()
+            data_release = datetime.date(int(year), int(month), int(day))
+        else:
+            date_data = re.findall('([0-9]{6})[^0-9]', file_name)
+            date_data = date_data[0]
+            this_year = "20%s" % (date_data[4:])
+            data_release = datetime.date(int(this_year), int(date_data[:2]), int(date_data[2:4]))
         if data_release > datetime.date(2014, 9, 01):
             return data_release
 
 
     def _can_make_string_to_datetime(self, date):
         """
-        are the keys I expect to be in the file present
+        parse a date string, remembering the most recent answers because a release only has a handful
+        the formats the state publishes are matched directly and dateutil handles the rest
+        a month without a day, such as Aug-14 or Dec 2016, is the first of that month
+        a blank string or one missing its year or month raises ValueError
         """
-        parsed_date = parser.parse(date)
+        if date is None or not date.strip():
+            raise ValueError("no date in %r" % (date))
+        try:
+            parsed_date = self.parsed_dates.pop(date)
+            self.parsed_dates[date] = parsed_date
+            return parsed_date
+        except KeyError:
+            pass
+        match = self.iso_date.match(date)
+        if match:
+            parsed_date = datetime.datetime(*[int(value) for value in match.groups() if value is not None])
+        else:
+            match = self.us_date.match(date)
+            if match:
+                month, day, year = [int(value) for value in match.groups()]
+                parsed_date = datetime.datetime(year, month, day)
+            else:
+                match = self.month_year.match(date)
+                month = self.month_numbers.get(match.group(1).lower()) if match else None
+                if month:
+                    year = int(match.group(3)) if match.group(3) else 2000 + int(match.group(2))
+                    parsed_date = datetime.datetime(year, month, 1)
+                else:
+                    parsed_date = parser.parse(date, default=self.fill_in_dates[0])
+                    other_date = parser.parse(date, default=self.fill_in_dates[1])
+                    if (parsed_date.year, parsed_date.month) != (other_date.year, other_date.month):
+                        raise ValueError("%r is not a whole date" % (date))
+        while len(self.parsed_dates) >= self.parsed_dates_maxsize:
+            self.parsed_dates.popitem(last=False)
+        self.parsed_dates[date] = parsed_date
         return parsed_date
 
 
@@ -0,0 +1,147 @@
+from __future__ import division
+from django.conf import settings
+from fetch_methods import MonthlyFormattingMethods
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from urlparse import urlparse
+import threading
+import logging
+import time
+import datetime
+import requests
+import os.path
+
+logger = logging.getLogger("cali_water_reports")
+
+class FetchReleaseManifest(object):
+    """
+    scaffolding to download past releases from the state water board into the data folder
+    """
+
+    data_path = settings.DATA_PATH
+
+    list_of_previous_files = [
+        "http://www.waterboards.ca.gov/water_issues/programs/conservation_portal/docs/2015dec/uw_supplier_data120115.xlsx",
+        "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data082715.xlsx",
+        "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data073015.xlsx",
+        "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data070115.xlsx",
+        "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/060215uw_supplier_data.xlsx",
+        "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/050515uw_supplier_data.xlsx",
+        "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data040715.xlsx",
+        "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data030315.xlsx",
+        "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data020315.xlsx",
+        "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data010215.xlsx",
+        "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data120214.xlsx",
+        "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/emergency_regulations/uw_supplier_data110414.xlsx",
+        "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data100714.xlsx",
+        "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/workshops/urban_water_conservation_mandatory_results091114.xlsx",
+    ]
+
+    max_connections = 4
+
+    max_attempts = 4
+
+    backoff_seconds = 2
+
+    host_delay_seconds = 1
+
+    # statuses worth asking again for, anything else is final
+    retry_statuses = [429, 500, 502, 503, 504]
+
+    sluggy = MonthlyFormattingMethods()
+
+    def _init(self, *args, **kwargs):
+        """
+        download every release in the manifest that isn't already in the data folder
+        pass force to download them again and max_connections to change how many run at once
+        """
+        urls = kwargs.get("urls") or self.list_of_previous_files
+        data_path = kwargs.get("data_path") or self.data_path
+        max_connections = kwargs.get("max_connections") or self.max_connections
+        force = kwargs.get("force", False)
+        self.host_delay_seconds = kwargs.get("host_delay_seconds", self.host_delay_seconds)
+        self.host_schedule = {}
+        self.host_lock = threading.Lock()
+        session = self._can_make_session(max_connections)
+        started = time.time()
+        pool = ThreadPool(processes=max_connections)
+        try:
+            results = pool.map(lambda url: self._can_fetch_release(session, url, data_path, force), urls, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            session.close()
+        summary = {"releases": results, "seconds": time.time() - started}
+        for status in ["downloaded", "exists", "failed"]:
+            summary[status] = len([result for result in results if result["status"] == status])
+        return summary
+
+
+    def _can_make_session(self, max_connections):
+        """
+        one session shared by every worker so connections to a host are reused
+        """
+        session = requests.Session()
+        session.headers.update(settings.REQUEST_HEADERS)
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+
+    def _can_wait_for_host(self, url):
+        """
+        space out requests to the same host by host_delay_seconds
+        each caller reserves the next slot under the lock and sleeps outside it
+        """
+        host = urlparse(url).netloc
+        with self.host_lock:
+            now = time.time()
+            slot = max(now, self.host_schedule.get(host, now))
+            self.host_schedule[host] = slot + self.host_delay_seconds
+        if slot > now:
+            time.sleep(slot - now)
+
+
+    def _can_fetch_release(self, session, url, data_path, force=False):
+        """
+        download one release into the data folder, retrying failures with exponential backoff
+        """
+        file_path = os.path.join(data_path, os.path.basename(urlparse(url).path))
+        result = {"url": url, "file_path": file_path, "status": None, "attempts": 0, "bytes": None, "error": None}
+        if force == False and os.path.isfile(file_path):
+            result["status"] = "exists"
+            return result
+        partial_path = "%s.part" % (file_path)
+        for attempt in range(1, self.max_attempts + 1):
+            result["attempts"] = attempt
+            self._can_wait_for_host(url)
+            try:
+                if os.path.isfile(partial_path):
+                    os.remove(partial_path)
+                self.sluggy._can_stream_download_to(partial_path, url, {}, session=session)
+                os.rename(partial_path, file_path)
+                result["status"] = "downloaded"
+                result["bytes"] = os.path.getsize(file_path)
+                result["error"] = None
+                logger.debug("fetched %s in %s attempts" % (os.path.basename(file_path), attempt))
+                return result
+            except Exception, exception:
+                result["error"] = "%s %s" % (exception.__class__.__name__, exception)
+                status_code = getattr(getattr(exception, "response", None), "status_code", None)
+                if status_code is not None and status_code not in self.retry_statuses:
+                    break
+                if attempt < self.max_attempts:
+                    logger.debug("attempt %s at %s failed: %s" % (attempt, url, result["error"]))
+                    time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+        if os.path.isfile(partial_path):
+            os.remove(partial_path)
+        logger.error("could not fetch %s: %s" % (url, result["error"]))
+        result["status"] = "failed"
+        return result
+
+
+if __name__ == '__main__':
+    task_run = FetchReleaseManifest()
+    task_run._init()
+    print "\nTask finished at %s\n" % str(datetime.datetime.now())
@@ -1,8 +1,19 @@
 from __future__ import division
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from monthly_water_reports.models import WaterSupplier, WaterSupplierMonthlyReport
-from fetch_methods import MonthlyFormattingMethods
+from fetch_methods import MonthlyFormattingMethods, SupplierNameNormalizer
+from bulk_methods import BulkUpsertMethods
+from timing_methods import StageTimer
+from unit_methods import UnitConversionMethods
+from cache_methods import ParsedReleaseCache
+from catalog_methods import ReleaseCatalogMethods
+from alias_methods import SupplierAliasIndex
+from screening_methods import ReleaseScreeningMethods
+from pipeline_methods import ReleasePipeline
+from snapshot_methods import ReportSnapshotMethods
+from release_methods import DataVersion
 import csv
 from csvkit.utilities.in2csv import In2CSV
 import re
@@ -55,182 +66,297 @@ class BuildMonthlyWaterUseReport(object):
         "Comments/Corrections",
     ]
 
-    suppliers_to_skip = [
-        "city-of-coalinga",
-        "mountain-house-community-services-district",
-        "cloverdale",
-        "",
+    columns = [
+        ("supplier_name", "supplier_name", "text"),
+        ("hydrologic_region", "hydrologic_region", "text"),
+        ("stage_invoked", "stage_invoked", "text"),
+        ("mandatory_restrictions", "mandatory_restrictions", "flag"),
+        ("reporting_month", "reporting_month", "date"),
+        ("total_monthly_potable_water_production_2014", "reported_total_monthly_potable_water_production_reporting_month", "number"),
+        ("total_monthly_potable_water_production_2013", "reported_total_monthly_potable_water_production_2013", "number"),
+        ("units", "reported_units", "upper"),
+        ("qualification", "qualification", "text"),
+        ("total_population_served", "total_population_served", "number"),
+        ("reported_rgpcd", "reported_residential_gallons-per-capita-day", "number"),
+        ("enforcement_actions", "optional_enforcement_actions", "text"),
+        ("implementation", "optional_implementation", "text"),
+        ("recycled_water", "optional_reported_recycled_water", "text"),
+        ("calculated_production_monthly_gallons_month_2014", "calculated_total_monthly_potable_water_production_reporting_month_gallons", "number"),
+        ("calculated_production_monthly_gallons_month_2013", "calculated_total_monthly_potable_water_production_2013_gallons", "number"),
+        ("calculated_rgpcd_2014", "calculated_r-gpcd_reporting_month", "number"),
+        ("percent_residential_use", "%_residential_use", "percent"),
+        ("comments_or_corrections", "comments_corrections", "text"),
     ]
 
     sluggy = MonthlyFormattingMethods()
 
+    normalizer = SupplierNameNormalizer()
+
+    bulky = BulkUpsertMethods()
+
+    converter = UnitConversionMethods()
+
+    # bump when a change to parsing should invalidate cached releases
+    parser_version = 2
+
+    catalog = ReleaseCatalogMethods()
+
+    aliases = SupplierAliasIndex()
+
+    screener = ReleaseScreeningMethods()
+
+    snapshot = ReportSnapshotMethods()
+
+    data_version = DataVersion()
+
     def _init(self, *args, **kwargs):
         """
         begin the process of downloading the latest state water control board usage report
+        pass local_file to ingest a workbook already on disk, row_by_row to use get_or_create
+        and streaming to read the workbook directly instead of converting it to csv
+        pass pipelined to parse a batched ingest in a worker process while it is staged
+        a download that matches the last ingested release is skipped unless force is set
+        pass a StageTimer as timer to collect timings for each stage of the run
+        each ingest is noted in the release catalog, exported as a columnar snapshot
+        and bumps the data version the views key their latest release on
+        """
+        local_file = kwargs.get("local_file", None)
+        row_by_row = kwargs.get("row_by_row", False)
+        streaming = kwargs.get("streaming", False)
+        pipelined = kwargs.get("pipelined", False)
+        force = kwargs.get("force", False)
+        timer = kwargs.get("timer", None) or StageTimer()
+        started = time.time()
+        if local_file:
+            file_name = os.path.basename(local_file)
+            file_download_excel_path = local_file
+            file_created_csv_path = "%s/%s" % (settings.FILE_DOWNLOAD_PATH, file_name.replace(".xlsx", ".csv"))
+        else:
+            file_name = self.file_name
+            file_download_excel_path = self.file_download_excel_path
+            file_created_csv_path = self.file_created_csv_path
+            with timer._can_time_stage("download"):
+                fetch = self.sluggy._can_write_excel_file_from(file_name, self.excel_file_url, file_download_excel_path, state_key="usage", force=force)
+            if fetch["changed"] == False:
+                logger.debug("skipping %s because it has not changed since it was last ingested" % (file_name))
+                return {"rows": 0, "unchanged_release": True}
+        cache = kwargs.get("cache", None) or ParsedReleaseCache()
+        with timer._can_time_stage("cache") as stage:
+            cache_key = self._can_make_cache_key_for(cache, file_download_excel_path, streaming)
+            cached = cache._can_load(cache_key)
+            stage["rows"] = len(cached["rows"]) if cached and cached["error"] is None else None
+        # a cached parse error is read again so it is raised with its traceback
+        if cached and cached["error"] is None:
+            logger.debug("using the parsed rows cached for %s" % (file_name))
+            summary = self._can_write_release_from(self._can_stamp_cached_rows(cached["rows"]), row_by_row=row_by_row, timer=timer)
+        elif streaming == True:
+            rows = timer._can_time_rows("read", self.sluggy._can_stream_excel_rows_from(file_download_excel_path), within="parse")
+            summary = self._can_build_model_instance(rows, file_download_excel_path, row_by_row=row_by_row, timer=timer, cache=cache, cache_key=cache_key, pipelined=pipelined)
+        else:
+            with timer._can_time_stage("convert"):
+                self.sluggy._can_convert_excel_file_to(file_name, file_created_csv_path, file_download_excel_path)
+            rows = timer._can_time_rows("read", self.sluggy._can_read_csv_rows_from(file_created_csv_path), within="parse")
+            summary = self._can_build_model_instance(rows, file_created_csv_path, row_by_row=row_by_row, timer=timer, cache=cache, cache_key=cache_key, pipelined=pipelined)
+        summary["parse_cache"] = cache._can_report_cache()
+        # the release is committed, so pages built from here on work out the latest release again
+        self.data_version._can_bump()
+        if not local_file:
+            self.sluggy._can_archive_file_to(file_download_excel_path, self.data_path)
+            if os.path.isfile(file_created_csv_path):
+                self.sluggy._can_archive_file_to(file_created_csv_path, self.data_path)
+            self.sluggy._can_save_fetch_state(fetch)
+        with timer._can_time_stage("snapshot"):
+            summary["snapshot"] = self.snapshot._can_export_release(self.sluggy._can_create_datetime_from_filename(file_download_excel_path))
+        self.catalog._can_record_ingest(local_file or os.path.join(self.data_path, file_name), "usage", summary["rows"], time.time() - started)
+        return summary
+
+
+    def _can_make_cache_key_for(self, cache, file_path, streaming=False):
+        """
+        csv and streamed reads are cached apart since In2CSV formats some cells differently
+        """
+        kind = "usage-stream" if streaming == True else "usage-csv"
+        return cache._can_make_cache_key(file_path, kind, self.parser_version, self.columns, self.list_of_expected_keys)
+
+
+    def _can_stamp_cached_rows(self, list_of_data):
+        """
+        rows from the parse cache get created_date set to now as a fresh parse would
+        """
+        created_date = datetime.datetime.now()
+        for data in list_of_data:
+            data["created_date"] = created_date
+        return list_of_data
+
+
+    def _can_build_model_instance(self, rows, file_path, row_by_row=False, timer=None, cache=None, cache_key=None, pipelined=False):
+        """
+        builds data for database from rows read out of a csv or excel file
+        the parsed rows are kept in the parse cache when a cache_key is passed
+        a batched ingest is staged as it is parsed when pipelined is set, see _can_write_pipelined_release_from
         """
-        self.sluggy._can_write_excel_file_from(self.file_name, self.excel_file_url, self.file_download_excel_path)
-        self.sluggy._can_convert_excel_file_to(self.file_name, self.file_created_csv_path, self.file_download_excel_path)
-        self._can_build_model_instance(self.file_created_csv_path)
+        timer = timer or StageTimer()
+        started = time.time()
+        if row_by_row == False and pipelined == True:
+            return self._can_write_pipelined_release_from(rows, file_path, timer=timer, cache=cache, cache_key=cache_key, started=started)
+        with timer._can_time_stage("parse") as stage:
+            list_of_data = self._can_parse_rows_from(rows, file_path, timer=timer)
+            stage["rows"] = len(list_of_data)
+        if cache_key is not None:
+            with timer._can_time_stage("cache"):
+                cache._can_save(cache_key, list_of_data)
+        return self._can_write_release_from(list_of_data, row_by_row=row_by_row, timer=timer, started=started)
+
+
+    def _can_write_pipelined_release_from(self, rows, file_path, timer=None, cache=None, cache_key=None, started=None):
+        """
+        rows are read and parsed in a worker process and each batch is normalized, resolved
+        and written to the staging table while the next one is parsed, once the whole
+        release is in it is screened and merged into the live tables in one transaction
+        the worker only does cpu work, supplier names are normalized here so the cache
+        carries over to the next release and the database is only used from this process
+        on one core this is a little slower than parsing first, so it is only used when asked for
+        """
+        timer = timer or StageTimer()
+        started = started or time.time()
+        report_date = self.sluggy._can_create_datetime_from_filename(file_path)
+        list_of_data = []
+        list_to_screen = []
+        pipeline = ReleasePipeline(timer=timer)
+        # the worker is forked before the staging table is created on this process's connection
+        pipeline._can_start(self._can_yield_parsed_rows_from(rows, file_path, timer=timer, normalize=False))
         try:
-            shutil.move(self.file_download_excel_path, self.data_path)
-            shutil.move(self.file_created_csv_path, self.data_path)
-        except:
-            logger.debug("file already exists in data folder")
-            logger.debug("moving %s" % (self.file_name))
-            if os.path.exists("%s/%s" % (self.data_path, self.file_name)):
-                os.remove("%s/%s" % (self.data_path, self.file_name))
-                shutil.move(self.file_download_excel_path, self.data_path)
-            logger.debug("moving %s" % (os.path.basename(self.file_created_csv_path)))
-            if os.path.exists("%s/%s" % (self.data_path, os.path.basename(self.file_created_csv_path))):
-                os.remove("%s/%s" % (self.data_path, os.path.basename(self.file_created_csv_path)))
-                shutil.move(self.file_created_csv_path, self.data_path)
-
-
-    def _can_build_model_instance(self, file_created_csv_path):
+            self.aliases._can_load()
+            with timer._can_time_stage("write"):
+                release = self.bulky._can_begin_release([report_date])
+            for batch in pipeline._can_iterate_batches():
+                with timer._can_time_stage("normalize") as stage:
+                    batch = self._can_normalize_rows_from(batch)
+                    stage["rows"] = (stage["rows"] or 0) + len(batch)
+                list_of_data.extend(batch)
+                with timer._can_time_stage("resolve") as stage:
+                    batch = self.aliases._can_resolve_rows_from(batch)
+                    stage["rows"] = (stage["rows"] or 0) + len(batch)
+                list_to_screen.extend(batch)
+                with timer._can_time_stage("write"):
+                    self.bulky._can_stage_batch(release, batch)
+            if cache_key is not None:
+                with timer._can_time_stage("cache"):
+                    cache._can_save(cache_key, list_of_data)
+            with timer._can_time_stage("screen") as stage:
+                list_to_screen, quarantine = self.screener._can_screen_release(list_to_screen)
+                stage["rows"] = len(list_to_screen)
+            with timer._can_time_stage("write") as stage:
+                self.bulky._can_set_aside_reports(release, [(report["supplier_slug"], report["reporting_month"], report["report_date"]) for report in quarantine])
+                summary = self.bulky._can_finish_release(release)
+                stage["rows"] = summary["rows"]
+        finally:
+            pipeline._can_stop()
+            self.bulky._can_drop_staging_table()
+        summary["aliases"] = self.aliases._can_save_new_spellings()
+        summary["quarantine"] = quarantine
+        summary["seconds"] = time.time() - started
+        summary["supplier_cache"] = self.normalizer._can_report_cache()
+        return summary
+
+
+    def _can_write_release_from(self, list_of_data, row_by_row=False, timer=None, started=None):
+        """
+        rows are collected and upserted in batches unless row_by_row is set
+        either way a release is written in one transaction
+        supplier names are resolved through the alias table first and rows that fail
+        screening are set aside in summary["quarantine"]
+        """
+        timer = timer or StageTimer()
+        started = started or time.time()
+        with timer._can_time_stage("resolve") as stage:
+            self.aliases._can_load()
+            list_of_data = self.aliases._can_resolve_rows_from(list_of_data)
+            stage["rows"] = len(list_of_data)
+        with timer._can_time_stage("screen") as stage:
+            list_of_data, quarantine = self.screener._can_screen_release(list_of_data)
+            stage["rows"] = len(list_of_data)
+        with timer._can_time_stage("write") as stage:
+            if row_by_row == True:
+                with transaction.atomic():
+                    for data_to_process in list_of_data:
+                        self._save_supplier_instance_from(data_to_process)
+                        self._save_supplier_report_instance_from(data_to_process)
+                        timer._can_tick("write")
+                summary = {}
+            else:
+                summary = self.bulky._can_bulk_save_release_from(list_of_data)
+            stage["rows"] = len(list_of_data)
+        summary["aliases"] = self.aliases._can_save_new_spellings()
+        summary["quarantine"] = quarantine
+        summary["rows"] = len(list_of_data)
+        summary["seconds"] = time.time() - started
+        summary["supplier_cache"] = self.normalizer._can_report_cache()
+        return summary
+
+
+    def _can_parse_rows_from(self, rows, file_path, timer=None):
+        """
+        turn the rows of a release into dictionaries ready for the database
+        no queries are made here so it is safe to run in a worker process
+        """
+        return list(self._can_yield_parsed_rows_from(rows, file_path, timer=timer))
+
+
+    def _can_yield_parsed_rows_from(self, rows, file_path, timer=None, normalize=True):
+        """
+        parse rows one at a time so a release can be written while it is read
+        pass normalize as False to leave the supplier name and slug for _can_normalize_rows_from
         """
-        builds data for database from csv file
+        count = 0
+        report_date = self.sluggy._can_create_datetime_from_filename(file_path)
+        created_date = datetime.datetime.now()
+        normalize_seconds = 0
+        schema = None
+        for row in rows:
+            if timer is not None:
+                timer._can_tick("parse")
+            if schema is None:
+                schema = self.sluggy._can_compile_row_schema(row.keys(), self.list_of_expected_keys, self.columns)
+            try:
+                values = self.sluggy._can_apply_row_schema(schema, row)
+            except Exception, exception:
+                error_output = "%s %s" % (exception, row)
+                logger.error(error_output)
+                raise
+            normalize_started = time.time()
+            supplier_formatted = self.normalizer._can_normalize(values.supplier_name) if normalize == True else {"supplier_name": None, "supplier_slug": None}
+            hydrologic_region_slug = self.sluggy._can_create_hydrologic_region_slug(values.hydrologic_region)
+            normalize_seconds += time.time() - normalize_started
+            data_to_process = dict(zip(values._fields, values))
+            data_to_process.update({
+                "raw_supplier_name": values.supplier_name,
+                "supplier_name": supplier_formatted["supplier_name"],
+                "supplier_slug": supplier_formatted["supplier_slug"],
+                "supplier_url": None,
+                "supplier_active": True,
+                "hydrologic_region_slug": hydrologic_region_slug,
+                "created_date": created_date,
+                "supplier_notes": None,
+                "recycled_water_units": None,
+                "report_date": report_date,
+            })
+            data_to_process.update(self.converter._can_make_canonical_values_from(data_to_process))
+            count += 1
+            yield data_to_process
+        if timer is not None and normalize == True:
+            timer._can_add_to_stage("normalize", normalize_seconds, rows=count, within="parse")
+
+
+    def _can_normalize_rows_from(self, list_of_data):
         """
-        with open(file_created_csv_path, "rb") as csvfile:
-            csv_data = csv.DictReader(csvfile, delimiter=',')
-            for row in csv_data:
-                clean_row = {re.sub(r"\([^)]*\)", "", k).strip().replace("- ", "").replace(" ", "_").replace("/", "_").lower(): v.strip() for k, v in row.iteritems()}
-
-                supplier_formatted = self.sluggy._can_prettify_and_slugify_string(clean_row["supplier_name"])
-
-                data_to_process = {}
-
-                data_to_process["supplier_name"] = supplier_formatted["supplier_name"]
-
-                data_to_process["supplier_slug"] = supplier_formatted["supplier_slug"]
-
-                data_to_process["supplier_url"] = None
-
-                data_to_process["supplier_active"] = True
-
-                try:
-                    data_to_process["hydrologic_region"] = clean_row["hydrologic_region"]
-                    data_to_process["hydrologic_region_slug"] = self.sluggy._can_create_hydrologic_region_slug(clean_row["hydrologic_region"])
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row["hydrologic_region"])
-                    logger.error(error_output)
-                    raise
-
-                data_to_process["created_date"] = datetime.datetime.now()
-
-                data_to_process["supplier_notes"] = None
-
-                data_to_process["stage_invoked"] = clean_row["stage_invoked"]
-
-                if clean_row["mandatory_restrictions"] == "Yes":
-                    data_to_process["mandatory_restrictions"] = True
-                else:
-                    data_to_process["mandatory_restrictions"] = False
-
-                data_to_process["enforcement_actions"] = clean_row["optional_enforcement_actions"]
-
-                data_to_process["implementation"] = clean_row["optional_implementation"]
-
-                data_to_process["recycled_water"] = clean_row["optional_reported_recycled_water"]
-
-                # try:
-                #     data_to_process["recycled_water_units"] = clean_row["recycled_water_units"]
-                # except Exception, exception:
-                data_to_process["recycled_water_units"] = None
-
-                data_to_process["units"] = clean_row["reported_units"].upper()
-
-                data_to_process["qualification"] = clean_row["qualification"]
-
-                data_to_process["comments_or_corrections"] = clean_row["comments_corrections"]
-
-                try:
-                    data_to_process["reporting_month"] = self.sluggy._can_make_string_to_datetime(clean_row["reporting_month"])
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                reported_prod_2014_15 = clean_row["reported_total_monthly_potable_water_production_reporting_month"]
-                try:
-                    if self.sluggy._can_convert_str_to_num(reported_prod_2014_15)["convert"] == True:
-                        data_to_process["reported_total_monthly_potable_water_production_reporting_month"] = self.sluggy._can_convert_str_to_num(reported_prod_2014_15)["value"]
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                reported_prod_2013 = clean_row["reported_total_monthly_potable_water_production_2013"]
-                try:
-                    if self.sluggy._can_convert_str_to_num(reported_prod_2013)["convert"] == True:
-                        data_to_process["total_monthly_potable_water_production_2013"] = self.sluggy._can_convert_str_to_num(reported_prod_2013)["value"]
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                try:
-                    if self.sluggy._can_convert_str_to_num(clean_row["total_population_served"])["convert"] == True:
-                        data_to_process["total_population_served"] = self.sluggy._can_convert_str_to_num(clean_row["total_population_served"])["value"]
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                try:
-                    if self.sluggy._can_convert_str_to_num(clean_row["%_residential_use"])["convert"] == True:
-                        data_to_process["percent_residential_use"] = self.sluggy._can_convert_str_to_num(clean_row["%_residential_use"])["value"]
-                        data_to_process["percent_residential_use"] = data_to_process["percent_residential_use"] / 100
-                    else:
-                        data_to_process["percent_residential_use"] = 0
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                try:
-                    if self.sluggy._can_convert_str_to_num(clean_row["reported_residential_gallons-per-capita-day"])["convert"] == True:
-                        data_to_process["reported_rgpcd"] = self.sluggy._can_convert_str_to_num(clean_row["reported_residential_gallons-per-capita-day"])["value"]
-                    else:
-                        data_to_process["reported_rgpcd"] = None
-                except Exception, exception:
-                    data_to_process["reported_rgpcd"] = None
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                try:
-                    if self.sluggy._can_convert_str_to_num(clean_row["calculated_total_monthly_potable_water_production_reporting_month_gallons"])["convert"] == True:
-                        data_to_process["calculated_total_monthly_potable_water_production_reporting_month_gallons"] = self.sluggy._can_convert_str_to_num(clean_row["calculated_total_monthly_potable_water_production_reporting_month_gallons"])["value"]
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                try:
-                    if self.sluggy._can_convert_str_to_num(clean_row["calculated_total_monthly_potable_water_production_2013_gallons"])["convert"] == True:
-                        data_to_process["calculated_production_monthly_gallons_month_2013"] = self.sluggy._can_convert_str_to_num(clean_row["calculated_total_monthly_potable_water_production_2013_gallons"])["value"]
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                try:
-                    if self.sluggy._can_convert_str_to_num(clean_row["calculated_r-gpcd_reporting_month"])["convert"] == True:
-                        data_to_process["calculated_r-gpcd_reporting_month"] = self.sluggy._can_convert_str_to_num(clean_row["calculated_r-gpcd_reporting_month"])["value"]
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                try:
-                    data_to_process["report_date"] = self.sluggy._can_create_datetime_from_filename(file_created_csv_path)
-                except Exception, exception:
-                    error_output = "%s %s" % (exception, clean_row)
-                    logger.error(error_output)
-                    raise
-
-                self._save_supplier_instance_from(data_to_process)
-                self._save_supplier_report_instance_from(data_to_process)
+        fill in the pretty supplier name and slug of rows parsed without them
+        """
+        for data in list_of_data:
+            supplier_formatted = self.normalizer._can_normalize(data["raw_supplier_name"])
+            data["supplier_name"] = supplier_formatted["supplier_name"]
+            data["supplier_slug"] = supplier_formatted["supplier_slug"]
+        return list_of_data
 
 
     def _save_supplier_instance_from(self, data):
@@ -238,25 +364,20 @@ class BuildMonthlyWaterUseReport(object):
         save water supplier model instance from dictionary
         """
         try:
-            if data["supplier_slug"] in self.suppliers_to_skip:
-                pass
-            else:
-                obj, created = WaterSupplier.objects.get_or_create(
-                    supplier_slug = data["supplier_slug"],
-                    defaults = {
-                        "supplier_name": data["supplier_name"],
-                        "supplier_url": data["supplier_url"],
-                        "supplier_active": data["supplier_active"],
-                        "hydrologic_region": data["hydrologic_region"],
-                        "hydrologic_region_slug": data["hydrologic_region_slug"],
-                        "created_date": data["created_date"],
-                        "supplier_notes": data["supplier_notes"],
-                    }
-                )
-                if created:
-                    logger.debug("%s created: %s - %s" % (data["supplier_name"], data["supplier_slug"], data["hydrologic_region"]))
-                else:
-                    logger.debug("%s exists" % (data["supplier_name"]))
+            obj, created = WaterSupplier.objects.get_or_create(
+                supplier_slug = data["supplier_slug"],
+                defaults = {
+                    "supplier_name": data["supplier_name"],
+                    "supplier_url": data["supplier_url"],
+                    "supplier_active": data["supplier_active"],
+                    "hydrologic_region": data["hydrologic_region"],
+                    "hydrologic_region_slug": data["hydrologic_region_slug"],
+                    "created_date": data["created_date"],
+                    "supplier_notes": data["supplier_notes"],
+                }
+            )
+            if created:
+                logger.debug("%s created: %s - %s" % (data["supplier_name"], data["supplier_slug"], data["hydrologic_region"]))
         except ValueError, exception:
             traceback.print_exc(file=sys.stdout)
             error_output = "%s %s" % (exception, data)
@@ -269,42 +390,17 @@ class BuildMonthlyWaterUseReport(object):
         save monthly water supplier model instance from dictionary
         """
         try:
-            if data["supplier_slug"] in self.suppliers_to_skip:
-                pass
-            else:
-                supplier = WaterSupplier.objects.get(supplier_slug = data["supplier_slug"])
-                report, created = supplier.watersuppliermonthlyreport_set.get_or_create(
-                    reporting_month = data["reporting_month"],
-                    report_date = data["report_date"],
-                    supplier_name = data["supplier_name"],
-                    defaults = {
-                        "supplier_slug": data["supplier_slug"],
-                        "stage_invoked": data["stage_invoked"],
-                        "mandatory_restrictions": data["mandatory_restrictions"],
-                        "reporting_month": data["reporting_month"],
-                        "total_monthly_potable_water_production_2014": data["reported_total_monthly_potable_water_production_reporting_month"],
-                        "total_monthly_potable_water_production_2013": data["total_monthly_potable_water_production_2013"],
-                        "units": data["units"].upper(),
-                        "qualification": data["qualification"],
-                        "total_population_served": data["total_population_served"],
-                        "reported_rgpcd": data["reported_rgpcd"],
-                        "enforcement_actions": data["enforcement_actions"],
-                        "implementation": data["implementation"],
-                        "recycled_water": data["recycled_water"],
-                        "recycled_water_units": data["recycled_water_units"],
-                        "calculated_production_monthly_gallons_month_2014": data["calculated_total_monthly_potable_water_production_reporting_month_gallons"],
-                        "calculated_production_monthly_gallons_month_2013": data["calculated_production_monthly_gallons_month_2013"],
-                        "calculated_rgpcd_2014": data["calculated_r-gpcd_reporting_month"],
-                        "percent_residential_use": data["percent_residential_use"],
-                        "comments_or_corrections": data["comments_or_corrections"],
-                        "hydrologic_region": data["hydrologic_region"],
-                        "hydrologic_region_slug": data["hydrologic_region_slug"],
-                    }
+            supplier = WaterSupplier.objects.get(supplier_slug = data["supplier_slug"])
+            report, created = supplier.watersuppliermonthlyreport_set.get_or_create(
+                reporting_month = data["reporting_month"],
+                report_date = data["report_date"],
+                supplier_name = data["supplier_name"],
+                defaults = dict(
+                    {field: data[field] for field in self.bulky.report_fields},
+                    supplier_slug = data["supplier_slug"],
+                    fingerprint = self.bulky._can_fingerprint(data)
                 )
-                if created:
-                    logger.debug("%s created for %s" % (data["supplier_name"], data["reporting_month"]))
-                else:
-                    logger.debug("%s - %s exists" % (data["supplier_name"], data["reporting_month"]))
+            )
         except ObjectDoesNotExist, exception:
             traceback.print_exc(file=sys.stdout)
             error_output = "%s %s" % (exception, data)
@@ -0,0 +1,71 @@
+from __future__ import division
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+import datetime
+import logging
+import os.path
+import json
+from monthly_water_reports.backfill_reports import BackfillMonthlyReports
+
+logger = logging.getLogger("cali_water_reports")
+
+class Command(BaseCommand):
+    help = "Rebuild usage and enforcement reports from the workbooks archived in the data folder"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "files",
+            nargs="*",
+            help="Workbooks to load. Defaults to every xlsx file in settings.DATA_PATH."
+        )
+        parser.add_argument(
+            "--data-path",
+            action="store",
+            dest="data_path",
+            default=None,
+            help="Load every xlsx file in this directory instead of settings.DATA_PATH."
+        )
+        parser.add_argument(
+            "--pending",
+            action="store_true",
+            dest="pending",
+            default=False,
+            help="Load only the releases in the catalog that haven't been ingested. Run refresh_release_catalog first to pick up new workbooks."
+        )
+        parser.add_argument(
+            "--processes",
+            action="store",
+            dest="processes",
+            type=int,
+            default=None,
+            help="Number of worker processes used to parse workbooks. Defaults to the number of cores."
+        )
+        parser.add_argument(
+            "--quarantine-file",
+            action="store",
+            dest="quarantine_file",
+            default=os.path.join(settings.FILE_DOWNLOAD_PATH, "backfill_reports_quarantine.json"),
+            help="Where to write the usage rows held back by screening as json."
+        )
+
+    def handle(self, *args, **options):
+        task_run = BackfillMonthlyReports()
+        summary = task_run._init(files=options["files"], data_path=options["data_path"], processes=options["processes"], pending=options["pending"])
+        self.stdout.write("\nParsed %s files in %.2f seconds\n" % (summary["files"], summary["parse_seconds"]))
+        self.stdout.write("Wrote %s usage rows and %s enforcement rows in %.2f seconds\n" % (summary["usage_rows"], summary["enforcement_rows"], summary["write_seconds"]))
+        self.stdout.write("Usage: %s new, %s revised, %s unchanged, %s created, %s updated\n" % (summary["new"], summary["revised"], summary["unchanged"], summary["created"], summary["updated"]))
+        self.stdout.write("Enforcement: %s created, %s updated, %s rows rejected\n" % (summary["enforcement_created"], summary["enforcement_updated"], summary["enforcement_rejects"]))
+        if summary["quarantine"]:
+            with open(options["quarantine_file"], "wb") as quarantine_file:
+                json.dump(summary["quarantine"], quarantine_file, indent=4, default=str)
+            self.stdout.write("%s usage rows quarantined, see %s\n" % (len(summary["quarantine"]), options["quarantine_file"]))
+        self.stdout.write("Supplier names: %(hits)s cache hits, %(misses)s normalized\n" % summary["supplier_cache"])
+        self.stdout.write("Parse cache: %(hits)s hits, %(misses)s misses\n" % summary["parse_cache"])
+        self.stdout.write("Supplier aliases: %(learned)s new spellings learned, %(skipped)s rows skipped, %(held)s rows held for review\n" % summary["aliases"])
+        for alias in summary["aliases"]["flagged"]:
+            self.stdout.write("    %(raw_name)s looks like %(suggested_slug)s (%(suggestion_score)s), see the supplier_aliases command\n" % alias)
+        self.stdout.write("Snapshots written for %s releases\n" % (len(summary["snapshots"])))
+        for release in summary["skipped"]:
+            self.stdout.write("Skipped %s: %s\n" % (os.path.basename(release["file_path"]), release["error"]))
+        self.stdout.write("\nTask finished at %s\n" % str(datetime.datetime.now()))
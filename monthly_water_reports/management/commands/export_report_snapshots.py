@@ -0,0 +1,34 @@
+from __future__ import division
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+import datetime
+import logging
+from monthly_water_reports.models import WaterSupplierMonthlyReport
+from monthly_water_reports.snapshot_methods import ReportSnapshotMethods
+
+logger = logging.getLogger("cali_water_reports")
+
+class Command(BaseCommand):
+    help = "Write a columnar snapshot of every usage release in the database, or only the latest one"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--latest",
+            action="store_true",
+            dest="latest",
+            default=False,
+            help="Only snapshot the most recent release."
+        )
+
+    def handle(self, *args, **options):
+        task_run = ReportSnapshotMethods()
+        started = time.time()
+        report_dates = sorted(WaterSupplierMonthlyReport.objects.order_by().values_list("report_date", flat=True).distinct())
+        if options["latest"]:
+            report_dates = report_dates[-1:]
+        for report_date in report_dates:
+            manifest = task_run._can_export_release(report_date)
+            self.stdout.write("%s  %s rows, %s suppliers\n" % (report_date, manifest["rows"], manifest["suppliers"]))
+        self.stdout.write("\nWrote %s snapshots to %s in %.2f seconds\n" % (len(report_dates), task_run.snapshot_path, time.time() - started))
+        self.stdout.write("\nTask finished at %s\n" % str(datetime.datetime.now()))
@@ -4,13 +4,81 @@ from django.core.management.base import BaseCommand
 import time
 import datetime
 import logging
+import os.path
+import json
+from monthly_water_reports.timing_methods import StageTimer
 from monthly_water_reports.fetch_enforcement_stats import LoadMonthlyEnforcementStats
 
 logger = logging.getLogger("cali_water_reports")
 
 class Command(BaseCommand):
     help = "Begin a request to State Water Resources Board for latest usage report"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            action="store",
+            dest="local_file",
+            default=None,
+            help="Ingest a workbook already on disk, such as one in monthly_water_reports/data, instead of downloading settings.USAGE_FILE."
+        )
+        parser.add_argument(
+            "--streaming",
+            action="store_true",
+            dest="streaming",
+            default=False,
+            help="Read worksheet rows directly with openpyxl instead of converting the workbook to csv with In2CSV."
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            dest="force",
+            default=False,
+            help="Download and ingest the release even if it matches the one ingested last time."
+        )
+        parser.add_argument(
+            "--timings-file",
+            action="store",
+            dest="timings_file",
+            default=os.path.join(settings.FILE_DOWNLOAD_PATH, "fetch_enforcement_stats_timings.json"),
+            help="Where to write the time spent in each stage of the run as json."
+        )
+        parser.add_argument(
+            "--rejects-file",
+            action="store",
+            dest="rejects_file",
+            default=os.path.join(settings.FILE_DOWNLOAD_PATH, "fetch_enforcement_stats_rejects.json"),
+            help="Where to write the rows that couldn't be loaded as json."
+        )
+
     def handle(self, *args, **options):
         task_run = LoadMonthlyEnforcementStats()
-        task_run._init()
+        # -v 2 swaps per-row logging for a progress line every thousand rows
+        timer = StageTimer(progress_every=1000 if options["verbosity"] > 1 else 0, write=self.stdout.write)
+        started = time.time()
+        summary = task_run._init(local_file=options["local_file"], streaming=options["streaming"], force=options["force"], timer=timer)
+        seconds = time.time() - started
+        if summary.get("unchanged_release"):
+            self.stdout.write("\nNo new release has been published since the last ingest\n")
+        rows_per_second = summary["rows"] / seconds if seconds else 0
+        self.stdout.write("\n%s rows ingested in %.2f seconds (%.1f rows/sec)\n" % (summary["rows"], seconds, rows_per_second))
+        if "created" in summary:
+            self.stdout.write("%s new, %s revised, %s unchanged rows in the release\n" % (summary["new"], summary["revised"], summary["unchanged"]))
+            self.stdout.write("%s rows created, %s updated\n" % (summary["created"], summary["updated"]))
+        if summary.get("rejects"):
+            with open(options["rejects_file"], "wb") as rejects_file:
+                json.dump(summary["rejects"], rejects_file, indent=4, default=str)
+            self.stdout.write("%s rows rejected, see %s\n" % (len(summary["rejects"]), options["rejects_file"]))
+            for reject in summary["rejects"][:10]:
+                self.stdout.write("    line %(line)s: %(error)s\n" % reject)
+        if "parse_cache" in summary and summary["parse_cache"]["hits"]:
+            self.stdout.write("Parsed rows read from the parse cache\n")
+        if "supplier_cache" in summary:
+            self.stdout.write("Supplier names: %(hits)s cache hits, %(misses)s normalized\n" % summary["supplier_cache"])
+        if "aliases" in summary:
+            self.stdout.write("Supplier aliases: %(learned)s new spellings learned, %(skipped)s rows skipped, %(held)s rows held for review\n" % summary["aliases"])
+            for alias in summary["aliases"]["flagged"]:
+                self.stdout.write("    %(raw_name)s looks like %(suggested_slug)s (%(suggestion_score)s), see the supplier_aliases command\n" % alias)
+        self.stdout.write("\n%s" % timer._can_format_stages())
+        timer._can_write_stages_to(options["timings_file"], command="fetch_enforcement_stats", summary=dict(summary, rejects=len(summary.get("rejects", []))), seconds=seconds)
         self.stdout.write("\nTask finished at %s\n" % str(datetime.datetime.now()))
@@ -0,0 +1,67 @@
+from __future__ import division
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+import datetime
+import logging
+import os.path
+from monthly_water_reports.fetch_releases import FetchReleaseManifest
+
+logger = logging.getLogger("cali_water_reports")
+
+class Command(BaseCommand):
+    help = "Download past releases from the State Water Resources Board into the data folder"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--manifest",
+            action="store",
+            dest="manifest",
+            default=None,
+            help="A text file with one release url per line. Defaults to the releases listed in monthly_water_reports/fetch_releases.py."
+        )
+        parser.add_argument(
+            "--data-path",
+            action="store",
+            dest="data_path",
+            default=None,
+            help="Save releases to this directory instead of settings.DATA_PATH."
+        )
+        parser.add_argument(
+            "--connections",
+            action="store",
+            dest="max_connections",
+            type=int,
+            default=None,
+            help="Number of releases to download at once."
+        )
+        parser.add_argument(
+            "--delay",
+            action="store",
+            dest="host_delay_seconds",
+            type=float,
+            default=FetchReleaseManifest.host_delay_seconds,
+            help="Seconds to wait between requests to the same host."
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            dest="force",
+            default=False,
+            help="Download releases that are already in the data folder again."
+        )
+
+    def handle(self, *args, **options):
+        urls = None
+        if options["manifest"]:
+            with open(options["manifest"], "rb") as manifest:
+                urls = [line.strip() for line in manifest if line.strip() and not line.startswith("#")]
+        task_run = FetchReleaseManifest()
+        summary = task_run._init(urls=urls, data_path=options["data_path"], max_connections=options["max_connections"], host_delay_seconds=options["host_delay_seconds"], force=options["force"])
+        for release in summary["releases"]:
+            if release["status"] == "failed":
+                self.stdout.write("failed      %s after %s attempts: %s\n" % (release["url"], release["attempts"], release["error"]))
+            else:
+                self.stdout.write("%-11s %s\n" % (release["status"], os.path.basename(release["file_path"])))
+        self.stdout.write("\n%s downloaded, %s already archived, %s failed in %.2f seconds\n" % (summary["downloaded"], summary["exists"], summary["failed"], summary["seconds"]))
+        self.stdout.write("\nTask finished at %s\n" % str(datetime.datetime.now()))
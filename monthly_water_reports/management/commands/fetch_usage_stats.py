@@ -4,13 +4,97 @@ from django.core.management.base import BaseCommand
 import time
 import datetime
 import logging
+import os.path
+import json
+from monthly_water_reports.timing_methods import StageTimer
 from monthly_water_reports.fetch_usage_stats import BuildMonthlyWaterUseReport
 
 logger = logging.getLogger("cali_water_reports")
 
 class Command(BaseCommand):
     help = "Begin a request to State Water Resources Board for latest usage report"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            action="store",
+            dest="local_file",
+            default=None,
+            help="Ingest a workbook already on disk, such as one in monthly_water_reports/data, instead of downloading settings.USAGE_FILE."
+        )
+        parser.add_argument(
+            "--row-by-row",
+            action="store_true",
+            dest="row_by_row",
+            default=False,
+            help="Save each row with get_or_create instead of batched inserts and updates."
+        )
+        parser.add_argument(
+            "--streaming",
+            action="store_true",
+            dest="streaming",
+            default=False,
+            help="Read worksheet rows directly with openpyxl instead of converting the workbook to csv with In2CSV."
+        )
+        parser.add_argument(
+            "--pipelined",
+            action="store_true",
+            dest="pipelined",
+            default=False,
+            help="Parse the workbook in a worker process while earlier batches are staged. Only worth it with a spare core."
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            dest="force",
+            default=False,
+            help="Download and ingest the release even if it matches the one ingested last time."
+        )
+        parser.add_argument(
+            "--timings-file",
+            action="store",
+            dest="timings_file",
+            default=os.path.join(settings.FILE_DOWNLOAD_PATH, "fetch_usage_stats_timings.json"),
+            help="Where to write the time spent in each stage of the run as json."
+        )
+        parser.add_argument(
+            "--quarantine-file",
+            action="store",
+            dest="quarantine_file",
+            default=os.path.join(settings.FILE_DOWNLOAD_PATH, "fetch_usage_stats_quarantine.json"),
+            help="Where to write the rows held back by screening as json."
+        )
+
     def handle(self, *args, **options):
         task_run = BuildMonthlyWaterUseReport()
-        task_run._init()
+        # -v 2 swaps per-row logging for a progress line every thousand rows
+        timer = StageTimer(progress_every=1000 if options["verbosity"] > 1 else 0, write=self.stdout.write)
+        started = time.time()
+        summary = task_run._init(local_file=options["local_file"], row_by_row=options["row_by_row"], streaming=options["streaming"], pipelined=options["pipelined"], force=options["force"], timer=timer)
+        seconds = time.time() - started
+        if summary.get("unchanged_release"):
+            self.stdout.write("\nNo new release has been published since the last ingest\n")
+        rows_per_second = summary["rows"] / seconds if seconds else 0
+        self.stdout.write("\n%s rows ingested in %.2f seconds (%.1f rows/sec)\n" % (summary["rows"], seconds, rows_per_second))
+        if "created" in summary:
+            self.stdout.write("%s new, %s revised, %s unchanged rows in the release\n" % (summary["new"], summary["revised"], summary["unchanged"]))
+            self.stdout.write("%s rows created, %s updated\n" % (summary["created"], summary["updated"]))
+        if summary.get("quarantine"):
+            with open(options["quarantine_file"], "wb") as quarantine_file:
+                json.dump(summary["quarantine"], quarantine_file, indent=4, default=str)
+            self.stdout.write("%s rows quarantined, see %s\n" % (len(summary["quarantine"]), options["quarantine_file"]))
+            for report in summary["quarantine"][:10]:
+                self.stdout.write("    %s %s: %s\n" % (report["supplier_slug"], report["reporting_month"], ", ".join(report["checks"])))
+        if "parse_cache" in summary and summary["parse_cache"]["hits"]:
+            self.stdout.write("Parsed rows read from the parse cache\n")
+        if "supplier_cache" in summary:
+            self.stdout.write("Supplier names: %(hits)s cache hits, %(misses)s normalized\n" % summary["supplier_cache"])
+        if "aliases" in summary:
+            self.stdout.write("Supplier aliases: %(learned)s new spellings learned, %(skipped)s rows skipped, %(held)s rows held for review\n" % summary["aliases"])
+            for alias in summary["aliases"]["flagged"]:
+                self.stdout.write("    %(raw_name)s looks like %(suggested_slug)s (%(suggestion_score)s), see the supplier_aliases command\n" % alias)
+        if summary.get("snapshot"):
+            self.stdout.write("Snapshot of %(rows)s rows for the %(report_date)s release written\n" % summary["snapshot"])
+        self.stdout.write("\n%s" % timer._can_format_stages())
+        timer._can_write_stages_to(options["timings_file"], command="fetch_usage_stats", summary=dict(summary, quarantine=len(summary.get("quarantine", []))), seconds=seconds)
         self.stdout.write("\nTask finished at %s\n" % str(datetime.datetime.now()))
@@ -0,0 +1,37 @@
+from __future__ import division
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+import datetime
+import logging
+import os.path
+from monthly_water_reports.models import ReleaseCatalog
+from monthly_water_reports.catalog_methods import ReleaseCatalogMethods
+
+logger = logging.getLogger("cali_water_reports")
+
+class Command(BaseCommand):
+    help = "Catalog the release workbooks in the data folder and list the ones that haven't been ingested"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--data-path",
+            action="store",
+            dest="data_path",
+            default=None,
+            help="Catalog the xlsx files in this directory instead of settings.DATA_PATH."
+        )
+
+    def handle(self, *args, **options):
+        task_run = ReleaseCatalogMethods()
+        started = time.time()
+        summary = task_run._can_refresh_catalog(data_path=options["data_path"])
+        self.stdout.write("\nCataloged releases in %.2f seconds: %s added, %s changed, %s unchanged, %s removed\n" % (time.time() - started, summary["added"], summary["changed"], summary["unchanged"], summary["removed"]))
+        for release in summary["skipped"]:
+            self.stdout.write("Skipped %s: %s\n" % (os.path.basename(release["file_path"]), release["error"]))
+        pending = ReleaseCatalog.objects.filter(ingested_date__isnull=True).order_by("release_date", "file_name")
+        if pending:
+            self.stdout.write("\nNot yet ingested:\n")
+            for release in pending:
+                self.stdout.write("%s  %-12s %s\n" % (release.release_date, release.file_type, release.file_name))
+        self.stdout.write("\nTask finished at %s\n" % str(datetime.datetime.now()))
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import datetime
+import logging
+from monthly_water_reports.models import WaterSupplierAlias
+from monthly_water_reports.alias_methods import SupplierAliasIndex
+
+logger = logging.getLogger("cali_water_reports")
+
+class Command(BaseCommand):
+    help = "List the supplier name spellings held for review, or settle one. Ingest the release again afterwards to load its rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--accept",
+            action="store",
+            dest="accept",
+            default=None,
+            help="Point this published name at the supplier it was suggested for."
+        )
+        parser.add_argument(
+            "--new",
+            action="store",
+            dest="new",
+            default=None,
+            help="Treat this published name as a supplier of its own."
+        )
+        parser.add_argument(
+            "--skip",
+            action="store",
+            dest="skip",
+            default=None,
+            help="Leave rows published under this name out of future ingests."
+        )
+
+    def handle(self, *args, **options):
+        task_run = SupplierAliasIndex()
+        if options["accept"]:
+            alias = task_run._can_settle_alias(options["accept"], accept=True)
+            self.stdout.write("%s now points at %s\n" % (alias.raw_name, alias.supplier_slug))
+        elif options["new"]:
+            alias = task_run._can_settle_alias(options["new"])
+            self.stdout.write("%s is now its own supplier, %s\n" % (alias.raw_name, alias.supplier_slug))
+        elif options["skip"]:
+            alias = task_run._can_settle_alias(options["skip"], skip=True)
+            self.stdout.write("%s will be skipped\n" % (alias.raw_name))
+        else:
+            held = WaterSupplierAlias.objects.filter(needs_review=True).order_by("created_date", "raw_name")
+            self.stdout.write("\n%s spellings held for review\n" % (held.count()))
+            for alias in held:
+                self.stdout.write("%s  %s looks like %s (%s)\n" % (alias.created_date.date(), alias.raw_name, alias.suggested_slug, alias.suggestion_score))
+        self.stdout.write("\nTask finished at %s\n" % str(datetime.datetime.now()))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import calendar
+
+# gallons in one of each unit the state water board published when this migration was written
+unit_to_gallons = {
+    "G": 1,
+    "MG": 1000000,
+    "CCF": 748,
+    "AF": 325851,
+}
+
+
+def convert_to_gallons(value, units):
+    if value is None:
+        return None
+    return value * unit_to_gallons.get((units or "G").upper(), 1)
+
+
+def make_residential_gallons(gallons, percent_residential_use):
+    if gallons is None or percent_residential_use is None:
+        return None
+    return gallons * percent_residential_use
+
+
+def make_canonical_values_from(report):
+    # a copy of UnitConversionMethods._can_make_canonical_values_from as it stood when this migration was written
+    reporting_month = report.reporting_month
+    return {
+        "production_gallons_2014": convert_to_gallons(report.total_monthly_potable_water_production_2014, report.units),
+        "production_gallons_2013": convert_to_gallons(report.total_monthly_potable_water_production_2013, report.units),
+        "days_in_month": calendar.monthrange(reporting_month.year, reporting_month.month)[1] if reporting_month else None,
+        "residential_gallons_2014": make_residential_gallons(report.calculated_production_monthly_gallons_month_2014, report.percent_residential_use),
+        "residential_gallons_2013": make_residential_gallons(report.calculated_production_monthly_gallons_month_2013, report.percent_residential_use),
+    }
+
+
+def fill_canonical_values(apps, schema_editor):
+    WaterSupplierMonthlyReport = apps.get_model("monthly_water_reports", "WaterSupplierMonthlyReport")
+    fields = [
+        "reporting_month",
+        "units",
+        "total_monthly_potable_water_production_2014",
+        "total_monthly_potable_water_production_2013",
+        "calculated_production_monthly_gallons_month_2014",
+        "calculated_production_monthly_gallons_month_2013",
+        "percent_residential_use",
+    ]
+    for report in WaterSupplierMonthlyReport.objects.only("id", *fields).iterator():
+        WaterSupplierMonthlyReport.objects.filter(id=report.id).update(**make_canonical_values_from(report))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monthly_water_reports', '0009_auto_20170315_1139'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='watersuppliermonthlyreport',
+            name='days_in_month',
+            field=models.IntegerField(null=True, verbose_name=b'Days in Reporting Month', blank=True),
+        ),
+        migrations.AddField(
+            model_name='watersuppliermonthlyreport',
+            name='production_gallons_2013',
+            field=models.FloatField(null=True, verbose_name=b'Reported Production 2013 in Gallons', blank=True),
+        ),
+        migrations.AddField(
+            model_name='watersuppliermonthlyreport',
+            name='production_gallons_2014',
+            field=models.FloatField(null=True, verbose_name=b'Reported Production Reporting Month in Gallons', blank=True),
+        ),
+        migrations.AddField(
+            model_name='watersuppliermonthlyreport',
+            name='residential_gallons_2013',
+            field=models.FloatField(null=True, verbose_name=b'Residential Gallons 2013', blank=True),
+        ),
+        migrations.AddField(
+            model_name='watersuppliermonthlyreport',
+            name='residential_gallons_2014',
+            field=models.FloatField(null=True, verbose_name=b'Residential Gallons Reporting Month', blank=True),
+        ),
+        migrations.RunPython(fill_canonical_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import datetime
+import hashlib
+import json
+
+# the fields each fingerprint covered when this migration was written
+report_fields = (
+    "stage_invoked",
+    "mandatory_restrictions",
+    "total_monthly_potable_water_production_2014",
+    "total_monthly_potable_water_production_2013",
+    "units",
+    "qualification",
+    "total_population_served",
+    "reported_rgpcd",
+    "enforcement_actions",
+    "implementation",
+    "recycled_water",
+    "recycled_water_units",
+    "calculated_production_monthly_gallons_month_2014",
+    "calculated_production_monthly_gallons_month_2013",
+    "calculated_rgpcd_2014",
+    "percent_residential_use",
+    "production_gallons_2014",
+    "production_gallons_2013",
+    "residential_gallons_2014",
+    "residential_gallons_2013",
+    "days_in_month",
+    "comments_or_corrections",
+    "hydrologic_region",
+    "hydrologic_region_slug",
+)
+
+enforcement_fields = (
+    "reported_to_state_date",
+    "supplier_name",
+    "hydrologic_region",
+    "hydrologic_region_slug",
+    "enforcement_comments",
+    "mandatory_restrictions",
+    "total_population_served",
+    "supplier_id",
+    "water_days_allowed_week",
+    "complaints_received",
+    "follow_up_actions",
+    "warnings_issued",
+    "penalties_assessed",
+)
+
+
+def fingerprint(values, fields):
+    # a copy of BulkUpsertMethods._can_fingerprint as it stood when this migration was written
+    parts = []
+    for field in fields:
+        value = values.get(field)
+        if isinstance(value, bool):
+            pass
+        elif isinstance(value, (int, long, float)):
+            value = float(value)
+        elif isinstance(value, datetime.date):
+            value = value.isoformat()
+        elif isinstance(value, str):
+            value = value.decode("utf-8")
+        parts.append(value)
+    return hashlib.sha1(json.dumps(parts)).hexdigest()
+
+
+def fill_fingerprints(apps, schema_editor):
+    for model_name, fields in [("WaterSupplierMonthlyReport", report_fields), ("WaterEnforcementMonthlyReport", enforcement_fields)]:
+        model = apps.get_model("monthly_water_reports", model_name)
+        for values in model.objects.values("id", *fields).iterator():
+            model.objects.filter(id=values["id"]).update(fingerprint=fingerprint(values, fields))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monthly_water_reports', '0010_watersuppliermonthlyreport_canonical_gallons'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='waterenforcementmonthlyreport',
+            name='fingerprint',
+            field=models.CharField(max_length=40, null=True, verbose_name=b'Fingerprint of Reported Values', blank=True),
+        ),
+        migrations.AddField(
+            model_name='watersuppliermonthlyreport',
+            name='fingerprint',
+            field=models.CharField(max_length=40, null=True, verbose_name=b'Fingerprint of Reported Values', blank=True),
+        ),
+        migrations.RunPython(fill_fingerprints, migrations.RunPython.noop),
+    ]
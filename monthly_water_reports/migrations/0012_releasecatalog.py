@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monthly_water_reports', '0011_report_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReleaseCatalog',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('file_name', models.CharField(unique=True, max_length=255, verbose_name=b'File Name', db_index=True)),
+                ('file_path', models.CharField(max_length=1024, verbose_name=b'Path to File')),
+                ('release_date', models.DateField(verbose_name=b'Release Date', db_index=True)),
+                ('file_type', models.CharField(db_index=True, max_length=255, verbose_name=b'File Type', choices=[(b'usage', b'Usage'), (b'enforcement', b'Enforcement')])),
+                ('sha256', models.CharField(max_length=64, verbose_name=b'SHA-256 of File', db_index=True)),
+                ('file_size', models.IntegerField(null=True, verbose_name=b'File Size in Bytes', blank=True)),
+                ('row_count', models.IntegerField(null=True, verbose_name=b'Rows Ingested', blank=True)),
+                ('ingested_date', models.DateTimeField(db_index=True, null=True, verbose_name=b'Date Ingested', blank=True)),
+                ('ingest_seconds', models.FloatField(null=True, verbose_name=b'Seconds to Ingest', blank=True)),
+                ('cataloged_date', models.DateTimeField(default=datetime.datetime.now, verbose_name=b'Date Cataloged')),
+            ],
+        ),
+    ]
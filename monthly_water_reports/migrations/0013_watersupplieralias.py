@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import datetime
+
+
+def seed_aliases(apps, schema_editor):
+    WaterSupplierAlias = apps.get_model("monthly_water_reports", "WaterSupplierAlias")
+    # the rename and skip lists that used to be hardcoded in the ingest classes
+    # keyed on the names as the state's workbooks spell them
+    WaterSupplierAlias.objects.create(raw_name="San Bernardino County Service Area 70J", supplier_name="san bernardino county service area 70", supplier_slug="san-bernardino-county-service-area-70")
+    for raw_name in ["Coalinga City of", "Mountain House Community Services District", "Cloverdale", ""]:
+        WaterSupplierAlias.objects.create(raw_name=raw_name, skip=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monthly_water_reports', '0012_releasecatalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaterSupplierAlias',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('raw_name', models.CharField(unique=True, max_length=255, verbose_name=b'Published Supplier Name', db_index=True)),
+                ('supplier_name', models.CharField(max_length=255, null=True, verbose_name=b'Water Supplier Name', blank=True)),
+                ('supplier_slug', models.SlugField(max_length=255, null=True, verbose_name=b'Water Supplier Slug', blank=True)),
+                ('skip', models.BooleanField(default=False, verbose_name=b'Leave Out of Ingests')),
+                ('needs_review', models.BooleanField(default=False, db_index=True, verbose_name=b'Spelling Needs Review')),
+                ('suggested_slug', models.SlugField(max_length=255, null=True, verbose_name=b'Suggested Water Supplier Slug', blank=True)),
+                ('suggestion_score', models.FloatField(null=True, verbose_name=b'Suggestion Similarity', blank=True)),
+                ('created_date', models.DateTimeField(default=datetime.datetime.now, verbose_name=b'Date Created')),
+            ],
+        ),
+        migrations.RunPython(seed_aliases, migrations.RunPython.noop),
+    ]
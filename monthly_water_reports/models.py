@@ -104,9 +104,15 @@ class WaterSupplierMonthlyReport(models.Model):
     calculated_rgpcd_2014 = models.FloatField("CALCULATED RGPCD 2014 (Values calculated by Water Board staff using methodology available at http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/ws_tools/guidance_estimate_res_gpcd.pdf)", db_index=True, null=True, blank=True)
     calculated_rgpcd_2013 = models.FloatField("CALCULATED RGPCD 2013 (Values calculated by Water Board staff using methodology available at http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/ws_tools/guidance_estimate_res_gpcd.pdf)", db_index=True, null=True, blank=True)
     percent_residential_use = models.FloatField("Percent Residential Use", null=True, blank=True)
+    production_gallons_2014 = models.FloatField("Reported Production Reporting Month in Gallons", null=True, blank=True)
+    production_gallons_2013 = models.FloatField("Reported Production 2013 in Gallons", null=True, blank=True)
+    residential_gallons_2014 = models.FloatField("Residential Gallons Reporting Month", null=True, blank=True)
+    residential_gallons_2013 = models.FloatField("Residential Gallons 2013", null=True, blank=True)
+    days_in_month = models.IntegerField("Days in Reporting Month", null=True, blank=True)
     comments_or_corrections = models.TextField("Comments or Corrections", null=True, blank=True)
     hydrologic_region = models.CharField("Hydrologic Region", db_index=True, max_length=255, null=True, blank=True)
     hydrologic_region_slug = models.SlugField("Hydrologic Region Slug", db_index=True, max_length=255, null=True, blank=True)
+    fingerprint = models.CharField("Fingerprint of Reported Values", max_length=40, null=True, blank=True)
 
     def __unicode__(self):
         return self.supplier_name_id
@@ -133,6 +139,7 @@ class WaterEnforcementMonthlyReport(models.Model):
     warnings_issued = models.IntegerField("Warnings Issued", null=True, blank=True)
     penalties_assessed = models.IntegerField("Penalties Assessed", null=True, blank=True)
     enforcement_comments = models.TextField("Enforcement Comments", null=True, blank=True)
+    fingerprint = models.CharField("Fingerprint of Reported Values", max_length=40, null=True, blank=True)
 
     def __unicode__(self):
         return self.supplier_name
@@ -141,6 +148,48 @@ class WaterEnforcementMonthlyReport(models.Model):
         super(WaterEnforcementMonthlyReport, self).save(*args, **kwargs)
 
 
+# model for the spellings of a water supplier's name in state releases
+class WaterSupplierAlias(models.Model):
+    raw_name = models.CharField("Published Supplier Name", db_index=True, unique=True, max_length=255)
+    supplier_name = models.CharField("Water Supplier Name", max_length=255, null=True, blank=True)
+    supplier_slug = models.SlugField("Water Supplier Slug", db_index=True, max_length=255, null=True, blank=True)
+    skip = models.BooleanField("Leave Out of Ingests", default=False)
+    needs_review = models.BooleanField("Spelling Needs Review", db_index=True, default=False)
+    suggested_slug = models.SlugField("Suggested Water Supplier Slug", max_length=255, null=True, blank=True)
+    suggestion_score = models.FloatField("Suggestion Similarity", null=True, blank=True)
+    created_date = models.DateTimeField("Date Created", default=datetime.datetime.now)
+
+    def __unicode__(self):
+        return self.raw_name
+
+    def save(self, *args, **kwargs):
+        super(WaterSupplierAlias, self).save(*args, **kwargs)
+
+
+# model for a state water board release archived in the data folder
+class ReleaseCatalog(models.Model):
+    FILE_TYPE_CHOICES = (
+        ("usage", "Usage"),
+        ("enforcement", "Enforcement"),
+    )
+    file_name = models.CharField("File Name", db_index=True, unique=True, max_length=255)
+    file_path = models.CharField("Path to File", max_length=1024)
+    release_date = models.DateField("Release Date", db_index=True)
+    file_type = models.CharField("File Type", db_index=True, max_length=255, choices=FILE_TYPE_CHOICES)
+    sha256 = models.CharField("SHA-256 of File", db_index=True, max_length=64)
+    file_size = models.IntegerField("File Size in Bytes", null=True, blank=True)
+    row_count = models.IntegerField("Rows Ingested", null=True, blank=True)
+    ingested_date = models.DateTimeField("Date Ingested", db_index=True, null=True, blank=True)
+    ingest_seconds = models.FloatField("Seconds to Ingest", null=True, blank=True)
+    cataloged_date = models.DateTimeField("Date Cataloged", default=datetime.datetime.now)
+
+    def __unicode__(self):
+        return self.file_name
+
+    def save(self, *args, **kwargs):
+        super(ReleaseCatalog, self).save(*args, **kwargs)
+
+
 # model for how consumers can conserve water
 class WaterConservationMethod(models.Model):
     method_name = models.CharField("Water Conservation Method Name", max_length=255, null=True, blank=True)
@@ -0,0 +1,192 @@
+from __future__ import division
+from django.db import connections
+import multiprocessing
+import cPickle as pickle
+import traceback
+import Queue
+import logging
+import time
+
+logger = logging.getLogger("cali_water_reports")
+
+class ReleasePipeline(object):
+    """
+    reads and parses a release in a worker process while the calling process writes it
+    parsed rows are handed over in batches through a bounded queue so the parser can
+    only get queue_size batches ahead of the writer, and an error on either side stops the other
+    parsing is pure python so a thread would wait on the writer for the interpreter lock,
+    and the writer stays in the calling process since the database connection and staging table belong to it
+    """
+
+    batch_size = 500
+
+    queue_size = 8
+
+    # how often a parser waiting on a full queue checks whether the writer has stopped
+    put_timeout = 0.5
+
+    # how often the writer waiting on an empty queue checks that the worker is still running
+    get_timeout = 0.5
+
+    # the stages the parser records, sent back to the writer's timer when it finishes
+    parser_stages = ["read", "parse", "wait"]
+
+    def __init__(self, timer=None, batch_size=None, queue_size=None):
+        self.timer = timer
+        self.batch_size = batch_size or self.batch_size
+        self.queue_size = queue_size or self.queue_size
+        self.report = None
+        self.worker = None
+
+
+    def _can_start(self, rows, report=None):
+        """
+        fork the worker that pulls rows, it must only do cpu work and never touch the database
+        call report in the worker once rows run out to send back anything else worth keeping
+        start it before the writer sets up anything that lives on its database connection, such
+        as a temporary table, since the writer lets go of that connection first
+        """
+        # a forked worker would otherwise share the writer's database socket, the writer opens
+        # a new connection on its next query, and one inside a transaction is kept since the
+        # worker never queries and exits without closing it
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+        self.batches = multiprocessing.Queue(maxsize=self.queue_size)
+        self.stopped = multiprocessing.Event()
+        self.worker = multiprocessing.Process(target=self._can_fill_queue_from, args=(rows, self.batches, self.stopped, report))
+        self.worker.daemon = True
+        self.worker.start()
+
+
+    def _can_iterate_batches_from(self, rows, report=None):
+        """
+        start the worker on rows and yield its batches, see _can_start and _can_iterate_batches
+        """
+        self._can_start(rows, report=report)
+        for batch in self._can_iterate_batches():
+            yield batch
+
+
+    def _can_iterate_batches(self):
+        """
+        yield lists of up to batch_size rows as the started worker pulls them from rows
+        an exception raised in the worker is raised again here, a worker that dies without
+        finishing raises RuntimeError, and leaving the loop early, or raising inside it, stops the worker
+        """
+        batches, worker = self.batches, self.worker
+        try:
+            while True:
+                kind, payload = self._can_get(batches, worker)
+                if kind == "batch":
+                    yield payload
+                elif kind == "error":
+                    logger.error("parsing failed in the pipeline worker\n%s" % (payload[1]))
+                    raise payload[0]
+                else:
+                    self._can_merge_parser_stages(payload["stages"])
+                    self.report = payload["report"]
+                    break
+        finally:
+            self._can_stop()
+
+
+    def _can_stop(self):
+        """
+        stop the worker if it is still running, safe to call more than once
+        """
+        if self.worker is None:
+            return
+        self.stopped.set()
+        self.worker.join(self.put_timeout * 4)
+        if self.worker.is_alive():
+            self.worker.terminate()
+
+
+    def _can_fill_queue_from(self, rows, batches, stopped, report=None):
+        """
+        runs in the worker process, time spent waiting on a full queue is
+        taken out of the parse stage and credited to wait
+        """
+        before = self._can_copy_parser_stages()
+        started = time.time()
+        waited = 0
+        count = 0
+        try:
+            batch = []
+            for data in rows:
+                batch.append(data)
+                if len(batch) >= self.batch_size:
+                    count += len(batch)
+                    put_started = time.time()
+                    if not self._can_put(batches, ("batch", batch), stopped):
+                        return
+                    waited += time.time() - put_started
+                    batch = []
+            count += len(batch)
+            if batch and not self._can_put(batches, ("batch", batch), stopped):
+                return
+            if self.timer is not None:
+                self.timer._can_add_to_stage("parse", time.time() - started, rows=count)
+                self.timer._can_add_to_stage("wait", waited, within="parse")
+            after = self._can_copy_parser_stages()
+            stages = {name: {key: (after[name][key] or 0) - (before[name][key] or 0) for key in ("seconds", "rows")} for name in after}
+            self._can_put(batches, ("done", {"stages": stages, "report": report() if report else None}), stopped)
+        except Exception, exception:
+            error = (exception, traceback.format_exc())
+            try:
+                pickle.dumps(exception)
+            except Exception:
+                error = (RuntimeError("%s %s" % (exception.__class__.__name__, exception)), error[1])
+            self._can_put(batches, ("error", error), stopped)
+
+
+    def _can_get(self, batches, worker):
+        """
+        block until the worker sends something, raising if it was killed or crashed instead
+        """
+        while True:
+            try:
+                return batches.get(timeout=self.get_timeout)
+            except Queue.Empty:
+                if worker.is_alive():
+                    continue
+            # whatever it sent before exiting may still be on its way through the pipe
+            try:
+                return batches.get(timeout=self.get_timeout)
+            except Queue.Empty:
+                raise RuntimeError("the pipeline worker exited with code %s before it finished" % (worker.exitcode))
+
+
+    def _can_put(self, batches, item, stopped):
+        """
+        block until there is room in the queue unless the writer has stopped
+        """
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=self.put_timeout)
+                return True
+            except Queue.Full:
+                continue
+        # nobody is reading, so the worker exits without flushing what is still queued
+        batches.cancel_join_thread()
+        return False
+
+
+    def _can_copy_parser_stages(self):
+        """
+        """
+        if self.timer is None:
+            return {}
+        return {name: dict(self.timer._can_get_stage(name)) for name in self.parser_stages}
+
+
+    def _can_merge_parser_stages(self, stages):
+        """
+        add what the worker's copy of the timer recorded to the writer's
+        """
+        if self.timer is None:
+            return
+        for name in self.parser_stages:
+            if name in stages:
+                self.timer._can_add_to_stage(name, stages[name]["seconds"], rows=stages[name]["rows"] or None)
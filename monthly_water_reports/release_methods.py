@@ -0,0 +1,130 @@
+from __future__ import division
+from django.conf import settings
+from django.db.models import Max
+from monthly_water_reports.models import WaterSupplierMonthlyReport
+import logging
+import uuid
+import os
+import os.path
+
+logger = logging.getLogger("cali_water_reports")
+
+class DataVersion(object):
+    """
+    a token each ingest changes when it writes reports, so anything worked out
+    from the stored reports can tell when it has gone stale
+    it lives in a file because the ingest and the build run in different processes
+    """
+
+    def __init__(self, version_path=None):
+        self.version_path = version_path or getattr(settings, "DATA_VERSION_PATH", None) or os.path.join(settings.FILE_DOWNLOAD_PATH, "data_version")
+
+
+    def _can_get_token(self):
+        """
+        the current token or None before the first ingest writes one
+        """
+        try:
+            with open(self.version_path, "rb") as version_file:
+                return version_file.read().strip() or None
+        except IOError:
+            return None
+
+
+    def _can_bump(self):
+        """
+        write a new token, swapped in so a reader never sees half of one
+        call it once the reports are committed or a build could cache the release before them
+        """
+        token = uuid.uuid4().hex
+        building_path = "%s.building-%s" % (self.version_path, os.getpid())
+        with open(building_path, "wb") as version_file:
+            version_file.write(token)
+        os.rename(building_path, self.version_path)
+        return token
+
+
+class CurrentRelease(object):
+    """
+    works out which stored rows make up the latest release, for the state and each
+    hydrologic region, once per data version and shares it with every view in the process
+    """
+
+    # resolved releases by data version token, shared by every instance
+    releases = {}
+
+    def __init__(self, version=None):
+        self.version = version or DataVersion()
+
+
+    def _can_get(self, hydrologic_region=None):
+        """
+        the report date, latest month of data, months in the report newest first and the ids
+        of the latest month's rows for a region, or the whole state when no region is passed
+        a region's latest release is worked out from its own rows as the region pages always have
+        regions are matched ignoring case and surrounding spaces and one with no rows gets None
+        """
+        token = self.version._can_get_token()
+        if token not in self.releases:
+            self.releases.clear()
+            self.releases[token] = self._can_resolve()
+        if hydrologic_region is None:
+            return self.releases[token]["state"]
+        return self.releases[token]["regions"].get(self._can_make_region_key(hydrologic_region))
+
+
+    def _can_make_region_key(self, hydrologic_region):
+        """
+        the database matched region names without regard to case so the lookup does too
+        """
+        return (hydrologic_region or "").strip().lower()
+
+
+    def _can_forget(self):
+        """
+        drop what was worked out so the next call reads the database again
+        """
+        self.releases.clear()
+
+
+    def _can_resolve(self):
+        """
+        one aggregate for the latest report date and month of each region, then the months
+        in those reports and the ids of their latest month's rows
+        """
+        latest_by_region = {}
+        queryset = WaterSupplierMonthlyReport.objects.order_by().values("hydrologic_region").annotate(Max("report_date"), Max("reporting_month"))
+        for latest in queryset:
+            region_key = self._can_make_region_key(latest["hydrologic_region"])
+            found = latest_by_region.get(region_key, {"report_date": latest["report_date__max"], "reporting_month": latest["reporting_month__max"]})
+            latest_by_region[region_key] = {"report_date": max(found["report_date"], latest["report_date__max"]), "reporting_month": max(found["reporting_month"], latest["reporting_month__max"])}
+        if not latest_by_region:
+            return {"state": None, "regions": {}}
+        latest_for_state = {
+            "report_date": max(latest["report_date"] for latest in latest_by_region.values()),
+            "reporting_month": max(latest["reporting_month"] for latest in latest_by_region.values()),
+        }
+        report_dates = set(latest["report_date"] for latest in latest_by_region.values())
+        queryset = WaterSupplierMonthlyReport.objects.filter(report_date__in=report_dates).order_by()
+        months = list(queryset.exclude(reporting_month__isnull=True).values_list("hydrologic_region", "report_date", "reporting_month").distinct())
+        ids = list(queryset.filter(reporting_month__gte=min(latest["reporting_month"] for latest in latest_by_region.values())).values_list("hydrologic_region", "report_date", "reporting_month", "id"))
+        output = {"state": self._can_make_release_from(latest_for_state, months, ids), "regions": {}}
+        for region_key, latest in latest_by_region.iteritems():
+            output["regions"][region_key] = self._can_make_release_from(latest, months, ids, region_key)
+        logger.debug("resolved the %s release across %s regions" % (latest_for_state["report_date"], len(latest_by_region)))
+        return output
+
+
+    def _can_make_release_from(self, latest, months, ids, region_key=None):
+        """
+        narrow the months and ids of the latest reports down to one region's latest report,
+        or to the state's when no region key is passed
+        """
+        def in_release(row):
+            return row[1] == latest["report_date"] and (region_key is None or self._can_make_region_key(row[0]) == region_key)
+        return {
+            "report_date": latest["report_date"],
+            "reporting_month": latest["reporting_month"],
+            "months_in_report": sorted(set(row[2] for row in months if in_release(row)), reverse=True),
+            "latest_month_ids": [row[3] for row in ids if in_release(row) and row[2] >= latest["reporting_month"]],
+        }
@@ -0,0 +1,163 @@
+from __future__ import division
+from monthly_water_reports.models import WaterSupplierMonthlyReport
+from unit_methods import UnitConversionMethods
+import numpy as np
+import logging
+import datetime
+
+logger = logging.getLogger("cali_water_reports")
+
+class ReleaseScreeningMethods(object):
+    """
+    checks a release of usage rows for values that shouldn't reach the database
+    the release is loaded into numpy arrays and each check runs over all of it at once
+    """
+
+    # residential gallons per capita per day outside this range is taken to be a data error
+    rgpcd_range = (10, 1000)
+
+    # a month this many times above or below the supplier's median month in the release
+    month_swing = 10
+
+    # a revision this many times above or below the value in the release before it
+    revision_swing = 10
+
+    # a revised value is only doubted when it is also this far from the supplier's median
+    # so a release that fixes an earlier mistake isn't held back
+    revision_median_swing = 3
+
+    # how close a swing has to come to the ratio between two units to be called a mislabelled unit
+    unit_scale_tolerance = 1.5
+
+    checks = ["population", "rgpcd_range", "unit_scale", "month_swing", "revision_swing"]
+
+    converter = UnitConversionMethods()
+
+    def _can_make_array_from(self, list_of_data, field):
+        """
+        a float array of one field with missing values as nan
+        """
+        return np.array([data[field] if data[field] is not None else np.nan for data in list_of_data], dtype=float)
+
+
+    def _can_make_unit_scales(self):
+        """
+        log10 of the ratio between every pair of units far enough apart to tell from a real swing
+        """
+        gallons = sorted(set(self.converter.unit_to_gallons.values()))
+        ratios = [larger / smaller for smaller in gallons for larger in gallons if larger / smaller >= self.month_swing]
+        return np.log10(np.array(ratios, dtype=float))
+
+
+    def _can_make_group_medians(self, codes, values):
+        """
+        the median of values for each row's group, ignoring nan and infinity
+        rows are sorted by group then value so each median is read from the middle of its run
+        """
+        values = np.where(np.isfinite(values), values, np.nan)
+        group_count = codes.max() + 1 if len(codes) else 0
+        order = np.lexsort((values, codes))
+        sorted_codes = codes[order]
+        sorted_values = values[order]
+        counts = np.bincount(codes[np.isfinite(values)], minlength=group_count)
+        starts = np.searchsorted(sorted_codes, np.arange(group_count))
+        low = np.maximum(starts + (counts - 1) // 2, 0)
+        high = np.maximum(starts + counts // 2, 0)
+        medians = np.where(counts > 0, (sorted_values[np.minimum(low, len(values) - 1)] + sorted_values[np.minimum(high, len(values) - 1)]) / 2, np.nan)
+        return medians[codes]
+
+
+    def _can_load_previous_values_for(self, list_of_data):
+        """
+        production gallons for each row's supplier and month in the release before its own
+        taken from earlier releases in the same batch or from the database
+        """
+        report_dates = sorted(set(self._can_make_date_from(data["report_date"]) for data in list_of_data))
+        stored_dates = set(WaterSupplierMonthlyReport.objects.order_by().values_list("report_date", flat=True).distinct())
+        all_dates = sorted(stored_dates | set(report_dates))
+        previous_dates = dict(zip(all_dates, [None] + all_dates[:-1]))
+        previous_values = {}
+        wanted_dates = set(previous_dates[report_date] for report_date in report_dates) - set(report_dates)
+        queryset = WaterSupplierMonthlyReport.objects.filter(report_date__in=wanted_dates & stored_dates)
+        for slug, reporting_month, report_date, gallons in queryset.values_list("supplier_slug", "reporting_month", "report_date", "production_gallons_2014"):
+            previous_values[(report_date, slug, reporting_month)] = gallons
+        for data in list_of_data:
+            previous_values[(self._can_make_date_from(data["report_date"]), data["supplier_slug"], self._can_make_date_from(data["reporting_month"]))] = data["production_gallons_2014"]
+        output = []
+        for data in list_of_data:
+            key = (previous_dates[self._can_make_date_from(data["report_date"])], data["supplier_slug"], self._can_make_date_from(data["reporting_month"]))
+            value = previous_values.get(key)
+            output.append(value if value is not None else np.nan)
+        return np.array(output, dtype=float)
+
+
+    def _can_make_date_from(self, value):
+        """
+        """
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        return value
+
+
+    def _can_screen_release(self, list_of_data):
+        """
+        split a release into rows fit to write and a quarantine report of the rows that aren't
+        each quarantined row lists the checks it failed and the values behind them
+        """
+        if not list_of_data:
+            return list_of_data, []
+        population = self._can_make_array_from(list_of_data, "total_population_served")
+        days_in_month = self._can_make_array_from(list_of_data, "days_in_month")
+        production = self._can_make_array_from(list_of_data, "production_gallons_2014")
+        residential = self._can_make_array_from(list_of_data, "residential_gallons_2014")
+        previous = self._can_load_previous_values_for(list_of_data)
+        groups, codes = np.unique(["%s|%s" % (data["report_date"], data["supplier_slug"]) for data in list_of_data], return_inverse=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            implied_rgpcd = residential / population / days_in_month
+            per_capita = production / population / days_in_month
+            median_ratio = per_capita / self._can_make_group_medians(codes, per_capita)
+            previous_ratio = production / previous
+            median_swing = np.abs(np.log10(median_ratio))
+            revision_swing = np.abs(np.log10(previous_ratio))
+        unit_distance = np.abs(median_swing[:, np.newaxis] - self._can_make_unit_scales()[np.newaxis, :]).min(axis=1)
+        # the per capita checks only mean something for rows that have a population
+        with np.errstate(invalid="ignore"):
+            has_population = population > 0
+            failed = {
+                "population": ~has_population,
+                "rgpcd_range": has_population & ((implied_rgpcd < self.rgpcd_range[0]) | (implied_rgpcd > self.rgpcd_range[1])),
+                "unit_scale": has_population & (median_swing >= np.log10(self.month_swing)) & (unit_distance < np.log10(self.unit_scale_tolerance)),
+                "revision_swing": has_population & (revision_swing >= np.log10(self.revision_swing)) & (median_swing >= np.log10(self.revision_median_swing)),
+            }
+            failed["month_swing"] = has_population & (median_swing >= np.log10(self.month_swing)) & ~failed["unit_scale"]
+        quarantined = np.zeros(len(list_of_data), dtype=bool)
+        for check in self.checks:
+            quarantined |= failed[check]
+        list_to_write = [list_of_data[index] for index in np.flatnonzero(~quarantined)]
+        quarantine = []
+        for index in np.flatnonzero(quarantined):
+            data = list_of_data[index]
+            quarantine.append({
+                "supplier_slug": data["supplier_slug"],
+                "reporting_month": data["reporting_month"],
+                "report_date": data["report_date"],
+                "checks": [check for check in self.checks if failed[check][index]],
+                "units": data["units"],
+                "total_population_served": data["total_population_served"],
+                "production_gallons_2014": data["production_gallons_2014"],
+                "implied_rgpcd": self._can_make_number_from(implied_rgpcd[index]),
+                "median_ratio": self._can_make_number_from(median_ratio[index]),
+                "previous_ratio": self._can_make_number_from(previous_ratio[index]),
+            })
+        if quarantine:
+            logger.error("%s of %s rows quarantined" % (len(quarantine), len(list_of_data)))
+        return list_to_write, quarantine
+
+
+    def _can_make_number_from(self, value):
+        """
+        numpy floats as plain floats and nan or infinity as None so the report writes as json
+        """
+        if np.isfinite(value):
+            return round(float(value), 3)
+        return None
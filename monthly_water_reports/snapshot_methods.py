@@ -0,0 +1,284 @@
+from __future__ import division
+from django.conf import settings
+from monthly_water_reports.models import WaterSupplierMonthlyReport
+import numpy as np
+import logging
+import datetime
+import shutil
+import json
+import os
+import os.path
+
+logger = logging.getLogger("cali_water_reports")
+
+class ReportSnapshotMethods(object):
+    """
+    writes each release of monthly reports to a folder of numpy arrays, one per column,
+    so analytics can memory map a release instead of querying the database
+    """
+
+    # bump when the layout of a snapshot changes
+    snapshot_format = 1
+
+    numeric_fields = [
+        "total_monthly_potable_water_production_2014",
+        "total_monthly_potable_water_production_2013",
+        "total_population_served",
+        "reported_rgpcd",
+        "calculated_production_monthly_gallons_month_2014",
+        "calculated_production_monthly_gallons_month_2013",
+        "calculated_rgpcd_2014",
+        "calculated_rgpcd_2013",
+        "percent_residential_use",
+        "production_gallons_2014",
+        "production_gallons_2013",
+        "residential_gallons_2014",
+        "residential_gallons_2013",
+        "days_in_month",
+    ]
+
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path or getattr(settings, "SNAPSHOT_PATH", None) or os.path.join(settings.FILE_DOWNLOAD_PATH, "snapshot")
+
+
+    def _can_get_release_path(self, report_date):
+        """
+        """
+        return os.path.join(self.snapshot_path, self._can_make_date_from(report_date).isoformat())
+
+
+    def _can_make_date_from(self, value):
+        """
+        """
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        return value
+
+
+    def _can_make_month_index(self, value):
+        """
+        months counted from year zero so a span of months is a range of integers
+        """
+        return value.year * 12 + value.month - 1
+
+
+    def _can_make_columns_for(self, report_date):
+        """
+        the stored reports of a release as numpy columns with nulls as nan and
+        supplier and region names stored once and referred to by code
+        """
+        fields = ["supplier_slug", "supplier_name_id", "hydrologic_region", "hydrologic_region_slug", "reporting_month", "mandatory_restrictions"] + self.numeric_fields
+        queryset = WaterSupplierMonthlyReport.objects.filter(report_date=self._can_make_date_from(report_date)).order_by("supplier_slug", "reporting_month")
+        rows = list(queryset.values_list(*fields))
+        if not rows:
+            return None
+        values = dict(zip(fields, zip(*rows)))
+        columns = {}
+        supplier_keys, columns["supplier"] = np.unique(["%s|%s" % (slug, name) for slug, name in zip(values["supplier_slug"], values["supplier_name_id"])], return_inverse=True)
+        columns["supplier_slugs"] = np.array([key.split("|", 1)[0] for key in supplier_keys], dtype=unicode)
+        columns["supplier_names"] = np.array([key.split("|", 1)[1] for key in supplier_keys], dtype=unicode)
+        region_keys, columns["region"] = np.unique(["%s|%s" % (slug or "", name or "") for slug, name in zip(values["hydrologic_region_slug"], values["hydrologic_region"])], return_inverse=True)
+        columns["region_slugs"] = np.array([key.split("|", 1)[0] for key in region_keys], dtype=unicode)
+        columns["region_names"] = np.array([key.split("|", 1)[1] for key in region_keys], dtype=unicode)
+        columns["supplier"] = columns["supplier"].astype(np.int32)
+        columns["region"] = columns["region"].astype(np.int32)
+        columns["month"] = np.array([self._can_make_month_index(value) for value in values["reporting_month"]], dtype=np.int32)
+        columns["mandatory_restrictions"] = np.array(values["mandatory_restrictions"], dtype=bool)
+        for field in self.numeric_fields:
+            columns[field] = np.array([value if value is not None else np.nan for value in values[field]], dtype=float)
+        return columns
+
+
+    def _can_export_release(self, report_date):
+        """
+        write a release's columns to its own folder, built alongside and swapped in
+        so a reader never maps a half written snapshot
+        """
+        columns = self._can_make_columns_for(report_date)
+        if columns is None:
+            logger.debug("no reports stored for %s so there is nothing to snapshot" % (report_date))
+            return None
+        release_path = self._can_get_release_path(report_date)
+        building_path = "%s.building-%s" % (release_path, os.getpid())
+        retired_path = "%s.retired-%s" % (release_path, os.getpid())
+        os.path.exists(building_path) and shutil.rmtree(building_path)
+        os.makedirs(building_path)
+        for name, column in columns.iteritems():
+            np.save(os.path.join(building_path, "%s.npy" % (name)), column)
+        manifest = {
+            "snapshot_format": self.snapshot_format,
+            "report_date": self._can_make_date_from(report_date).isoformat(),
+            "rows": len(columns["month"]),
+            "suppliers": len(columns["supplier_slugs"]),
+            "columns": sorted(columns.keys()),
+            "created_date": datetime.datetime.now().isoformat(),
+        }
+        with open(os.path.join(building_path, "snapshot.json"), "wb") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+        if os.path.exists(release_path):
+            os.rename(release_path, retired_path)
+        os.rename(building_path, release_path)
+        os.path.exists(retired_path) and shutil.rmtree(retired_path)
+        return manifest
+
+
+    def _can_find_release_dates(self):
+        """
+        the report dates with a finished snapshot, oldest first
+        """
+        if not os.path.isdir(self.snapshot_path):
+            return []
+        output = []
+        for name in os.listdir(self.snapshot_path):
+            if os.path.isfile(os.path.join(self.snapshot_path, name, "snapshot.json")):
+                try:
+                    output.append(datetime.datetime.strptime(name, "%Y-%m-%d").date())
+                except ValueError:
+                    continue
+        return sorted(output)
+
+
+    def _can_load(self, report_date=None, mmap_mode="r"):
+        """
+        the snapshot of a release, the latest one unless report_date is set, as a
+        MonthlyReportSeries or None when there isn't one this code can read
+        """
+        if report_date is None:
+            release_dates = self._can_find_release_dates()
+            if not release_dates:
+                return None
+            report_date = release_dates[-1]
+        release_path = self._can_get_release_path(report_date)
+        try:
+            with open(os.path.join(release_path, "snapshot.json"), "rb") as manifest_file:
+                manifest = json.load(manifest_file)
+        except IOError:
+            return None
+        if manifest["snapshot_format"] != self.snapshot_format:
+            logger.error("ignoring the snapshot in %s, it was written in format %s" % (release_path, manifest["snapshot_format"]))
+            return None
+        columns = {}
+        for name in manifest["columns"]:
+            columns[name] = np.load(os.path.join(release_path, "%s.npy" % (name)), mmap_mode=mmap_mode)
+        return MonthlyReportSeries(columns, manifest)
+
+
+class MonthlyReportSeries(object):
+    """
+    one release of monthly reports held as columns and read as a grid of suppliers by months
+    every statistic here covers all suppliers at once and none of it touches the database
+    """
+
+    def __init__(self, columns, manifest):
+        self.columns = columns
+        self.manifest = manifest
+        self.report_date = datetime.datetime.strptime(manifest["report_date"], "%Y-%m-%d").date()
+        self.supplier_slugs = list(columns["supplier_slugs"])
+        self.supplier_names = list(columns["supplier_names"])
+        self.region_names = list(columns["region_names"])
+        self.supplier_index = {slug: code for code, slug in enumerate(self.supplier_slugs)}
+        self.first_month = int(columns["month"].min())
+        self.month_count = int(columns["month"].max()) - self.first_month + 1
+        self.cells = np.asarray(columns["supplier"]) * self.month_count + (np.asarray(columns["month"]) - self.first_month)
+        self.grids = {}
+
+
+    def _can_get_month_index(self, value):
+        """
+        the column of a reporting month in the grid, below zero or past the last column
+        when the release doesn't cover it
+        """
+        return value.year * 12 + value.month - 1 - self.first_month
+
+
+    def _can_get_months(self):
+        """
+        the reporting month of each column in the grid
+        """
+        return [datetime.date((self.first_month + index) // 12, (self.first_month + index) % 12 + 1, 1) for index in range(self.month_count)]
+
+
+    def _can_make_grid(self, field):
+        """
+        a field as a suppliers by months array with nan where a supplier didn't report
+        """
+        if field not in self.grids:
+            grid = np.empty(len(self.supplier_slugs) * self.month_count, dtype=float)
+            grid.fill(np.nan)
+            grid[self.cells] = self.columns[field]
+            self.grids[field] = grid.reshape(len(self.supplier_slugs), self.month_count)
+        return self.grids[field]
+
+
+    def _can_get_series_for(self, supplier_slug, field):
+        """
+        one supplier's values for every month in the release
+        """
+        return self._can_make_grid(field)[self.supplier_index[supplier_slug]]
+
+
+    def _can_get_rgpcd_by_region(self, reporting_month, residential_gallons_field="residential_gallons_2014"):
+        """
+        residential gallons per capita per day for each region in a month worked out as
+        QueryUtilities._get_rgcpd_from does, summed gallons over summed population over the days
+        """
+        month = self.columns["month"] == reporting_month.year * 12 + reporting_month.month - 1
+        regions = np.asarray(self.columns["region"])[month]
+        region_count = len(self.region_names)
+        gallons = np.bincount(regions, weights=np.nan_to_num(np.asarray(self.columns[residential_gallons_field])[month]), minlength=region_count)
+        population = np.bincount(regions, weights=np.nan_to_num(np.asarray(self.columns["total_population_served"])[month]), minlength=region_count)
+        days = np.zeros(region_count)
+        np.maximum.at(days, regions, np.nan_to_num(np.asarray(self.columns["days_in_month"])[month]))
+        output = {}
+        for code, name in enumerate(self.region_names):
+            if name and population[code] > 0 and days[code] > 0:
+                output[name] = np.floor(gallons[code]) / np.floor(population[code]) / days[code]
+        return output
+
+
+    def _can_get_state_rgpcd(self, reporting_month, residential_gallons_field="residential_gallons_2014"):
+        """
+        the same figure for every supplier in the state
+        """
+        month = self.columns["month"] == reporting_month.year * 12 + reporting_month.month - 1
+        population = np.nansum(np.asarray(self.columns["total_population_served"])[month])
+        days = np.nanmax(np.asarray(self.columns["days_in_month"])[month]) if month.any() else 0
+        if not population or not days:
+            return None
+        return np.floor(np.nansum(np.asarray(self.columns[residential_gallons_field])[month])) / np.floor(population) / days
+
+
+    def _can_get_month_by_year(self, month_of_year, years, field="calculated_production_monthly_gallons_month_2014"):
+        """
+        each supplier's value for one month of the year in each of years as a suppliers by years array
+        """
+        grid = self._can_make_grid(field)
+        output = np.empty((len(self.supplier_slugs), len(years)), dtype=float)
+        output.fill(np.nan)
+        for column, year in enumerate(years):
+            index = self._can_get_month_index(datetime.date(year, month_of_year, 1))
+            if 0 <= index < self.month_count:
+                output[:, column] = grid[:, index]
+        return output
+
+
+    def _can_get_cumulative_savings(self, first_month, last_month):
+        """
+        total production against the 2013 baseline over a span of months for every supplier
+        a supplier missing a baseline month has no baseline, as in QueryUtilities._create_cumulative_savings
+        """
+        first_index = max(self._can_get_month_index(first_month), 0)
+        last_index = max(self._can_get_month_index(last_month) + 1, first_index)
+        current = self._can_make_grid("calculated_production_monthly_gallons_month_2014")[:, first_index:last_index]
+        baseline = self._can_make_grid("calculated_production_monthly_gallons_month_2013")[:, first_index:last_index]
+        reported = ~np.isnan(current) | ~np.isnan(baseline)
+        cum_current = np.nansum(current, axis=1)
+        cum_baseline = np.where((np.isnan(baseline) & reported).any(axis=1) | ~reported.any(axis=1), np.nan, np.nansum(baseline, axis=1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cum_percent_change = (cum_current - cum_baseline) / cum_baseline * 100
+        return {
+            "supplier_slug": self.supplier_slugs,
+            "cum_current": cum_current,
+            "cum_baseline": cum_baseline,
+            "cum_percent_change": cum_percent_change,
+        }
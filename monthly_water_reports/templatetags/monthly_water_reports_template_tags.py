@@ -55,18 +55,9 @@ def percentage(value):
 
 
 @register.simple_tag
-def standardize_unit_to_gallons(value, unit):
-    if unit.upper() == "G":
-        output = (value * 1)
-    elif unit.upper() == "MG":
-        output = (value * 1000000)
-    elif unit.upper() == "CCF":
-        output = (value * 748)
-    elif unit.upper() == "AF":
-        output = (value * 325851)
-    else:
-        output = (value * 1)
-    return output
+def standardize_unit_to_gallons(report, year="2014"):
+    # gallons are worked out once at ingest, so read what was stored with the report
+    return getattr(report, "production_gallons_%s" % (year))
 
 
 @register.simple_tag
@@ -1,6 +1,29 @@
 from django.test import TestCase
+from django.core.management import call_command
 from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from django.http import Http404
+from monthly_water_reports.models import WaterSupplier, WaterSupplierMonthlyReport, WaterEnforcementMonthlyReport, ReleaseCatalog, WaterSupplierAlias, HydrologicRegion
+from monthly_water_reports.bulk_methods import BulkUpsertMethods
+from monthly_water_reports.timing_methods import StageTimer
+from monthly_water_reports.fetch_usage_stats import BuildMonthlyWaterUseReport
+from monthly_water_reports.fetch_enforcement_stats import LoadMonthlyEnforcementStats
+from monthly_water_reports.fetch_releases import FetchReleaseManifest
+from monthly_water_reports.fetch_methods import MonthlyFormattingMethods, SupplierNameNormalizer
+from monthly_water_reports.unit_methods import UnitConversionMethods
+from monthly_water_reports.cache_methods import ParsedReleaseCache
+from monthly_water_reports.catalog_methods import ReleaseCatalogMethods
+from monthly_water_reports.alias_methods import SupplierAliasIndex
+from monthly_water_reports.screening_methods import ReleaseScreeningMethods
+from monthly_water_reports.pipeline_methods import ReleasePipeline
+from monthly_water_reports.snapshot_methods import ReportSnapshotMethods
+from monthly_water_reports.release_methods import CurrentRelease, DataVersion
+from monthly_water_reports.backfill_reports import BackfillMonthlyReports
+from monthly_water_reports.templatetags.monthly_water_reports_template_tags import standardize_unit_to_gallons
+from monthly_water_reports.views import QueryUtilities, InitialIndex, RegionDetailView, RegionEmbedView, SupplierDetailView, ComparisonIndex
 import csv
+from openpyxl import Workbook
+from StringIO import StringIO
 from csvkit.utilities.in2csv import In2CSV
 import re
 import logging
@@ -9,6 +32,14 @@ import datetime
 import requests
 from dateutil import parser
 import os.path
+import BaseHTTPServer
+import SocketServer
+import threading
+import tempfile
+import itertools
+import shutil
+import json
+import numpy as np
 
 logger = logging.getLogger("cali_water_reports")
 
@@ -31,22 +62,7 @@ class TestFetchUsageStats(TestCase):
 
         self.file_created_csv_path = None
 
-        self.list_of_previous_files = [
-            "http://www.waterboards.ca.gov/water_issues/programs/conservation_portal/docs/2015dec/uw_supplier_data120115.xlsx",
-            "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data082715.xlsx",
-            "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data073015.xlsx",
-            "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data070115.xlsx"
-            "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/060215uw_supplier_data.xlsx",
-            "http://www.waterboards.ca.gov/waterrights/water_issues/programs/drought/docs/050515uw_supplier_data.xlsx",
-            "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data040715.xlsx",
-            "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data030315.xlsx",
-            "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data020315.xlsx",
-            "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data010215.xlsx",
-            "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data120214.xlsx",
-            "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/emergency_regulations/uw_supplier_data110414.xlsx",
-            "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/uw_supplier_data100714.xlsx",
-            "http://www.swrcb.ca.gov/waterrights/water_issues/programs/drought/docs/workshops/urban_water_conservation_mandatory_results091114.xlsx",
-        ]
+        self.list_of_previous_files = FetchReleaseManifest.list_of_previous_files
 
         self.list_of_usage_keys = [
             "Supplier Name",
@@ -306,6 +322,33 @@ class TestFetchUsageStats(TestCase):
             self.assertIs(type(output), dict)
 
 
+    def test_can_share_prettify_and_slugify_cache(self):
+        """
+        do separate instances share one normalizer cache without handing out the cached entry
+        """
+        MonthlyFormattingMethods()._can_prettify_and_slugify_string("Ontario  City of")
+        hits = MonthlyFormattingMethods.normalizer.hits
+        formatted = MonthlyFormattingMethods()._can_prettify_and_slugify_string("Ontario  City of")
+        self.assertEqual(MonthlyFormattingMethods.normalizer.hits, hits + 1)
+        self.assertEqual(formatted, {"supplier_slug": "city-of-ontario", "supplier_name": "city of ontario"})
+        formatted["supplier_slug"] = "changed"
+        self.assertEqual(MonthlyFormattingMethods()._can_prettify_and_slugify_string("Ontario  City of")["supplier_slug"], "city-of-ontario")
+
+
+    def test_can_normalize_supplier_names(self):
+        """
+        are repeated names served from a bounded cache with the skip list applied
+        """
+        normalizer = SupplierNameNormalizer(suppliers_to_skip=["cloverdale"], maxsize=2)
+        self.assertEqual(normalizer._can_normalize("Ontario  City of")["supplier_slug"], "city-of-ontario")
+        self.assertEqual(normalizer._can_normalize("Ontario  City of")["supplier_name"], "city of ontario")
+        self.assertEqual(normalizer._can_normalize("San Bernardino County Service Area 70J")["supplier_slug"], "san-bernardino-county-service-area-70j")
+        self.assertFalse(normalizer._can_normalize("Ontario  City of")["skip"])
+        self.assertTrue(normalizer._can_normalize("Cloverdale")["skip"])
+        self.assertEqual(normalizer.cache.keys(), ["Ontario  City of", "Cloverdale"])
+        self.assertEqual(normalizer._can_report_cache(), {"hits": 2, "misses": 3, "size": 2})
+
+
     def test_can_convert_str_to_num(self):
         """
         can this value be converted to an int
@@ -382,6 +425,67 @@ class TestFetchUsageStats(TestCase):
             self.assertTrue(self.data_release > datetime.date(2014, 9, 01))
 
 
+    def test_can_make_string_to_datetime(self):
+        """
+        do the published date formats parse without dateutil and match what it would return
+        """
+        sluggy = MonthlyFormattingMethods()
+        for date in ["2016-12-15", "2016-12-15T00:00:00", "2016-12-15 08:30:00", "12/15/2016", "Dec 15, 2016"]:
+            self.assertEqual(sluggy._can_make_string_to_datetime(date), parser.parse(date))
+        self.assertIn("12/15/2016", sluggy.parsed_dates)
+        self.assertNotIn("12/15/2016", MonthlyFormattingMethods().parsed_dates)
+        for date in ["Dec 2016", "December 2016", "Dec-16", "12/2016", "2016-12"]:
+            self.assertEqual(sluggy._can_make_string_to_datetime(date), datetime.datetime(2016, 12, 1))
+        self.assertEqual(sluggy._can_make_string_to_datetime("Aug-14"), datetime.datetime(2014, 8, 1))
+        for date in ["", "  ", "-", "Dec 15", "Aug 14", "n/a"]:
+            self.assertRaises(ValueError, sluggy._can_make_string_to_datetime, date)
+        self.assertNotIn("", sluggy.parsed_dates)
+        sluggy.parsed_dates_maxsize = 2
+        for date in ["1/15/2016", "2/15/2016", "3/15/2016"]:
+            sluggy._can_make_string_to_datetime(date)
+        self.assertEqual(list(sluggy.parsed_dates)[-2:], ["2/15/2016", "3/15/2016"])
+        self.assertNotIn("1/15/2016", sluggy.parsed_dates)
+
+
+    def test_can_stream_excel_rows_from(self):
+        """
+        can I read rows straight from a workbook without converting it to csv
+        """
+        sluggy = MonthlyFormattingMethods()
+        file_path = os.path.join(os.path.dirname(__file__), "data", "uw_supplier_data020817.xlsx")
+        rows = sluggy._can_stream_excel_rows_from(file_path)
+        first_row = rows.next()
+        for key in self.list_of_usage_keys:
+            self.assertTrue(first_row.has_key(key))
+        self.assertEqual(first_row["Supplier Name"], "East Bay Municipal Utilities District")
+        self.assertEqual(first_row["Reporting Month"], "2016-12-15")
+        self.assertEqual(first_row["REPORTED Units"], "MG")
+        for row in rows:
+            self.assertTrue(all(isinstance(value, basestring) for value in row.values()))
+
+
+    def test_can_compile_row_schema(self):
+        """
+        are columns resolved once per file and rows converted into typed tuples
+        """
+        sluggy = MonthlyFormattingMethods()
+        columns = [
+            ("supplier_name", "supplier_name", "text"),
+            ("mandatory_restrictions", "mandatory_restrictions", "flag"),
+            ("total_population_served", "total_population_served", "number"),
+            ("percent_residential_use", "%_residential_use", "percent"),
+        ]
+        header = ["Supplier Name", "Mandatory Restrictions", "Population Served", "% Residential Use"]
+        schema = sluggy._can_compile_row_schema(header, header, columns, header_aliases={"population_served": "total_population_served"})
+        values = sluggy._can_apply_row_schema(schema, {"Supplier Name": " Alameda County Water District ", "Mandatory Restrictions": "Yes", "Population Served": "340,000", "% Residential Use": "62"})
+        self.assertEqual(values.supplier_name, "Alameda County Water District")
+        self.assertEqual(values.mandatory_restrictions, True)
+        self.assertEqual(values.total_population_served, 340000)
+        self.assertEqual(values.percent_residential_use, 0.62)
+        with self.assertRaises(ValueError):
+            sluggy._can_compile_row_schema(header[:2], header, columns)
+
+
     def _test_can_make_xldate_to_datetime(self):
         """
         can I create a datetime from a reporting month value
@@ -428,3 +532,1087 @@ class TestFetchUsageStats(TestCase):
         """
         """
         logger.debug("pass for now")
+
+
+class StandInReleaseHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    serves a committed workbook the way the state water board web server would
+    """
+
+    body = None
+
+    etag = None
+
+    last_modified = "Wed, 08 Feb 2017 17:00:00 GMT"
+
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(dict(self.headers))
+        if self.etag and self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.etag:
+            self.send_header("ETag", self.etag)
+        self.send_header("Last-Modified", self.last_modified)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServerTestCase(TestCase):
+    """
+    runs a local stand-in for the state water board web server during a test
+    """
+
+    handler = StandInReleaseHandler
+
+    def setUp(self):
+        self.sluggy = MonthlyFormattingMethods()
+        self.temporary_path = tempfile.mkdtemp()
+        self.excel_file_path = os.path.join(self.temporary_path, "uw_supplier_data020817.xlsx")
+        with open(os.path.join(os.path.dirname(__file__), "data", "uw_supplier_data020817.xlsx"), "rb") as excel_file:
+            StandInReleaseHandler.body = excel_file.read()
+        StandInReleaseHandler.etag = '"release-020817"'
+        StandInReleaseHandler.requests_seen = []
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), self.handler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.excel_file_url = "http://127.0.0.1:%s/uw_supplier_data020817.xlsx" % (self.server.server_address[1])
+        self.state_settings = self.settings(FETCH_STATE_PATH=os.path.join(self.temporary_path, "fetch_state.json"))
+        self.state_settings.enable()
+
+
+    def tearDown(self):
+        self.state_settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temporary_path)
+
+
+    def _fetch(self, force=False):
+        return self.sluggy._can_write_excel_file_from("uw_supplier_data020817.xlsx", self.excel_file_url, self.excel_file_path, state_key="usage", force=force)
+
+
+class TestConditionalDownload(StandInServerTestCase):
+    """
+    tests that unchanged releases are detected against a local stand-in server
+    """
+
+    def test_can_skip_release_with_matching_etag(self):
+        """
+        does the second request send the etag and come back unchanged
+        """
+        fetch = self._fetch()
+        self.assertTrue(fetch["changed"])
+        self.assertEqual(os.path.getsize(self.excel_file_path), len(StandInReleaseHandler.body))
+        self.sluggy._can_save_fetch_state(fetch)
+        os.remove(self.excel_file_path)
+        fetch = self._fetch()
+        self.assertFalse(fetch["changed"])
+        self.assertEqual(StandInReleaseHandler.requests_seen[-1]["if-none-match"], '"release-020817"')
+        self.assertFalse(os.path.exists(self.excel_file_path))
+
+
+    def test_can_skip_release_with_matching_hash(self):
+        """
+        without an etag is an identical file still recognized by its hash
+        """
+        StandInReleaseHandler.etag = None
+        fetch = self._fetch()
+        self.assertTrue(fetch["changed"])
+        self.sluggy._can_save_fetch_state(fetch)
+        fetch = self._fetch()
+        self.assertFalse(fetch["changed"])
+
+
+    def test_can_fetch_new_release_and_force(self):
+        """
+        does new content or the force flag bring back a changed release
+        """
+        fetch = self._fetch()
+        self.sluggy._can_save_fetch_state(fetch)
+        self.assertTrue(self._fetch(force=True)["changed"])
+        StandInReleaseHandler.body = StandInReleaseHandler.body + "\0"
+        StandInReleaseHandler.etag = '"release-020817-revised"'
+        fetch = self._fetch()
+        self.assertTrue(fetch["changed"])
+        self.assertEqual(fetch["etag"], '"release-020817-revised"')
+
+
+    def test_does_not_record_release_until_saved(self):
+        """
+        a release that was downloaded but never ingested is fetched again
+        """
+        self.assertTrue(self._fetch()["changed"])
+        self.assertTrue(self._fetch()["changed"])
+
+
+class DroppingReleaseHandler(StandInReleaseHandler):
+    """
+    honors range requests but hangs up partway through the first few responses
+    """
+
+    drops = 0
+
+    drop_after = 0
+
+    def do_GET(self):
+        self.requests_seen.append(dict(self.headers))
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"].replace("bytes=", "").rstrip("-"))
+        body = self.body[start:]
+        if start:
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %s-%s/%s" % (start, len(self.body) - 1, len(self.body)))
+        else:
+            self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if DroppingReleaseHandler.drops > 0:
+            DroppingReleaseHandler.drops -= 1
+            self.wfile.write(body[:self.drop_after])
+            self.close_connection = 1
+            return
+        self.wfile.write(body)
+
+
+class TestResumableDownload(StandInServerTestCase):
+    """
+    tests that interrupted downloads resume against a local stand-in server
+    """
+
+    handler = DroppingReleaseHandler
+
+    def setUp(self):
+        super(TestResumableDownload, self).setUp()
+        DroppingReleaseHandler.drops = 3
+        DroppingReleaseHandler.drop_after = 100000
+        self.sluggy.download_chunk_size = 8192
+        self.sluggy.download_retry_delay = 0
+
+
+    def test_can_resume_dropped_download(self):
+        """
+        does a download that is cut off three times arrive intact
+        """
+        fetch = self._fetch()
+        self.assertTrue(fetch["changed"])
+        with open(self.excel_file_path, "rb") as excel_file:
+            self.assertEqual(excel_file.read(), StandInReleaseHandler.body)
+        self.assertEqual([headers.get("range") for headers in StandInReleaseHandler.requests_seen], [None, "bytes=100000-", "bytes=200000-", "bytes=300000-"])
+        self.assertEqual(StandInReleaseHandler.requests_seen[1]["if-range"], '"release-020817"')
+        self.assertFalse(os.path.exists("%s.part" % (self.excel_file_path)))
+
+
+    def test_can_give_up_without_replacing_file(self):
+        """
+        does a download that never finishes leave the previous file alone
+        """
+        with open(self.excel_file_path, "wb") as excel_file:
+            excel_file.write("previous release")
+        DroppingReleaseHandler.drops = self.sluggy.download_attempts
+        with self.assertRaises(IOError):
+            self._fetch()
+        with open(self.excel_file_path, "rb") as excel_file:
+            self.assertEqual(excel_file.read(), "previous release")
+        self.assertFalse(os.path.exists("%s.part" % (self.excel_file_path)))
+
+
+class StandInArchiveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    serves the committed workbooks by file name and fails some requests once
+    """
+
+    data_path = os.path.join(os.path.dirname(__file__), "data")
+
+    fail_once = set()
+
+    requests_seen = []
+
+    def do_GET(self):
+        file_name = os.path.basename(self.path)
+        self.requests_seen.append((time.time(), file_name))
+        if file_name in self.fail_once:
+            self.fail_once.discard(file_name)
+            self.send_error(503)
+            return
+        file_path = os.path.join(self.data_path, file_name)
+        if not os.path.isfile(file_path):
+            self.send_error(404)
+            return
+        with open(file_path, "rb") as excel_file:
+            body = excel_file.read()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadedStandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestFetchReleaseManifest(TestCase):
+    """
+    tests fetching a manifest of releases concurrently from a local stand-in server
+    """
+
+    def setUp(self):
+        self.temporary_path = tempfile.mkdtemp()
+        self.file_names = ["uw_supplier_data060616.xlsx", "uw_supplier_data070616.xlsx", "2015_12_01_enforcement_statistics.xlsx"]
+        StandInArchiveHandler.fail_once = set(["uw_supplier_data070616.xlsx"])
+        StandInArchiveHandler.requests_seen = []
+        self.server = ThreadedStandInServer(("127.0.0.1", 0), StandInArchiveHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        base_url = "http://127.0.0.1:%s/docs/" % (self.server.server_address[1])
+        self.urls = [base_url + file_name for file_name in self.file_names + ["uw_supplier_data010100.xlsx"]]
+        self.fetcher = FetchReleaseManifest()
+        self.fetcher.backoff_seconds = 0
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.temporary_path)
+
+
+    def test_can_fetch_release_manifest(self):
+        """
+        do releases land in the data folder intact with retries and polite spacing
+        """
+        summary = self.fetcher._init(urls=self.urls, data_path=self.temporary_path, max_connections=3, host_delay_seconds=0.05)
+        self.assertEqual((summary["downloaded"], summary["exists"], summary["failed"]), (3, 0, 1))
+        for file_name in self.file_names:
+            with open(os.path.join(StandInArchiveHandler.data_path, file_name), "rb") as original, open(os.path.join(self.temporary_path, file_name), "rb") as fetched:
+                self.assertEqual(original.read(), fetched.read())
+        attempts = {os.path.basename(release["file_path"]): release["attempts"] for release in summary["releases"]}
+        self.assertEqual(attempts["uw_supplier_data070616.xlsx"], 2)
+        self.assertEqual(attempts["uw_supplier_data010100.xlsx"], 1)
+        started = sorted(seen for seen, file_name in StandInArchiveHandler.requests_seen)
+        self.assertTrue(all(later - earlier >= 0.04 for earlier, later in zip(started, started[1:])))
+        self.assertEqual(sorted(os.listdir(self.temporary_path)), sorted(self.file_names))
+        summary = self.fetcher._init(urls=self.urls[:3], data_path=self.temporary_path, max_connections=3, host_delay_seconds=0.05)
+        self.assertEqual(summary["exists"], 3)
+        self.assertEqual(len(StandInArchiveHandler.requests_seen), 5)
+
+
+class TestBulkUpsert(TestCase):
+    """
+    tests that the batched upsert sorts a release into new, revised and unchanged reports
+    """
+
+    def setUp(self):
+        self.bulky = BulkUpsertMethods()
+        self.list_of_data = [self._make_row("city-of-ontario", "city of ontario", month) for month in (10, 11, 12)]
+
+
+    def _make_row(self, slug, name, month, report_date=datetime.date(2017, 2, 8)):
+        data = {field: None for field in self.bulky.supplier_fields + self.bulky.report_fields}
+        data.update({
+            "supplier_slug": slug,
+            "supplier_name": name,
+            "supplier_active": True,
+            "created_date": datetime.datetime(2017, 2, 8),
+            "mandatory_restrictions": True,
+            "reporting_month": datetime.datetime(2016, month, 15),
+            "report_date": report_date,
+            "total_population_served": 170000,
+            "hydrologic_region": "South Coast",
+            "hydrologic_region_slug": "south-coast",
+        })
+        return data
+
+
+    def _stage(self, list_of_data):
+        release = self.bulky._can_begin_release(sorted(set(data["report_date"] for data in list_of_data)))
+        self.bulky._can_find_new_suppliers_from(list_of_data, release)
+        return release, self.bulky._can_diff_reports_from(list_of_data, release)
+
+
+    def test_can_diff_new_revised_and_unchanged_reports(self):
+        """
+        are new reports built, revised ones kept as changes and unchanged ones left alone
+        """
+        release, new_reports = self._stage(self.list_of_data)
+        self.assertEqual(release["counts"], {"new": 3, "revised": 0, "unchanged": 0})
+        self.assertEqual([report.reporting_month for report in new_reports], [datetime.date(2016, month, 15) for month in (10, 11, 12)])
+        self.assertEqual(release["new_suppliers"].keys(), ["city-of-ontario"])
+        self.bulky._can_stage_reports(new_reports)
+        summary = self.bulky._can_finish_release(release)
+        self.assertEqual((summary["created"], summary["updated"], summary["carried"]), (3, 0, 0))
+        self.assertEqual(WaterSupplier.objects.filter(supplier_slug="city-of-ontario").count(), 1)
+        self.list_of_data[1]["total_population_served"] = 171000
+        release, new_reports = self._stage(self.list_of_data)
+        self.assertEqual(release["counts"], {"new": 0, "revised": 1, "unchanged": 2})
+        self.assertEqual(new_reports, [])
+        self.assertEqual(release["new_suppliers"].keys(), [])
+        revised = WaterSupplierMonthlyReport.objects.get(reporting_month=datetime.date(2016, 11, 15))
+        self.assertEqual([pk for pk, values in release["changed_reports"].values()], [revised.pk])
+        summary = self.bulky._can_finish_release(release)
+        self.assertEqual((summary["created"], summary["updated"], summary["carried"]), (0, 1, 0))
+        self.assertEqual(WaterSupplierMonthlyReport.objects.get(pk=revised.pk).total_population_served, 171000)
+        self.assertEqual(WaterSupplierMonthlyReport.objects.count(), 3)
+
+
+    def test_can_carry_forward_from_previous_release(self):
+        """
+        are reports unchanged since the previous release copied, and revised ones built
+        """
+        self.bulky._can_bulk_save_release_from(self.list_of_data)
+        next_release = [self._make_row("city-of-ontario", "city of ontario", month, datetime.date(2017, 3, 8)) for month in (10, 11, 12)]
+        next_release[2]["total_population_served"] = 171000
+        release, new_reports = self._stage(next_release)
+        self.assertEqual(release["counts"], {"new": 0, "revised": 1, "unchanged": 2})
+        self.assertEqual([report.reporting_month for report in new_reports], [datetime.date(2016, 12, 15)])
+        carried = release["carried_reports"][datetime.date(2017, 3, 8)]
+        previous = WaterSupplierMonthlyReport.objects.filter(report_date=datetime.date(2017, 2, 8), reporting_month__lt=datetime.date(2016, 12, 1))
+        self.assertEqual(sorted(carried.values()), sorted(previous.values_list("id", flat=True)))
+        self.bulky._can_stage_reports(new_reports)
+        summary = self.bulky._can_finish_release(release)
+        self.assertEqual((summary["created"], summary["carried"], summary["updated"]), (3, 2, 0))
+        reports = WaterSupplierMonthlyReport.objects.filter(report_date=datetime.date(2017, 3, 8)).order_by("reporting_month")
+        self.assertEqual([report.total_population_served for report in reports], [170000, 170000, 171000])
+        self.assertEqual(WaterSupplierMonthlyReport.objects.filter(report_date=datetime.date(2017, 2, 8)).count(), 3)
+
+
+    def test_can_skip_suppliers(self):
+        """
+        are skipped suppliers left out of the release and never created
+        """
+        self.list_of_data.append(self._make_row("city-of-coalinga", "city of coalinga", 12))
+        summary = self.bulky._can_bulk_save_release_from(self.list_of_data, suppliers_to_skip=["city-of-coalinga"])
+        self.assertEqual((summary["rows"], summary["new"], summary["created"]), (3, 3, 3))
+        self.assertFalse(WaterSupplier.objects.filter(supplier_slug="city-of-coalinga").exists())
+        self.assertFalse(WaterSupplierMonthlyReport.objects.filter(supplier_slug="city-of-coalinga").exists())
+        summary = self.bulky._can_bulk_save_release_from(self.list_of_data)
+        self.assertEqual((summary["rows"], summary["new"], summary["unchanged"], summary["created"]), (4, 1, 3, 1))
+        self.assertTrue(WaterSupplier.objects.filter(supplier_slug="city-of-coalinga").exists())
+
+
+class TestStagedReleaseSave(TestCase):
+    """
+    tests that a release is merged into the live tables all at once
+    """
+
+    def setUp(self):
+        self.bulky = BulkUpsertMethods()
+        self.list_of_data = [self._make_row("city-of-ontario", "city of ontario", month) for month in (10, 11, 12)]
+
+
+    def _staging_table_exists(self):
+        try:
+            with transaction.atomic():
+                connection.cursor().execute("SELECT 1 FROM %s" % (self.bulky.staging_table))
+            return True
+        except DatabaseError:
+            return False
+
+
+    def _make_row(self, slug, name, month):
+        data = {field: None for field in self.bulky.supplier_fields + self.bulky.report_fields}
+        data.update({
+            "supplier_slug": slug,
+            "supplier_name": name,
+            "supplier_active": True,
+            "created_date": datetime.datetime(2017, 2, 8),
+            "mandatory_restrictions": True,
+            "reporting_month": datetime.datetime(2016, month, 15),
+            "report_date": datetime.date(2017, 2, 8),
+            "total_population_served": 170000,
+            "hydrologic_region": "South Coast",
+            "hydrologic_region_slug": "south-coast",
+        })
+        return data
+
+
+    def test_can_merge_staged_release(self):
+        """
+        are new rows merged, changed rows updated and the staging table dropped
+        """
+        summary = self.bulky._can_bulk_save_release_from(self.list_of_data)
+        self.assertEqual((summary["created"], summary["updated"], summary["unchanged"]), (3, 0, 0))
+        self.list_of_data[0]["total_population_served"] = 171000
+        self.list_of_data.append(self._make_row("cloverdale", "cloverdale", 12))
+        summary = self.bulky._can_bulk_save_release_from(self.list_of_data, suppliers_to_skip=["cloverdale"])
+        self.assertEqual((summary["created"], summary["updated"], summary["unchanged"]), (0, 1, 2))
+        self.assertEqual(WaterSupplierMonthlyReport.objects.filter(supplier_name_id="city of ontario").count(), 3)
+        self.assertEqual(WaterSupplierMonthlyReport.objects.get(reporting_month=datetime.date(2016, 10, 15)).total_population_served, 171000)
+        self.assertFalse(WaterSupplier.objects.filter(supplier_slug="cloverdale").exists())
+        self.assertFalse(self._staging_table_exists())
+
+
+    def test_can_carry_unchanged_reports_forward(self):
+        """
+        does a new release only build rows that are new or revised and copy the rest
+        """
+        self.bulky._can_bulk_save_release_from(self.list_of_data)
+        next_release = [dict(data, report_date=datetime.date(2017, 3, 8)) for data in self.list_of_data]
+        next_release[0]["total_population_served"] = 171000
+        next_release.append(dict(self._make_row("city-of-ontario", "city of ontario", 9), report_date=datetime.date(2017, 3, 8)))
+        summary = self.bulky._can_bulk_save_release_from(next_release)
+        self.assertEqual((summary["new"], summary["revised"], summary["unchanged"]), (1, 1, 2))
+        self.assertEqual((summary["created"], summary["carried"], summary["updated"]), (4, 2, 0))
+        reports = WaterSupplierMonthlyReport.objects.filter(report_date=datetime.date(2017, 3, 8)).order_by("reporting_month")
+        self.assertEqual([report.total_population_served for report in reports], [170000, 171000, 170000, 170000])
+        self.assertEqual(len(set(report.fingerprint for report in reports)), 2)
+
+
+    def test_can_leave_live_tables_alone_when_release_fails(self):
+        """
+        does a release that fails partway through write nothing at all
+        """
+        self.bulky._can_bulk_save_release_from(self.list_of_data)
+        self.list_of_data.append(self._make_row("city-of-upland", "city of upland", 12))
+        self.list_of_data[0]["total_population_served"] = "not a number"
+        with self.assertRaises(ValueError):
+            self.bulky._can_bulk_save_release_from(self.list_of_data)
+        self.assertFalse(WaterSupplier.objects.filter(supplier_slug="city-of-upland").exists())
+        self.assertEqual(WaterSupplierMonthlyReport.objects.count(), 3)
+        self.assertEqual(WaterSupplierMonthlyReport.objects.get(reporting_month=datetime.date(2016, 10, 15)).total_population_served, 170000)
+        self.assertFalse(self._staging_table_exists())
+
+
+class TestEnforcementWriter(TestCase):
+    """
+    tests that an enforcement release loads in a handful of queries
+    """
+
+    def setUp(self):
+        self.enforcement = LoadMonthlyEnforcementStats()
+        self.rows = [self._make_row("Ontario  City of", "%s/15/2016" % (month), "12") for month in range(1, 13)]
+
+
+    def _make_row(self, name, month, complaints):
+        row = {key: "" for key in self.enforcement.list_of_expected_keys}
+        row.update({
+            "Supplier Name": name,
+            "Reporting Month": month,
+            "Hydrologic Region": "South Coast",
+            "Population Served": "170,000",
+            "Mandatory Restrictions": "Yes",
+            "Complaints Received": complaints,
+        })
+        return row
+
+
+    def test_can_save_enforcement_release(self):
+        """
+        are bad rows rejected and the rest created, then updated in bulk
+        """
+        self.rows.append(self._make_row("City of Upland", "", "3"))
+        self.rows.append(self._make_row("City of Upland", "-", "3"))
+        summary = self.enforcement._can_build_model_instance(self.rows, "uw_supplier_data020817.xlsx")
+        self.assertEqual((summary["created"], summary["updated"], summary["unchanged"]), (12, 0, 0))
+        self.assertEqual([reject["line"] for reject in summary["rejects"]], [14, 15])
+        report = WaterEnforcementMonthlyReport.objects.get(supplier_slug="city-of-ontario", reporting_month=datetime.date(2016, 3, 1))
+        self.assertEqual((report.complaints_received, report.total_population_served, report.hydrologic_region_slug), (12, 170000, "south-coast"))
+        self.rows[2] = self._make_row("Ontario  City of", "3/15/2016", "13")
+        list_of_data = self.enforcement._can_parse_rows_from(self.rows[:12], "uw_supplier_data020817.xlsx")
+        with self.assertNumQueries(4):
+            summary = self.enforcement._save_enforcement_instances_from(list_of_data)
+        self.assertEqual((summary["created"], summary["updated"], summary["unchanged"]), (0, 1, 11))
+        self.assertEqual(WaterEnforcementMonthlyReport.objects.get(pk=report.pk).complaints_received, 13)
+
+
+class TestCanonicalGallons(TestCase):
+    """
+    tests the gallons stored at ingest and the averages summed from them
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.converter = UnitConversionMethods()
+        task_run = BuildMonthlyWaterUseReport()
+        rows = task_run.sluggy._can_stream_excel_rows_from(os.path.join(os.path.dirname(__file__), "data", "uw_supplier_data020817.xlsx"))
+        months = [datetime.datetime(2016, 12, 15), datetime.datetime(2016, 11, 15)]
+        cls.list_of_data = [data for data in task_run._can_parse_rows_from(rows, "uw_supplier_data020817.xlsx") if data["reporting_month"] in months]
+        task_run.aliases._can_load()
+        cls.list_of_data = task_run.aliases._can_resolve_rows_from(cls.list_of_data)
+        task_run.bulky._can_bulk_save_release_from(cls.list_of_data)
+
+
+    def test_can_convert_to_gallons(self):
+        """
+        are reported units converted through the one registry
+        """
+        self.assertEqual(self.converter._can_convert_to_gallons(2, "af"), 651702)
+        self.assertEqual(self.converter._can_convert_to_gallons(2, "MG"), 2000000)
+        self.assertEqual(self.converter._can_convert_to_gallons(2, "CCF"), 1496)
+        self.assertEqual(self.converter._can_convert_to_gallons(2, None), 2)
+        self.assertEqual(self.converter._can_convert_to_gallons(None, "AF"), None)
+        data = self.list_of_data[0]
+        self.assertEqual(data["days_in_month"], 31)
+        self.assertEqual(data["residential_gallons_2014"], data["calculated_production_monthly_gallons_month_2014"] * data["percent_residential_use"])
+        report = WaterSupplierMonthlyReport.objects.exclude(units="G").exclude(total_monthly_potable_water_production_2014__isnull=True).first()
+        self.assertEqual(standardize_unit_to_gallons(report), self.converter._can_convert_to_gallons(report.total_monthly_potable_water_production_2014, report.units))
+        self.assertEqual(standardize_unit_to_gallons(report, "2013"), report.production_gallons_2013)
+
+
+    def test_can_sum_rgcpd_in_database(self):
+        """
+        does the aggregate match averaging every report in python
+        """
+        queryset = WaterSupplierMonthlyReport.objects.filter(reporting_month=datetime.date(2016, 12, 15))
+        reports = list(queryset)
+        expected = int(sum(report.calculated_production_monthly_gallons_month_2014 * report.percent_residential_use for report in reports)) / float(sum(report.total_population_served for report in reports)) / 31
+        with self.assertNumQueries(1):
+            self.assertEqual(QueryUtilities()._get_avg_rgcpd(queryset), expected)
+        expected = int(sum(report.calculated_production_monthly_gallons_month_2013 * report.percent_residential_use for report in reports)) / float(sum(report.total_population_served for report in reports)) / 31
+        self.assertEqual(QueryUtilities()._get_last_year_avg_rgcpd(queryset), expected)
+
+
+class TestReportSnapshot(TestCase):
+    """
+    tests the columnar snapshot written for each release
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        task_run = BuildMonthlyWaterUseReport()
+        rows = task_run.sluggy._can_stream_excel_rows_from(os.path.join(os.path.dirname(__file__), "data", "uw_supplier_data020817.xlsx"))
+        list_of_data = [data for data in task_run._can_parse_rows_from(rows, "uw_supplier_data020817.xlsx") if data["reporting_month"].year == 2016]
+        task_run.aliases._can_load()
+        task_run.bulky._can_bulk_save_release_from(task_run.aliases._can_resolve_rows_from(list_of_data))
+
+
+    def setUp(self):
+        self.snapshot_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.snapshot_path)
+        self.snapshot = ReportSnapshotMethods(snapshot_path=self.snapshot_path)
+
+
+    def test_can_match_database_from_snapshot(self):
+        """
+        does the memory mapped release give the same figures as the database
+        """
+        manifest = self.snapshot._can_export_release(datetime.date(2017, 2, 8))
+        self.assertEqual(manifest["rows"], WaterSupplierMonthlyReport.objects.count())
+        self.snapshot._can_export_release(datetime.date(2017, 2, 8))
+        self.assertEqual(os.listdir(self.snapshot_path), ["2017-02-08"])
+        december = datetime.date(2016, 12, 15)
+        queryset = WaterSupplierMonthlyReport.objects.filter(reporting_month=december)
+        with self.assertNumQueries(0):
+            series = self.snapshot._can_load()
+            by_region = series._can_get_rgpcd_by_region(december)
+            state = series._can_get_state_rgpcd(december)
+            savings = series._can_get_cumulative_savings(datetime.date(2016, 6, 1), datetime.date(2016, 12, 1))
+            by_year = series._can_get_month_by_year(12, [2015, 2016])
+        self.assertAlmostEqual(by_region["South Coast"], QueryUtilities()._get_avg_rgcpd(queryset.filter(hydrologic_region="South Coast")))
+        self.assertAlmostEqual(state, QueryUtilities()._get_avg_rgcpd(queryset))
+        reports = WaterSupplierMonthlyReport.objects.filter(supplier_slug="city-of-pasadena", reporting_month__gte=datetime.date(2016, 6, 1))
+        code = series.supplier_index["city-of-pasadena"]
+        self.assertAlmostEqual(savings["cum_current"][code], sum(reports.values_list("calculated_production_monthly_gallons_month_2014", flat=True)))
+        self.assertAlmostEqual(savings["cum_baseline"][code], sum(reports.values_list("calculated_production_monthly_gallons_month_2013", flat=True)))
+        self.assertTrue(np.isnan(by_year[code, 0]))
+        self.assertEqual(by_year[code, 1], reports.get(reporting_month=december).calculated_production_monthly_gallons_month_2014)
+
+
+class TestLatestReleaseViews(TestCase):
+    """
+    tests the pages built from the latest release
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        task_run = BuildMonthlyWaterUseReport()
+        rows = task_run.sluggy._can_stream_excel_rows_from(os.path.join(os.path.dirname(__file__), "data", "uw_supplier_data020817.xlsx"))
+        list_of_data = [data for data in task_run._can_parse_rows_from(rows, "uw_supplier_data020817.xlsx") if data["reporting_month"].year == 2016]
+        task_run.aliases._can_load()
+        task_run.bulky._can_bulk_save_release_from(task_run.aliases._can_resolve_rows_from(list_of_data))
+
+
+    def setUp(self):
+        CurrentRelease()._can_forget()
+        CurrentRelease()._can_get()
+
+
+    def test_can_build_index_in_constant_queries(self):
+        """
+        do the region figures match the database and take the same few queries however many regions there are
+        """
+        view = InitialIndex()
+        view.kwargs = {}
+        with self.assertNumQueries(2):
+            context = view.get_queryset()
+            suppliers = [supplier.supplier_name for item in context["option_list"] for supplier in item["suppliers"]]
+        self.assertEqual(len(suppliers), WaterSupplier.objects.exclude(supplier_active=False).exclude(hydrologic_region__isnull=True).count())
+        item = [item for item in context["map_data"] if item["hydrologic_region"] == "South Coast"][0]
+        queryset = WaterSupplierMonthlyReport.objects.filter(hydrologic_region="South Coast")
+        self.assertAlmostEqual(item["this_month_avg"], QueryUtilities()._get_avg_rgcpd(queryset.filter(reporting_month=datetime.date(2016, 12, 15))))
+        self.assertAlmostEqual(item["last_month_avg"], QueryUtilities()._get_avg_rgcpd(queryset.filter(reporting_month=datetime.date(2016, 11, 15))))
+        self.assertEqual(item["count"], queryset.filter(reporting_month=datetime.date(2016, 12, 15)).count())
+        self.assertEqual(item["median"], queryset.filter(reporting_month=datetime.date(2016, 12, 15)).values_list("calculated_rgpcd_2014", flat=True).order_by("calculated_rgpcd_2014")[int(round(item["count"] / 2.0))])
+        self.assertEqual([supplier["calculated_rgpcd_2014"] for supplier in item["suppliers"]], sorted(supplier["calculated_rgpcd_2014"] for supplier in item["suppliers"]))
+        self.assertEqual(context["target_report"], datetime.date(2016, 12, 15))
+
+
+    def test_can_build_region_page_in_constant_queries(self):
+        """
+        does a region page cost the same few queries however many suppliers it has
+        """
+        for region_name, region_slug in (("South Coast", "south-coast"), ("North Lahontan", "north-lahontan")):
+            region = HydrologicRegion.objects.create(hydrologic_region=region_name, hydrologic_region_slug=region_slug)
+            view = RegionDetailView()
+            view.kwargs = {}
+            view.object = region
+            with self.assertNumQueries(11):
+                context = view.get_context_data(object=region)
+            self.assertEqual(len(context["map_data"][0]["suppliers"]), WaterSupplierMonthlyReport.objects.filter(hydrologic_region=region_name, reporting_month=datetime.date(2016, 12, 15)).count())
+
+
+    def test_can_share_latest_release_until_ingest(self):
+        """
+        is the latest release worked out once and again only after the data version changes
+        """
+        version_path = os.path.join(tempfile.mkdtemp(), "data_version")
+        self.addCleanup(shutil.rmtree, os.path.dirname(version_path))
+        version = DataVersion(version_path)
+        version._can_bump()
+        with self.assertNumQueries(3):
+            release = CurrentRelease(version)._can_get()
+        with self.assertNumQueries(0):
+            region_release = CurrentRelease(version)._can_get("South Coast")
+        latest_month = WaterSupplierMonthlyReport.objects.filter(reporting_month=datetime.date(2016, 12, 15))
+        self.assertEqual(release["months_in_report"][:2], [datetime.date(2016, 12, 15), datetime.date(2016, 11, 15)])
+        self.assertEqual(sorted(release["latest_month_ids"]), sorted(latest_month.values_list("id", flat=True)))
+        self.assertEqual(sorted(region_release["latest_month_ids"]), sorted(latest_month.filter(hydrologic_region="South Coast").values_list("id", flat=True)))
+        version._can_bump()
+        with self.assertNumQueries(3):
+            CurrentRelease(version)._can_get()
+
+
+    def test_can_find_region_release_or_404(self):
+        """
+        are regions matched ignoring case and a region or supplier without reports a 404
+        """
+        release = CurrentRelease()._can_get("South Coast")
+        self.assertEqual(CurrentRelease()._can_get(" south coast "), release)
+        self.assertIsNotNone(release)
+        self.assertIsNone(CurrentRelease()._can_get("Atlantis"))
+        region = HydrologicRegion.objects.create(hydrologic_region="Atlantis", hydrologic_region_slug="atlantis")
+        for view_class in (RegionDetailView, RegionEmbedView):
+            view = view_class()
+            view.kwargs = {}
+            view.object = region
+            with self.assertRaises(Http404):
+                view.get_context_data(object=region)
+        supplier = WaterSupplier.objects.create(supplier_name="city of atlantis", supplier_slug="city-of-atlantis", hydrologic_region="Atlantis")
+        view = SupplierDetailView()
+        view.kwargs = {}
+        view.object = supplier
+        with self.assertRaises(Http404):
+            view.get_context_data(object=supplier)
+
+
+    def test_can_build_supplier_page_from_one_query(self):
+        """
+        are the comparisons worked out in memory the same as querying for each one
+        """
+        supplier = WaterSupplier.objects.get(supplier_slug="city-of-pasadena")
+        view = SupplierDetailView()
+        view.kwargs = {}
+        view.object = supplier
+        with self.assertNumQueries(1):
+            context = view.get_context_data(object=supplier)
+        queryset = WaterSupplierMonthlyReport.objects.filter(supplier_slug="city-of-pasadena").order_by("-reporting_month")
+        same_month = queryset.filter(reporting_month__month=12).order_by("-reporting_month")
+        self.assertEqual(context["same_month"], list(same_month))
+        self.assertEqual(context["range_of_years"], QueryUtilities()._range_of_years(same_month))
+        self.assertEqual(context["month_comparison_data"], QueryUtilities()._month_comparison_data(context["range_of_years"], same_month.order_by("reporting_month")))
+        self.assertEqual(context["yearly_comparison_data"], QueryUtilities()._new_yearly_data(context["range_of_years"], queryset))
+
+
+    def test_can_compare_region_years_from_one_query(self):
+        """
+        are the reduction comparisons for any years worked out from one fetch of the region's reports
+        """
+        region = HydrologicRegion.objects.create(hydrologic_region="South Coast", hydrologic_region_slug="south-coast")
+        view = ComparisonIndex(comparison_years=[2013, 2015, 2016])
+        view.kwargs = {}
+        view.object = region
+        with self.assertNumQueries(2):
+            context = view.get_context_data(object=region)
+        supplier = [supplier for supplier in context["water_suppliers"] if supplier.supplier_slug == "city-of-pasadena"][0]
+        same_month = WaterSupplierMonthlyReport.objects.filter(supplier_slug="city-of-pasadena", reporting_month__month=12).order_by("reporting_month")
+        self.assertEqual(supplier.month_comparison_data, QueryUtilities()._month_comparison_data([2013, 2015, 2016], same_month))
+        self.assertEqual((context["first_year"], context["previous_year"], context["last_year"]), (2013, 2015, 2016))
+        view = ComparisonIndex(comparison_years=[2014, 2016])
+        view.kwargs = {}
+        view.object = region
+        context = view.get_context_data(object=region)
+        supplier = [supplier for supplier in context["water_suppliers"] if supplier.supplier_slug == "city-of-pasadena"][0]
+        self.assertEqual([year["year"] for year in supplier.month_comparison_data], [2014, 2016])
+        self.assertEqual(supplier.comparison_previous, supplier.comparison_first)
+        self.assertEqual(supplier.comparison_first["use"], QueryUtilities()._millify(same_month.first().calculated_production_monthly_gallons_month_2013))
+        self.assertEqual(supplier.comparison_last["use"], QueryUtilities()._millify(same_month.last().calculated_production_monthly_gallons_month_2014))
+        view = SupplierDetailView(comparison_years=[2014, 2016])
+        view.kwargs = {}
+        view.object = WaterSupplier.objects.get(supplier_slug="city-of-pasadena")
+        context = view.get_context_data(object=view.object)
+        december = context["yearly_comparison_data"][11]
+        self.assertEqual([year["year"] for year in december["data"]], [2014, 2016])
+        self.assertEqual(december["data"][0]["use"], QueryUtilities()._millify(same_month.last().calculated_production_monthly_gallons_month_2013))
+        self.assertEqual(december["data"][1]["use"], QueryUtilities()._millify(same_month.last().calculated_production_monthly_gallons_month_2014))
+
+
+class TestParsedReleaseCache(TestCase):
+    """
+    tests that a workbook parsed once is ingested again from the parse cache
+    """
+
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        self.local_file = os.path.join(os.path.dirname(__file__), "data", "2015_12_01_enforcement_statistics.xlsx")
+        self.enforcement = LoadMonthlyEnforcementStats()
+        self.enforcement.data_version = CountingDataVersion(os.path.join(self.cache_path, "data_version"))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_path)
+
+
+    def _ingest(self):
+        timer = StageTimer()
+        summary = self.enforcement._init(local_file=self.local_file, streaming=True, cache=ParsedReleaseCache(self.cache_path), timer=timer)
+        return summary, timer
+
+
+    def test_can_skip_xlsx_on_cache_hit(self):
+        """
+        does the second run skip reading the workbook and write the same rows
+        """
+        summary, timer = self._ingest()
+        self.assertEqual(summary["parse_cache"], {"hits": 0, "misses": 1})
+        self.assertIn("read", timer.stages)
+        reports = list(WaterEnforcementMonthlyReport.objects.values_list("supplier_slug", "reporting_month", "fingerprint").order_by("id"))
+        WaterEnforcementMonthlyReport.objects.all().delete()
+        summary, timer = self._ingest()
+        self.assertEqual(summary["parse_cache"], {"hits": 1, "misses": 0})
+        self.assertNotIn("read", timer.stages)
+        self.assertEqual(list(WaterEnforcementMonthlyReport.objects.values_list("supplier_slug", "reporting_month", "fingerprint").order_by("id")), reports)
+        self.enforcement.parser_version += 1
+        summary, timer = self._ingest()
+        self.assertEqual(summary["parse_cache"], {"hits": 0, "misses": 1})
+        self.assertEqual(len(self.enforcement.data_version.tokens), 3)
+
+
+class TestReleaseCatalog(TestCase):
+    """
+    tests cataloging the workbooks in a data folder
+    """
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        for file_name in ["2015_12_01_enforcement_statistics.xlsx", "uw_supplier_data060616.xlsx"]:
+            shutil.copy(os.path.join(os.path.dirname(__file__), "data", file_name), self.data_path)
+        self.catalog = ReleaseCatalogMethods()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+
+    def test_can_refresh_catalog(self):
+        """
+        are releases added, marked ingested, reset when their contents change and dropped when gone
+        """
+        summary = self.catalog._can_refresh_catalog(self.data_path)
+        self.assertEqual((summary["added"], summary["changed"], summary["unchanged"], summary["removed"]), (2, 0, 0, 0))
+        self.assertEqual([(entry.release_date, entry.file_type) for entry in ReleaseCatalog.objects.order_by("release_date")], [(datetime.date(2015, 12, 1), "enforcement"), (datetime.date(2016, 6, 6), "usage")])
+        usage_file = os.path.join(self.data_path, "uw_supplier_data060616.xlsx")
+        self.assertEqual(self.catalog._can_record_ingest(usage_file, "enforcement", 10, 1.0), None)
+        self.catalog._can_record_ingest(usage_file, "usage", 11794, 2.5)
+        self.assertEqual(self.catalog._can_find_pending_releases(), [os.path.join(self.data_path, "2015_12_01_enforcement_statistics.xlsx")])
+        with open(usage_file, "ab") as release:
+            release.write(b"revised")
+        os.remove(os.path.join(self.data_path, "2015_12_01_enforcement_statistics.xlsx"))
+        summary = self.catalog._can_refresh_catalog(self.data_path)
+        self.assertEqual((summary["added"], summary["changed"], summary["unchanged"], summary["removed"]), (0, 1, 0, 1))
+        entry = ReleaseCatalog.objects.get()
+        self.assertEqual((entry.row_count, entry.ingested_date, entry.sha256), (None, None, MonthlyFormattingMethods()._can_hash_file(usage_file)))
+
+
+class CountingDataVersion(DataVersion):
+    """
+    a data version that remembers every token it writes
+    """
+
+    def __init__(self, version_path):
+        super(CountingDataVersion, self).__init__(version_path)
+        self.tokens = []
+
+
+    def _can_bump(self):
+        token = super(CountingDataVersion, self)._can_bump()
+        self.tokens.append(token)
+        return token
+
+
+class TestBackfillReports(TestCase):
+    """
+    tests that the parallel backfill stores what loading each release in turn would
+    """
+
+    fields = ["supplier_slug", "supplier_name_id", "hydrologic_region", "reporting_month", "report_date", "total_population_served", "calculated_rgpcd_2014", "residential_gallons_2014", "fingerprint"]
+
+    def setUp(self):
+        self.temporary_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temporary_path)
+        self.files = [self._make_workbook(file_name, 150) for file_name in ("uw_supplier_data120116.xlsx", "uw_supplier_data020817.xlsx")]
+        self.version = CountingDataVersion(os.path.join(self.temporary_path, "data_version"))
+        self._swap_attribute(BackfillMonthlyReports, "data_version", self.version)
+        self._swap_attribute(BackfillMonthlyReports, "snapshot", ReportSnapshotMethods(snapshot_path=os.path.join(self.temporary_path, "snapshot")))
+        cache_settings = self.settings(PARSE_CACHE_PATH=os.path.join(self.temporary_path, "parse_cache"))
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+
+
+    def _swap_attribute(self, owner, name, value):
+        self.addCleanup(setattr, owner, name, getattr(owner, name))
+        setattr(owner, name, value)
+
+
+    def _make_workbook(self, file_name, count):
+        """
+        the first count rows of an archived release saved as a workbook of its own
+        """
+        rows = list(itertools.islice(MonthlyFormattingMethods()._can_stream_excel_rows_from(os.path.join(os.path.dirname(__file__), "data", file_name)), count))
+        header = sorted(rows[0].keys())
+        workbook = Workbook()
+        worksheet = workbook.active
+        worksheet.append(header)
+        for row in rows:
+            worksheet.append([row[key] for key in header])
+        file_path = os.path.join(self.temporary_path, file_name)
+        workbook.save(file_path)
+        return file_path
+
+
+    def _take_stored_rows(self):
+        """
+        the stored usage rows, clearing the tables for the next load
+        """
+        stored = list(WaterSupplierMonthlyReport.objects.order_by("report_date", "supplier_slug", "reporting_month").values_list(*self.fields))
+        WaterSupplierMonthlyReport.objects.all().delete()
+        WaterEnforcementMonthlyReport.objects.all().delete()
+        WaterSupplier.objects.all().delete()
+        WaterSupplierAlias.objects.all().delete()
+        return stored
+
+
+    def test_can_match_loading_releases_in_turn(self):
+        """
+        does the backfill command store the same rows as a serial load and bump the data version once
+        """
+        output = StringIO()
+        call_command("backfill_reports", *self.files, processes=2, quarantine_file=os.path.join(self.temporary_path, "quarantine.json"), stdout=output)
+        self.assertIn("Wrote 300 usage rows", output.getvalue())
+        self.assertEqual(len(self.version.tokens), 1)
+        self.assertEqual(self.version._can_get_token(), self.version.tokens[0])
+        backfilled = self._take_stored_rows()
+        task_run = BuildMonthlyWaterUseReport()
+        for file_path in self.files:
+            list_of_data = task_run._can_parse_rows_from(MonthlyFormattingMethods()._can_stream_excel_rows_from(file_path), file_path)
+            task_run.aliases._can_load()
+            list_of_data = task_run.aliases._can_resolve_rows_from(list_of_data)
+            task_run.aliases._can_save_new_spellings()
+            list_of_data, quarantine = task_run.screener._can_screen_release(list_of_data)
+            task_run.bulky._can_bulk_save_release_from(list_of_data)
+        serial = self._take_stored_rows()
+        self.assertEqual(len(backfilled), 300)
+        self.assertEqual(backfilled, serial)
+
+
+class TestSupplierAliasIndex(TestCase):
+    """
+    tests resolving published supplier names through the alias table
+    """
+
+    def setUp(self):
+        for name in ["city of ontario", "los angeles county public works waterworks district 40", "east valley water district"]:
+            formatted = SupplierNameNormalizer()._can_prettify_and_slugify(name)
+            WaterSupplier.objects.create(supplier_name=formatted["supplier_name"], supplier_slug=formatted["supplier_slug"])
+        self.aliases = SupplierAliasIndex()
+
+
+    def _make_rows(self, raw_names):
+        normalizer = SupplierNameNormalizer()
+        return [dict(normalizer._can_prettify_and_slugify(raw_name), raw_supplier_name=raw_name) for raw_name in raw_names]
+
+
+    def test_can_resolve_supplier_names(self):
+        """
+        are seeded renames and skips applied, new spellings learned and near duplicates held
+        """
+        raw_names = ["Ontario  City of", "San Bernardino County Service Area 70J", "Cloverdale", "", "Los Angeles County Public Works Waterworks Dist 40", "West Valley Water District", "Ontario  City of"]
+        self.aliases._can_load()
+        self.assertEqual(sorted(raw_name for raw_name, alias in self.aliases.aliases.iteritems() if alias["skip"] == True), ["", "Cloverdale", "Coalinga City of", "Mountain House Community Services District"])
+        self.assertEqual(self.aliases.aliases["San Bernardino County Service Area 70J"]["supplier_slug"], "san-bernardino-county-service-area-70")
+        resolved = self.aliases._can_resolve_rows_from(self._make_rows(raw_names))
+        self.assertEqual([data["supplier_slug"] for data in resolved], ["city-of-ontario", "san-bernardino-county-service-area-70", "west-valley-water-district", "city-of-ontario"])
+        summary = self.aliases._can_save_new_spellings()
+        self.assertEqual((summary["resolved"], summary["skipped"], summary["held"], summary["learned"]), (4, 2, 1, 3))
+        self.assertEqual([(alias["raw_name"], alias["suggested_slug"]) for alias in summary["flagged"]], [("Los Angeles County Public Works Waterworks Dist 40", "los-angeles-county-public-works-waterworks-district-40")])
+        self.aliases._can_settle_alias("Los Angeles County Public Works Waterworks Dist 40", accept=True)
+        self.aliases._can_load()
+        resolved = self.aliases._can_resolve_rows_from(self._make_rows(raw_names))
+        self.assertEqual(resolved[2]["supplier_slug"], "los-angeles-county-public-works-waterworks-district-40")
+        self.assertEqual(self.aliases._can_save_new_spellings()["learned"], 0)
+
+
+class TestReleaseScreening(TestCase):
+    """
+    tests screening a release for values that shouldn't be written
+    """
+
+    def setUp(self):
+        self.screener = ReleaseScreeningMethods()
+        self.bulky = BulkUpsertMethods()
+
+
+    def _make_row(self, slug, month, gallons, population=10000, report_date=datetime.date(2017, 2, 8)):
+        data = {field: None for field in self.bulky.supplier_fields + self.bulky.report_fields}
+        data.update({
+            "supplier_slug": slug,
+            "supplier_name": slug.replace("-", " "),
+            "supplier_active": True,
+            "created_date": datetime.datetime(2017, 2, 8),
+            "mandatory_restrictions": True,
+            "reporting_month": datetime.datetime(2016, month, 15),
+            "report_date": report_date,
+            "units": "G",
+            "total_population_served": population,
+            "production_gallons_2014": gallons,
+            "residential_gallons_2014": gallons * 0.6,
+            "days_in_month": 30,
+        })
+        return data
+
+
+    def test_can_quarantine_suspect_rows(self):
+        """
+        are missing populations, unit slips and revisions far from the supplier's other months held back
+        """
+        WaterSupplier.objects.create(supplier_name="city of ontario", supplier_slug="city-of-ontario")
+        previous = self._make_row("city-of-ontario", 9, 20000000, report_date=datetime.date(2017, 1, 5))
+        self.bulky._can_bulk_save_release_from([previous])
+        list_of_data = [self._make_row("city-of-ontario", month, gallons) for month, gallons in [(9, 200000000), (10, 31000000), (11, 29000000), (12, 30000000)]]
+        list_of_data.append(self._make_row("city-of-ontario", 8, 30, population=10000))
+        list_of_data.append(self._make_row("city-of-ontario", 7, 30000000, population=0))
+        list_to_write, quarantine = self.screener._can_screen_release(list_of_data)
+        self.assertEqual([data["reporting_month"].month for data in list_to_write], [10, 11, 12])
+        checks = {report["reporting_month"].month: report["checks"] for report in quarantine}
+        self.assertEqual(checks[9], ["revision_swing"])
+        self.assertEqual(checks[8], ["rgpcd_range", "unit_scale"])
+        self.assertEqual(checks[7], ["population"])
+        self.assertEqual(self.screener._can_screen_release(list_to_write), (list_to_write, []))
+
+
+class TestStageTimer(TestCase):
+    """
+    tests the per stage timings reported by the ingest commands
+    """
+
+    def test_can_report_stages(self):
+        """
+        do nested stages add up and come out as a table and as json
+        """
+        progress = []
+        timer = StageTimer(progress_every=2, write=progress.append)
+        rows = timer._can_time_rows("read", range(5), within="parse")
+        with timer._can_time_stage("parse") as stage:
+            rows = list(rows)
+            for row in rows:
+                timer._can_tick("parse")
+            timer._can_add_to_stage("normalize", 0.0, rows=len(rows), within="parse")
+            stage["rows"] = len(rows)
+        report = timer._can_report_stages()
+        self.assertEqual([stage["stage"] for stage in report], ["read", "parse", "normalize"])
+        self.assertEqual([stage["rows"] for stage in report], [5, 5, 5])
+        self.assertEqual(len(progress), 2)
+        self.assertIn("total", timer._can_format_stages())
+        temporary_path = tempfile.mkdtemp()
+        try:
+            timer._can_write_stages_to(os.path.join(temporary_path, "timings.json"), command="test")
+            with open(os.path.join(temporary_path, "timings.json"), "rb") as timings_file:
+                self.assertEqual(json.load(timings_file)["command"], "test")
+        finally:
+            shutil.rmtree(temporary_path)
+
+
+class TestReleasePipeline(TestCase):
+    """
+    tests handing parsed rows from the worker process to the writer
+    """
+
+    def _make_rows(self, count, fail_at=None):
+        for row in range(count):
+            if row == fail_at:
+                raise ValueError("bad row %s" % (row))
+            yield {"row": row}
+
+
+    def test_can_hand_over_batches(self):
+        """
+        do batches come back in order with the worker's timings and stop on errors
+        """
+        timer = StageTimer()
+        pipeline = ReleasePipeline(timer=timer, batch_size=3, queue_size=1)
+        rows = timer._can_time_rows("read", self._make_rows(10), within="parse")
+        batches = list(pipeline._can_iterate_batches_from(rows, report=lambda: "done"))
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 3, 1])
+        self.assertEqual([data["row"] for batch in batches for data in batch], range(10))
+        self.assertEqual(timer._can_get_stage("read")["rows"], 10)
+        self.assertEqual(pipeline.report, "done")
+        with self.assertRaises(ValueError):
+            list(ReleasePipeline(batch_size=3)._can_iterate_batches_from(self._make_rows(10, fail_at=5)))
+        for batch in ReleasePipeline(batch_size=3, queue_size=1)._can_iterate_batches_from(self._make_rows(1000)):
+            break
+        self.assertEqual(batch, [{"row": 0}, {"row": 1}, {"row": 2}])
+
+
+    def test_can_match_serial_ingest(self):
+        """
+        does a pipelined ingest store what a serial one does, normalizing names in this process
+        """
+        file_path = os.path.join(os.path.dirname(__file__), "data", "uw_supplier_data020817.xlsx")
+        fields = ["supplier_slug", "supplier_name_id", "reporting_month", "report_date", "total_population_served", "calculated_rgpcd_2014", "fingerprint"]
+        stored = []
+        for pipelined in (False, True):
+            task_run = BuildMonthlyWaterUseReport()
+            task_run.normalizer = SupplierNameNormalizer()
+            rows = itertools.islice(task_run.sluggy._can_stream_excel_rows_from(file_path), 1200)
+            summary = task_run._can_build_model_instance(rows, file_path, pipelined=pipelined)
+            self.assertEqual(summary["supplier_cache"]["hits"] + summary["supplier_cache"]["misses"], 1200)
+            stored.append(list(WaterSupplierMonthlyReport.objects.order_by("supplier_slug", "reporting_month").values_list(*fields)))
+            WaterSupplierMonthlyReport.objects.all().delete()
+            WaterSupplier.objects.all().delete()
+        self.assertEqual(len(stored[0]), 1200)
+        self.assertEqual(stored[0], stored[1])
+
+
+    def test_can_stop_when_the_worker_dies(self):
+        """
+        does the writer raise rather than wait forever when the worker is killed
+        """
+        def rows():
+            yield {"row": 0}
+            os._exit(1)
+        started = time.time()
+        with self.assertRaises(RuntimeError):
+            list(ReleasePipeline(batch_size=3)._can_iterate_batches_from(rows()))
+        self.assertLess(time.time() - started, 10)
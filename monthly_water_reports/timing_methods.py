@@ -0,0 +1,123 @@
+from __future__ import division
+from contextlib import contextmanager
+from collections import OrderedDict
+import logging
+import time
+import json
+
+logger = logging.getLogger("cali_water_reports")
+
+class StageTimer(object):
+    """
+    records wall time and row counts for each stage of an ingest run
+    """
+
+    def __init__(self, progress_every=0, write=None):
+        self.stages = OrderedDict()
+        self.progress_every = progress_every
+        self.write = write or logger.debug
+
+
+    @contextmanager
+    def _can_time_stage(self, name):
+        """
+        time a block of work, the block can set rows on the stage it is handed
+        """
+        stage = self._can_get_stage(name)
+        started = time.time()
+        try:
+            yield stage
+        finally:
+            stage["seconds"] += time.time() - started
+
+
+    def _can_get_stage(self, name):
+        """
+        stages are created in the order they first run
+        """
+        if name not in self.stages:
+            self.stages[name] = {"stage": name, "seconds": 0.0, "rows": None, "ticks": 0, "started": time.time()}
+        return self.stages[name]
+
+
+    def _can_add_to_stage(self, name, seconds, rows=None, within=None):
+        """
+        credit time spent inside another stage's loop to its own stage
+        and take it back out of the stage it ran within so totals still add up
+        """
+        stage = self._can_get_stage(name)
+        stage["seconds"] += seconds
+        if rows is not None:
+            stage["rows"] = (stage["rows"] or 0) + rows
+        if within is not None:
+            self._can_get_stage(within)["seconds"] -= seconds
+
+
+    def _can_time_rows(self, name, rows, within=None):
+        """
+        wrap a lazy reader so the time spent producing rows is credited to a stage
+        """
+        self._can_get_stage(name)
+        return self._can_yield_timed_rows(name, iter(rows), within)
+
+
+    def _can_yield_timed_rows(self, name, rows, within):
+        """
+        """
+        while True:
+            started = time.time()
+            try:
+                row = next(rows)
+            except StopIteration:
+                self._can_add_to_stage(name, time.time() - started, within=within)
+                return
+            self._can_add_to_stage(name, time.time() - started, rows=1, within=within)
+            yield row
+
+
+    def _can_tick(self, name):
+        """
+        count a row and write an aggregate progress line every progress_every rows
+        """
+        stage = self._can_get_stage(name)
+        stage["ticks"] += 1
+        if self.progress_every and stage["ticks"] % self.progress_every == 0:
+            elapsed = time.time() - stage["started"]
+            self.write("%s: %s rows in %.2f seconds (%.1f rows/sec)\n" % (name, stage["ticks"], elapsed, stage["ticks"] / elapsed if elapsed else 0))
+
+
+    def _can_report_stages(self):
+        """
+        the timings as a list of dictionaries ready to be written out as json
+        """
+        report = []
+        for stage in self.stages.values():
+            rows = stage["rows"] if stage["rows"] is not None else (stage["ticks"] or None)
+            report.append({
+                "stage": stage["stage"],
+                "seconds": round(stage["seconds"], 4),
+                "rows": rows,
+                "rows_per_second": round(rows / stage["seconds"], 1) if rows and stage["seconds"] else None,
+            })
+        return report
+
+
+    def _can_format_stages(self):
+        """
+        a compact table of the timings for the end of a management command
+        """
+        report = self._can_report_stages()
+        lines = ["%-10s %10s %10s %12s" % ("stage", "seconds", "rows", "rows/sec")]
+        for stage in report:
+            lines.append("%-10s %10.2f %10s %12s" % (stage["stage"], stage["seconds"], stage["rows"] if stage["rows"] is not None else "-", stage["rows_per_second"] if stage["rows_per_second"] is not None else "-"))
+        lines.append("%-10s %10.2f" % ("total", sum(stage["seconds"] for stage in report)))
+        return "\n".join(lines) + "\n"
+
+
+    def _can_write_stages_to(self, file_path, **extra):
+        """
+        write the timings and anything else worth keeping about the run to a json file
+        """
+        output = dict(extra, stages=self._can_report_stages())
+        with open(file_path, "wb") as output_file:
+            json.dump(output, output_file, indent=4, sort_keys=True, default=str)
@@ -0,0 +1,52 @@
+from __future__ import division
+import calendar
+import logging
+
+logger = logging.getLogger("cali_water_reports")
+
+class UnitConversionMethods(object):
+    """
+    one place to turn the units suppliers report in to gallons
+    """
+
+    # gallons in one of each unit the state water board publishes
+    unit_to_gallons = {
+        "G": 1,
+        "MG": 1000000,
+        "CCF": 748,
+        "AF": 325851,
+    }
+
+    def _can_convert_to_gallons(self, value, units):
+        """
+        units we don't recognize are taken to already be gallons
+        """
+        if value is None:
+            return None
+        return value * self.unit_to_gallons.get((units or "G").upper(), 1)
+
+
+    def _can_make_residential_gallons(self, gallons, percent_residential_use):
+        """
+        the share of a month's production that went to residential customers
+        """
+        if gallons is None or percent_residential_use is None:
+            return None
+        return gallons * percent_residential_use
+
+
+    def _can_make_canonical_values_from(self, data):
+        """
+        the gallons, residential gallons and days in month stored with each monthly report
+        so averages can be summed in the database instead of recomputed for every row
+        """
+        reporting_month = data["reporting_month"]
+        values = {
+            "production_gallons_2014": self._can_convert_to_gallons(data["total_monthly_potable_water_production_2014"], data["units"]),
+            "production_gallons_2013": self._can_convert_to_gallons(data["total_monthly_potable_water_production_2013"], data["units"]),
+            "days_in_month": calendar.monthrange(reporting_month.year, reporting_month.month)[1] if reporting_month else None,
+        }
+        # residential use is figured from the state's calculated gallons as the site always has
+        values["residential_gallons_2014"] = self._can_make_residential_gallons(data["calculated_production_monthly_gallons_month_2014"], data["percent_residential_use"])
+        values["residential_gallons_2013"] = self._can_make_residential_gallons(data["calculated_production_monthly_gallons_month_2013"], data["percent_residential_use"])
+        return values
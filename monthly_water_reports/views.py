@@ -11,6 +11,7 @@ from django.shortcuts import render
 from django.views.generic import View, ListView, DetailView
 from django.db.models import Q, Avg, Max, Min, Sum, Count
 from monthly_water_reports.models import WaterSupplier, WaterSupplierMonthlyReport, WaterEnforcementMonthlyReport, WaterConservationMethod, HydrologicRegion
+from monthly_water_reports.release_methods import CurrentRelease
 from bakery.views import BuildableListView, BuildableDetailView
 import json
 import os
@@ -42,54 +43,58 @@ class InitialIndex(BuildableListView):
         # get all the reports
         queryset = super(InitialIndex, self).get_queryset()
 
-        # get all of the water suppliers
-        water_suppliers = WaterSupplier.objects.exclude(supplier_active=False)
-
         # new instance of the utility class
         new_queries = QueryUtilities()
 
-        # queryset of the latest month of data from the most recent report
-        latest_month_latest_report = new_queries._latest_month_latest_report(queryset)
-
-        # queryset of all the months of data from the most recent report
-        all_months_latest_report = new_queries._all_months_latest_report(queryset)
+        # the most recent report submitted to the state and the latest month of data in any report
+        # worked out once and shared by every page until the next ingest
+        latest_release = CurrentRelease()._can_get()
+        if latest_release is None:
+            raise Http404("no reports have been ingested")
 
-        # list of months available in the most recent report
-        months_in_report = all_months_latest_report.exclude(reporting_month__isnull=True).values("reporting_month").distinct().order_by("-reporting_month")
+        # every row of the most recent report in one query, split up by region below
+        all_months_latest_report = list(queryset.filter(report_date = latest_release["report_date"]).values("supplier_name", "hydrologic_region", "reporting_month", "calculated_rgpcd_2014", "residential_gallons_2014", "residential_gallons_2013", "total_population_served", "days_in_month"))
 
-        # get the max value of calculated_rgpcd_2014 in the latest report
-        global_max = latest_month_latest_report.values("calculated_rgpcd_2014").aggregate(Max("calculated_rgpcd_2014"))
+        # rows of the latest month of data from the most recent report
+        latest_month_latest_report = [row for row in all_months_latest_report if row["reporting_month"] >= latest_release["reporting_month"]]
 
-        # get the min value of calculated_rgpcd_2014 in the latest report
-        global_min = latest_month_latest_report.values("calculated_rgpcd_2014").aggregate(Min("calculated_rgpcd_2014"))
+        # list of months available in the most recent report
+        months_in_report = latest_release["months_in_report"]
 
-        # create the hydrologic_region option list
-        hydrologic_regions = water_suppliers.exclude(hydrologic_region__isnull=True).values("hydrologic_region").distinct()
+        # get the max and min values of calculated_rgpcd_2014 in the latest report
+        global_max = {"calculated_rgpcd_2014__max": new_queries._get_max_or_min_from(latest_month_latest_report, "calculated_rgpcd_2014", max)}
+        global_min = {"calculated_rgpcd_2014__min": new_queries._get_max_or_min_from(latest_month_latest_report, "calculated_rgpcd_2014", min)}
 
-        for item in hydrologic_regions:
-            item["suppliers"] = water_suppliers.filter(hydrologic_region = item["hydrologic_region"]).order_by("supplier_name")
+        # get all of the water suppliers and create the hydrologic_region option list
+        water_suppliers = list(WaterSupplier.objects.exclude(supplier_active=False).exclude(hydrologic_region__isnull=True).only("supplier_name", "hydrologic_region").order_by("supplier_name"))
+        hydrologic_regions = []
+        for region in sorted(set(supplier.hydrologic_region for supplier in water_suppliers)):
+            hydrologic_regions.append({"hydrologic_region": region, "suppliers": [supplier for supplier in water_suppliers if supplier.hydrologic_region == region]})
 
         # create the hydrologic_region data for the maps
-        map_data = water_suppliers.exclude(hydrologic_region__isnull=True).values("hydrologic_region").distinct().order_by("hydrologic_region")
+        map_data = [{"hydrologic_region": item["hydrologic_region"]} for item in hydrologic_regions]
 
         for item in map_data:
-            this_month = all_months_latest_report.filter(hydrologic_region = item["hydrologic_region"]).filter(reporting_month = months_in_report[0]["reporting_month"])
-            item["this_month_avg"] = new_queries._get_avg_rgcpd(this_month)
+            region_rows = [row for row in all_months_latest_report if row["hydrologic_region"] == item["hydrologic_region"]]
+            region_latest = new_queries._order_rows_by([row for row in latest_month_latest_report if row["hydrologic_region"] == item["hydrologic_region"]], "calculated_rgpcd_2014")
 
-            item["this_month_baseline_avg"] = new_queries._get_last_year_avg_rgcpd(this_month)
+            this_month = [row for row in region_rows if row["reporting_month"] == months_in_report[0]]
+            item["this_month_avg"] = new_queries._get_rgcpd_from_rows(this_month, "residential_gallons_2014")
 
-            last_month = all_months_latest_report.filter(hydrologic_region = item["hydrologic_region"]).filter(reporting_month = months_in_report[1]["reporting_month"])
-            item["last_month_avg"] = new_queries._get_avg_rgcpd(last_month)
+            item["this_month_baseline_avg"] = new_queries._get_rgcpd_from_rows(this_month, "residential_gallons_2013")
 
-            item["suppliers"] = list(latest_month_latest_report.filter(hydrologic_region = item["hydrologic_region"]).values("supplier_name", "calculated_rgpcd_2014").order_by("calculated_rgpcd_2014"))
+            last_month = [row for row in region_rows if row["reporting_month"] == months_in_report[1]]
+            item["last_month_avg"] = new_queries._get_rgcpd_from_rows(last_month, "residential_gallons_2014")
 
-            item["count"] = latest_month_latest_report.filter(hydrologic_region = item["hydrologic_region"]).count()
+            item["suppliers"] = [{"supplier_name": row["supplier_name"], "calculated_rgpcd_2014": row["calculated_rgpcd_2014"]} for row in region_latest]
 
-            item["this_max"] = latest_month_latest_report.filter(hydrologic_region = item["hydrologic_region"]).values("calculated_rgpcd_2014").aggregate(Max("calculated_rgpcd_2014"))
+            item["count"] = len(region_latest)
 
-            item["this_min"] = latest_month_latest_report.filter(hydrologic_region = item["hydrologic_region"]).values("calculated_rgpcd_2014").aggregate(Min("calculated_rgpcd_2014"))
+            item["this_max"] = {"calculated_rgpcd_2014__max": new_queries._get_max_or_min_from(region_latest, "calculated_rgpcd_2014", max)}
 
-            item["median"] =  latest_month_latest_report.filter(hydrologic_region = item["hydrologic_region"]).values_list("calculated_rgpcd_2014", flat=True).order_by("calculated_rgpcd_2014")[int(round(item["count"]/2))]
+            item["this_min"] = {"calculated_rgpcd_2014__min": new_queries._get_max_or_min_from(region_latest, "calculated_rgpcd_2014", min)}
+
+            item["median"] = region_latest[int(round(item["count"]/2))]["calculated_rgpcd_2014"]
 
             item["min_range"] = new_queries.pct_value_inside_arbitrary_range(item["this_min"]["calculated_rgpcd_2014__min"], global_min["calculated_rgpcd_2014__min"], global_max["calculated_rgpcd_2014__max"])
 
@@ -103,20 +108,20 @@ class InitialIndex(BuildableListView):
                 supplier["distribution_percent"] = new_queries.pct_value_inside_arbitrary_range(supplier["calculated_rgpcd_2014"], global_min["calculated_rgpcd_2014__min"], global_max["calculated_rgpcd_2014__max"])
 
         # calculate the state average rgcpd for the current month
-        state_this_month = all_months_latest_report.filter(reporting_month = months_in_report[0]["reporting_month"])
-        state_avg_latest = new_queries._get_avg_rgcpd(state_this_month)
+        state_this_month = [row for row in all_months_latest_report if row["reporting_month"] == months_in_report[0]]
+        state_avg_latest = new_queries._get_rgcpd_from_rows(state_this_month, "residential_gallons_2014")
 
         # calculate the state average rgcpd for last month
-        state_last_month = all_months_latest_report.filter(reporting_month = months_in_report[1]["reporting_month"])
-        state_avg_last = new_queries._get_avg_rgcpd(state_last_month)
+        state_last_month = [row for row in all_months_latest_report if row["reporting_month"] == months_in_report[1]]
+        state_avg_last = new_queries._get_rgcpd_from_rows(state_last_month, "residential_gallons_2014")
 
         return {
             "article_content": config["article_content"],
             "about_content": config["about_content"],
             "config_object": json.dumps(config["config_object"]),
-            "target_report": latest_month_latest_report[0].reporting_month,
+            "target_report": latest_month_latest_report[0]["reporting_month"],
             "option_list": hydrologic_regions,
-            "map_data": list(map_data),
+            "map_data": map_data,
             "global_max": global_max,
             "global_min": global_min,
             "state_avg_latest": state_avg_latest,
@@ -183,14 +188,19 @@ class RegionDetailView(BuildableDetailView):
         # new instance of the utility class
         new_queries = QueryUtilities()
 
+        # which rows make up the most recent report, worked out once until the next ingest
+        latest_release = CurrentRelease()._can_get(context["region_name"])
+        if latest_release is None:
+            raise Http404("no reports have been ingested for %s" % (context["region_name"]))
+
         # queryset of the latest month of data from the most recent report
-        latest_month_latest_report = new_queries._latest_month_latest_report(queryset)
+        latest_month_latest_report = new_queries._latest_month_latest_report(queryset, latest_release)
 
         # queryset of all the months of data from the most recent report
-        all_months_latest_report = new_queries._all_months_latest_report(queryset)
+        all_months_latest_report = new_queries._all_months_latest_report(queryset, latest_release)
 
         # list of months available in the most recent report
-        months_in_report = all_months_latest_report.exclude(reporting_month__isnull=True).values("reporting_month").distinct().order_by("-reporting_month")
+        months_in_report = latest_release["months_in_report"]
 
         # get the max value of calculated_rgpcd_2014 in the latest report
         context["global_max"] = latest_month_latest_report.values("calculated_rgpcd_2014").aggregate(Max("calculated_rgpcd_2014"))
@@ -212,13 +222,13 @@ class RegionDetailView(BuildableDetailView):
         item["hydrologic_region"] = context["region_name"]
 
         # create the hydrologic_region data for the overview
-        this_month = all_months_latest_report.filter(hydrologic_region = context["region_name"]).filter(reporting_month = months_in_report[0]["reporting_month"])
+        this_month = all_months_latest_report.filter(hydrologic_region = context["region_name"]).filter(reporting_month = months_in_report[0])
         item["this_month_avg"] = new_queries._get_avg_rgcpd(this_month)
 
         this_month_baseline_avg = new_queries._get_last_year_avg_rgcpd(this_month)
         item["this_month_baseline_avg"] = this_month_baseline_avg
 
-        last_month = all_months_latest_report.filter(hydrologic_region = context["region_name"]).filter(reporting_month = months_in_report[1]["reporting_month"])
+        last_month = all_months_latest_report.filter(hydrologic_region = context["region_name"]).filter(reporting_month = months_in_report[1])
         item["last_month_avg"] = new_queries._get_avg_rgcpd(last_month)
 
         item["suppliers"] = list(latest_month_latest_report.filter(hydrologic_region = context["region_name"]).values("supplier_name", "supplier_slug", "reporting_month", "calculated_rgpcd_2013", "calculated_rgpcd_2014", "calculated_production_monthly_gallons_month_2014", "calculated_production_monthly_gallons_month_2013", "percent_residential_use").order_by("supplier_name_id", "calculated_rgpcd_2013", "calculated_rgpcd_2014"))
@@ -248,35 +258,6 @@ class RegionDetailView(BuildableDetailView):
 
             supplier["distribution_percent"] = new_queries.pct_value_inside_arbitrary_range(supplier["calculated_rgpcd_2014"], context["global_min"]["calculated_rgpcd_2014__min"], context["global_max"]["calculated_rgpcd_2014__max"])
 
-            supplier_info = WaterSupplier.objects.get(supplier_slug = supplier["supplier_slug"])
-
-            baseline_usage_list = [
-                supplier_info.production_2013_june,
-                supplier_info.production_2013_july,
-                supplier_info.production_2013_aug,
-                supplier_info.production_2013_sept,
-                supplier_info.production_2013_oct,
-                supplier_info.production_2013_nov,
-                supplier_info.production_2013_dec,
-                supplier_info.production_2013_jan,
-                supplier_info.production_2013_feb,
-            ]
-
-            current_usage_list = all_months_latest_report.filter(supplier_slug = supplier["supplier_slug"]).filter(reporting_month__gte = "2015-06-01").filter(reporting_month__lte = "2016-02-29").values_list("calculated_production_monthly_gallons_month_2014", flat=True).order_by("calculated_production_monthly_gallons_month_2014")
-
-            # supplier["cum_data"] = new_queries._create_cumulative_savings(current_usage_list, baseline_usage_list, supplier_info.june_11_reduction, supplier["supplier_slug"])
-
-            # if supplier["cum_data"] == None:
-            #     item["no_data"].append(supplier["supplier_slug"])
-            # else:
-            #     if supplier["cum_data"]["cum_success"] == True:
-            #         item["achieved_target"].append(supplier["supplier_slug"])
-            #     else:
-            #         if supplier["cum_data"]["cum_output"] == "narrowly missed":
-            #             item["missed_target"].append(supplier["supplier_slug"])
-            #         elif supplier["cum_data"]["cum_output"] == "failed to meet":
-            #             item["failed_target"].append(supplier["supplier_slug"])
-
         context["map_data"].append(item)
 
         return context
@@ -341,14 +322,19 @@ class RegionEmbedView(BuildableDetailView):
         # new instance of the utility class
         new_queries = QueryUtilities()
 
+        # which rows make up the most recent report, worked out once until the next ingest
+        latest_release = CurrentRelease()._can_get(context["region_name"])
+        if latest_release is None:
+            raise Http404("no reports have been ingested for %s" % (context["region_name"]))
+
         # queryset of the latest month of data from the most recent report
-        latest_month_latest_report = new_queries._latest_month_latest_report(queryset)
+        latest_month_latest_report = new_queries._latest_month_latest_report(queryset, latest_release)
 
         # queryset of all the months of data from the most recent report
-        all_months_latest_report = new_queries._all_months_latest_report(queryset)
+        all_months_latest_report = new_queries._all_months_latest_report(queryset, latest_release)
 
         # list of months available in the most recent report
-        months_in_report = all_months_latest_report.exclude(reporting_month__isnull=True).values("reporting_month").distinct().order_by("-reporting_month")
+        months_in_report = latest_release["months_in_report"]
 
         # get the max value of calculated_rgpcd_2014 in the latest report
         context["global_max"] = latest_month_latest_report.values("calculated_rgpcd_2014").aggregate(Max("calculated_rgpcd_2014"))
@@ -370,13 +356,13 @@ class RegionEmbedView(BuildableDetailView):
         item["hydrologic_region"] = context["region_name"]
 
         # create the hydrologic_region data for the overview
-        this_month = all_months_latest_report.filter(hydrologic_region = context["region_name"]).filter(reporting_month = months_in_report[0]["reporting_month"])
+        this_month = all_months_latest_report.filter(hydrologic_region = context["region_name"]).filter(reporting_month = months_in_report[0])
         item["this_month_avg"] = new_queries._get_avg_rgcpd(this_month)
 
         this_month_baseline_avg = new_queries._get_last_year_avg_rgcpd(this_month)
         item["this_month_baseline_avg"] = this_month_baseline_avg
 
-        last_month = all_months_latest_report.filter(hydrologic_region = context["region_name"]).filter(reporting_month = months_in_report[1]["reporting_month"])
+        last_month = all_months_latest_report.filter(hydrologic_region = context["region_name"]).filter(reporting_month = months_in_report[1])
         item["last_month_avg"] = new_queries._get_avg_rgcpd(last_month)
 
         item["suppliers"] = list(latest_month_latest_report.filter(hydrologic_region = context["region_name"]).values("supplier_name", "supplier_slug", "reporting_month", "calculated_rgpcd_2013", "calculated_rgpcd_2014", "calculated_production_monthly_gallons_month_2014", "calculated_production_monthly_gallons_month_2013", "percent_residential_use").order_by("supplier_name_id", "calculated_rgpcd_2013", "calculated_rgpcd_2014"))
@@ -416,6 +402,10 @@ class ComparisonIndex(BuildableDetailView):
 
     sub_directory = "region/"
 
+    # the years shown for each supplier's latest month, the first is read from the baseline figures
+    # set another list with as_view(comparison_years=[...]) or on a subclass
+    comparison_years = [2013, 2015, 2016]
+
     def get_object(self):
         object = super(ComparisonIndex, self).get_object()
         return object
@@ -464,17 +454,33 @@ class ComparisonIndex(BuildableDetailView):
         context["region_name"] = self.object.hydrologic_region
 
         # get all of the water suppliers
-        context["water_suppliers"] = WaterSupplier.objects.all().filter(hydrologic_region = context["region_name"]).order_by("hydrologic_region", "supplier_name")
+        context["water_suppliers"] = list(WaterSupplier.objects.all().filter(hydrologic_region = context["region_name"]).order_by("hydrologic_region", "supplier_name"))
+
+        # the years to compare, the first and second to last are each compared to the last
+        context["comparison_years"] = self.comparison_years
+        context["first_year"] = self.comparison_years[0]
+        context["previous_year"] = self.comparison_years[-2]
+        context["last_year"] = self.comparison_years[-1]
+        context["change_column"] = len(self.comparison_years) + 2
+
+        # every report for the region's suppliers in one query, grouped by supplier
+        reports_by_supplier = {}
+        for report in WaterSupplierMonthlyReport.objects.filter(supplier_slug__in=[supplier.supplier_slug for supplier in context["water_suppliers"]]).order_by("supplier_slug", "-reporting_month", "-report_date"):
+            reports_by_supplier.setdefault(report.supplier_slug, []).append(report)
 
         for supplier in context["water_suppliers"]:
-            supplier.reports = WaterSupplierMonthlyReport.objects.filter(supplier_slug=supplier.supplier_slug).order_by("-reporting_month")
+            series = SupplierReportSeries(reports_by_supplier.get(supplier.supplier_slug, []), baseline_year=self.comparison_years[0])
+            supplier.reports = series.reports
             if supplier.reports:
                 supplier.latest_month = supplier.reports[0]
                 supplier.this_month = supplier.latest_month.reporting_month.month
                 context["which_month"] = supplier.latest_month.reporting_month
-                supplier.same_month = supplier.reports.filter(reporting_month__month=supplier.this_month).order_by("-reporting_month")
-                supplier.range_of_years = [2013, 2015, 2016]
-                supplier.month_comparison_data = q._month_comparison_data(supplier.range_of_years, supplier.same_month.order_by("reporting_month"))
+                supplier.same_month = series._get_same_month(supplier.this_month)
+                supplier.range_of_years = self.comparison_years
+                supplier.month_comparison_data = series._month_comparison_data(supplier.range_of_years, list(reversed(supplier.same_month)))
+                supplier.comparison_first = supplier.month_comparison_data[0]
+                supplier.comparison_previous = supplier.month_comparison_data[-2]
+                supplier.comparison_last = supplier.month_comparison_data[-1]
         return context
 
 
@@ -550,6 +556,9 @@ class SupplierDetailView(BuildableDetailView):
     template_name = "monthly_water_reports/supplier_detail.html"
     slug_field = "supplier_slug"
 
+    # the years charted for each month, the first is read from the baseline figures
+    comparison_years = [2013, 2015, 2016]
+
     def get_object(self):
         object = super(SupplierDetailView, self).get_object()
         return object
@@ -590,16 +599,19 @@ class SupplierDetailView(BuildableDetailView):
         # add the javascript config to the context
         context["config_object"] = config["config_object"]
 
-        # get reports for this district
-        context["reports"] = WaterSupplierMonthlyReport.objects.filter(supplier_slug=self.object.supplier_slug).order_by("-reporting_month")
+        # get reports for this district in one query, the rest of the page is worked out from them in memory
+        series = SupplierReportSeries(WaterSupplierMonthlyReport.objects.filter(supplier_slug=self.object.supplier_slug).order_by("-reporting_month", "-report_date"), baseline_year=self.comparison_years[0])
+        context["reports"] = series.reports
+        if not context["reports"]:
+            raise Http404("no reports have been ingested for %s" % (self.object.supplier_name))
         context["latest_month"] = context["reports"][0]
         context["last_month"] = context["reports"][1]
         context["this_month"] = context["latest_month"].reporting_month.month
-        context["same_month"] = context["reports"].filter(reporting_month__month=context["this_month"]).order_by("-reporting_month")
-        context["range_of_years"] = q._range_of_years(context["same_month"])
-        context["month_comparison_data"] = q._month_comparison_data(context["range_of_years"], context["same_month"].order_by("reporting_month"))
+        context["same_month"] = series._get_same_month(context["this_month"])
+        context["range_of_years"] = series._range_of_years(context["same_month"])
+        context["month_comparison_data"] = series._month_comparison_data(context["range_of_years"], list(reversed(context["same_month"])))
         context["month_comparison_length"] = len(context["range_of_years"])
-        context["yearly_comparison_data"] = q._new_yearly_data(context["range_of_years"], context["reports"])
+        context["yearly_comparison_data"] = series._new_yearly_data(self.comparison_years, context["reports"])
         context["enforcement_stats"] = WaterEnforcementMonthlyReport.objects.filter(supplier_slug=self.object.supplier_slug).order_by("-reporting_month")
         # context["april_7_tier"] = {
         #     "conservation_standard": self.object.april_7_reduction,
@@ -626,9 +638,9 @@ class SupplierDetailView(BuildableDetailView):
         #     "conservation_savings": self.object.june_11_estimated_savings,
         # }
 
-        reduction_period = context["reports"].filter(reporting_month__gte="2015-06-01").filter(reporting_month__lte="2016-05-30").order_by("reporting_month")
-        baseline_usage = reduction_period.values_list("calculated_production_monthly_gallons_month_2013", flat=True)
-        current_usage = reduction_period.values_list("calculated_production_monthly_gallons_month_2014", flat=True)
+        reduction_period = series._get_between(datetime.date(2015, 6, 1), datetime.date(2016, 5, 30))
+        baseline_usage = [report.calculated_production_monthly_gallons_month_2013 for report in reduction_period]
+        current_usage = [report.calculated_production_monthly_gallons_month_2014 for report in reduction_period]
         try:
             context["cumulative_calcs"] = q._create_cumulative_savings(current_usage, baseline_usage, self.object.june_11_reduction, self.object.supplier_slug)
         except:
@@ -720,10 +732,13 @@ class QueryUtilities(object):
             output.append(this_dict)
         return output
 
-    def _latest_month_latest_report(self, queryset):
+    def _latest_month_latest_report(self, queryset, release=None):
         """
         get the most recent month's data from the most recent report submitted to the state
+        pass a release from CurrentRelease to skip working out which rows those are
         """
+        if release is not None:
+            return queryset.filter(id__in=release["latest_month_ids"])
         latest_data = queryset.aggregate(Max("reporting_month"))
         latest_report_date = queryset.aggregate(Max("report_date"))
         target_report = datetime.date(latest_data["reporting_month__max"].year, latest_data["reporting_month__max"].month, latest_data["reporting_month__max"].day)
@@ -738,10 +753,12 @@ class QueryUtilities(object):
         output = queryset.filter(reporting_month__month=5).order_by("-reporting_month")
         return output
 
-    def _all_months_latest_report(self, queryset):
+    def _all_months_latest_report(self, queryset, release=None):
         """
         get the all the months of data from the most recent report submitted to the state
         """
+        if release is not None:
+            return queryset.filter(report_date = release["report_date"]).order_by("-reporting_month")
         latest_data = queryset.aggregate(Max("reporting_month"))
         latest_report_date = queryset.aggregate(Max("report_date"))
         target_report = datetime.date(latest_data["reporting_month__max"].year, latest_data["reporting_month__max"].month, latest_data["reporting_month__max"].day)
@@ -752,62 +769,57 @@ class QueryUtilities(object):
         """
         get the average residential gallons per capita per day for this last year for suppliers in a queryset
         """
-        residential_population = []
-        residential_gallons_used = []
-        days_in_month = calendar.monthrange(queryset[0].reporting_month.year, queryset[0].reporting_month.month)
-        for result in queryset:
-            residential_population.append(result.total_population_served)
-            if result.units.upper() == "G":
-                tmp = result.calculated_production_monthly_gallons_month_2014 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-            elif result.units.upper() == "MG":
-                tmp = result.calculated_production_monthly_gallons_month_2014 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-            elif result.units.upper() == "CCF":
-                tmp = result.calculated_production_monthly_gallons_month_2014 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-            elif result.units.upper() == "AF":
-                tmp = result.calculated_production_monthly_gallons_month_2014 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-            else:
-                tmp = result.calculated_production_monthly_gallons_month_2014 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-        res_gallons = int(sum(residential_gallons_used))
-        total_pop = int(sum(residential_population))
-        output = (res_gallons / total_pop) / days_in_month[1]
-        return output
+        return self._get_rgcpd_from(queryset, "residential_gallons_2014")
 
 
     def _get_last_year_avg_rgcpd(self, queryset):
         """
         get the average residential gallons per capita per day for last year for suppliers in a queryset
         """
-        residential_population = []
-        residential_gallons_used = []
-        days_in_month = calendar.monthrange(queryset[0].reporting_month.year, queryset[0].reporting_month.month)
-        for result in queryset:
-            residential_population.append(result.total_population_served)
-            if result.units.upper() == "G":
-                tmp = result.calculated_production_monthly_gallons_month_2013 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-            elif result.units.upper() == "MG":
-                tmp = result.calculated_production_monthly_gallons_month_2013 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-            elif result.units.upper() == "CCF":
-                tmp = result.calculated_production_monthly_gallons_month_2013 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-            elif result.units.upper() == "AF":
-                tmp = result.calculated_production_monthly_gallons_month_2013 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-            else:
-                tmp = result.calculated_production_monthly_gallons_month_2013 * result.percent_residential_use
-                residential_gallons_used.append(tmp)
-        res_gallons = int(sum(residential_gallons_used))
-        total_pop = int(sum(residential_population))
-        output = (res_gallons / total_pop) / days_in_month[1]
+        return self._get_rgcpd_from(queryset, "residential_gallons_2013")
+
+
+    def _get_rgcpd_from(self, queryset, residential_gallons_field):
+        """
+        sum the residential gallons and population stored at ingest in one query
+        every report in the queryset is for the same month so any row's days_in_month will do
+        """
+        totals = queryset.order_by().aggregate(
+            residential_gallons=Sum(residential_gallons_field),
+            total_population=Sum("total_population_served"),
+            days_in_month=Max("days_in_month"),
+        )
+        res_gallons = int(totals["residential_gallons"])
+        total_pop = int(totals["total_population"])
+        output = (res_gallons / total_pop) / totals["days_in_month"]
         return output
 
 
+    def _get_rgcpd_from_rows(self, rows, residential_gallons_field):
+        """
+        the same figure for rows already fetched, nulls are left out of each sum as the database does
+        """
+        res_gallons = int(sum(row[residential_gallons_field] for row in rows if row[residential_gallons_field] is not None))
+        total_pop = int(sum(row["total_population_served"] for row in rows if row["total_population_served"] is not None))
+        output = (res_gallons / total_pop) / max(row["days_in_month"] for row in rows)
+        return output
+
+
+    def _get_max_or_min_from(self, rows, field, function):
+        """
+        the max or min of a field across fetched rows ignoring nulls, None when there aren't any
+        """
+        values = [row[field] for row in rows if row[field] is not None]
+        return function(values) if values else None
+
+
+    def _order_rows_by(self, rows, field):
+        """
+        sort fetched rows by a field with nulls first as an order_by on the database would
+        """
+        return sorted(rows, key=lambda row: (row[field] is not None, row[field]))
+
+
     def calculate_production_threshold(self, reduction, amount):
         reduce_by = amount * reduction
         output = amount - reduce_by
@@ -890,3 +902,110 @@ class QueryUtilities(object):
                 cumulative_calcs["cum_output"] = "remained flat"
                 cumulative_calcs["cum_html"] = "<span style='color: red';>&#x2718;</span>"
         return cumulative_calcs
+
+
+class SupplierReportSeries(object):
+    """
+    one supplier's monthly reports held in memory and pivoted by month and year
+    a month revised by a later release is read from the newest release that reported it
+    """
+
+    queries = QueryUtilities()
+
+    # the year read from the baseline production columns rather than the reports of that year
+    # the views pass the first of their comparison years
+    baseline_year = 2013
+
+    def __init__(self, reports, baseline_year=None):
+        self.baseline_year = baseline_year or self.baseline_year
+        self.reports = []
+        self.by_month = {}
+        for report in reports:
+            if report.reporting_month not in self.by_month:
+                self.by_month[report.reporting_month] = report
+                self.reports.append(report)
+
+
+    def _get_same_month(self, month):
+        """
+        reports for one month of the year, newest first
+        """
+        return [report for report in self.reports if report.reporting_month.month == month]
+
+
+    def _get_between(self, first_month, last_month):
+        """
+        reports between two dates, oldest first
+        """
+        return [report for report in reversed(self.reports) if first_month <= report.reporting_month <= last_month]
+
+
+    def _range_of_years(self, reports):
+        """
+        the year before the earliest report through the year of the latest
+        """
+        years = [report.reporting_month.year for report in reports]
+        return range(min(years) - 1, max(years) + 1)
+
+
+    def _get_the_max(self, reports):
+        """
+        """
+        this_max = []
+        for field in ("calculated_production_monthly_gallons_month_2013", "calculated_production_monthly_gallons_month_2014"):
+            values = [getattr(report, field) for report in reports if getattr(report, field) is not None]
+            this_max.append(self.queries._millify(max(values) if values else None))
+        return max(this_max)
+
+
+    def _month_comparison_data(self, year_range, reports):
+        """
+        the use in one month of the year for each year in year_range, reports oldest first
+        the baseline year is read from the baseline columns of the oldest report
+        """
+        output = []
+        this_max = self._get_the_max(reports)
+        for year in year_range:
+            data_dict = {}
+            data_dict["year"] = year
+            if year == self.baseline_year:
+                data_dict["use"] = self.queries._millify(reports[0].calculated_production_monthly_gallons_month_2013)
+            else:
+                this = [report for report in reports if report.reporting_month.year == year]
+                if this:
+                    data_dict["use"] = self.queries._millify(this[0].calculated_production_monthly_gallons_month_2014)
+                else:
+                    data_dict["use"] = 0
+            data_dict["percent"] = (data_dict["use"] / this_max) * 100
+            output.append(data_dict)
+        return output
+
+
+    def _new_yearly_data(self, year_range, reports):
+        """
+        the use in each month of the year for each year in year_range, reports newest first
+        the baseline year is read from the baseline columns of the newest report for the month
+        """
+        output = []
+        month_range = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+        this_max = self._get_the_max(reports)
+        for month in month_range:
+            this_dict = {}
+            values = [report for report in reports if report.reporting_month.month == month]
+            this_dict["month"] = datetime.date(1900, month, 1).strftime("%B")
+            this_dict["data"] = []
+            for year in year_range:
+                data_dict = {}
+                data_dict["year"] = year
+                if year == self.baseline_year:
+                    data_dict["use"] = self.queries._millify(values[0].calculated_production_monthly_gallons_month_2013)
+                else:
+                    this = [report for report in values if report.reporting_month.year == year]
+                    if this:
+                        data_dict["use"] = self.queries._millify(this[0].calculated_production_monthly_gallons_month_2014)
+                    else:
+                        data_dict["use"] = 0
+                data_dict["percent"] = (data_dict["use"] / this_max) * 100
+                this_dict["data"].append(data_dict)
+            output.append(this_dict)
+        return output